@@ -94,7 +94,9 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated'
-    ]
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'helper.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
 SPECTACULAR_SETTINGS = {
@@ -104,6 +106,80 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
 }
 
+# Catalog cache entries are versioned and invalidated on every product change,
+# the timeout only bounds how long superseded generations linger in the cache.
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# Catalog pages are only cached for these page sizes, others are read from the database.
+CATALOG_CACHE_PAGE_SIZES = (10, 20, 50, 100)
+# Pages after the first are keyed by client cursors, they are only kept briefly.
+CATALOG_CACHE_SHORT_TIMEOUT = 60
+# Store a gzip encoded copy of the rendered catalog next to the plain body.
+CATALOG_CACHE_GZIP = True
+# Per-worker in-process catalog cache in front of the shared cache.
+CATALOG_L1_ENABLED = True
+CATALOG_L1_MAX_ENTRIES = 256
+# Upper bound on staleness should an invalidation message be missed.
+CATALOG_L1_TIMEOUT = 30
+# Statistics are cached for STATISTICS_CACHE_TIMEOUT seconds, then served stale
+# for up to STATISTICS_CACHE_STALE_TIMEOUT more while one worker recomputes them.
+STATISTICS_CACHE_TIMEOUT = 60
+STATISTICS_CACHE_STALE_TIMEOUT = 600
+# Rows validated and written per bulk statement by the product importer.
+PRODUCT_IMPORT_CHUNK_SIZE = 500
+# Where carts are stored, order.cart.DatabaseCartBackend or order.cart.RedisCartBackend.
+CART_BACKEND = 'order.cart.DatabaseCartBackend'
+# Seconds of inactivity after which a cart is abandoned: Redis carts expire,
+# database carts are deleted by the cleanup_carts command or job.
+CART_TIMEOUT = 60 * 60 * 24 * 30
+# Seconds a checkout holds a Redis cart's lock at most, and waits for it.
+CART_LOCK_TIMEOUT = 10
+CART_CLEANUP_BATCH_SIZE = 1000
+# Seconds between two runs of the scheduled cleanup job.
+CART_CLEANUP_INTERVAL = 60 * 60
+# Order numbers reserved per process at once where no sequence is available (hi/lo).
+ORDER_NUMBER_BLOCK_SIZE = 100
+# Responses to requests sent with an Idempotency-Key are replayed for this many seconds.
+IDEMPOTENCY_KEY_TIMEOUT = 60 * 60 * 24
+# How long a duplicate waits for the first request, also the lock expiry should it crash.
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+# Queued checkout: create-order only enqueues the checkout and answers 202, the orders
+# are written in batches by the consume_checkouts command. Best with the Redis cart backend.
+CHECKOUT_QUEUED = False
+CHECKOUT_BATCH_SIZE = 200
+# How long the status of a queued checkout can be polled.
+CHECKOUT_TICKET_TIMEOUT = 60 * 60
+# Stock reservations in Redis for the products with a Stock row, see order.stock.
+STOCK_TRACKING = False
+# Seconds a cart's reserved units are kept after its last addition.
+STOCK_RESERVATION_TIMEOUT = 15 * 60
+# Seconds between two runs of the scheduled reconcile_stock job.
+STOCK_RECONCILE_INTERVAL = 60
+STOCK_RECONCILE_BATCH_SIZE = 1000
+# RQ queue payment jobs are sent to, executed by the run_payment_executor command.
+PAYMENT_QUEUE = 'payments'
+# Payments in flight at once per executor process, bounded by the gateway rather than by CPU.
+PAYMENT_CONCURRENCY = 200
+# Seconds payment jobs are kept in Redis once done: results are not read, 0 deletes them
+# right away; failures are kept for inspection and requeueing.
+PAYMENT_RESULT_TTL = 0
+PAYMENT_FAILURE_TTL = 60 * 60 * 24 * 7
+# Seconds before each retry of a failed payment job, e.g. the gateway was unreachable.
+# The payment stays PENDING meanwhile, once they are used up the job is left failed.
+PAYMENT_RETRY_INTERVALS = [10, 60, 300, 1800]
+# Payment jobs are queued from the outbox table by the relay_payments command.
+PAYMENT_OUTBOX_BATCH_SIZE = 500
+# Seconds between two polls of an empty outbox, the worst added dispatch latency.
+PAYMENT_OUTBOX_POLL_INTERVAL = 0.5
+# Payment gateway adapter and its constructor arguments, see payment.gateway. E.g.
+# 'payment.gateway.HttpGateway' with {'url': 'http://127.0.0.1:8100/', 'read_timeout': 15}
+# charges through the run_stub_gateway command.
+PAYMENT_GATEWAY = 'payment.gateway.SimulatedGateway'
+PAYMENT_GATEWAY_OPTIONS = {}
+# The executor charges payments in batches of up to PAYMENT_BATCH_SIZE, waiting at most
+# PAYMENT_BATCH_WAIT seconds for a batch to fill. A size of 1 charges them one by one.
+PAYMENT_BATCH_SIZE = 50
+PAYMENT_BATCH_WAIT = 0.05
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
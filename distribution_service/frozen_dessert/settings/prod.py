@@ -28,9 +28,20 @@ CACHES = {
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
+    },
+    # Used by {% cache %}, fragments are keyed by row version so a per-process cache needs no invalidation.
+    "template_fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "template_fragments",
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+        }
     }
 }
 
+CART_BACKEND = 'order.cart.RedisCartBackend'
+STOCK_TRACKING = True
+
 RQ_QUEUES = {
     "default": {
         "HOST": "localhost",
@@ -39,4 +50,11 @@ RQ_QUEUES = {
         "DEFAULT_TIMEOUT": 360,
         'USE_REDIS_CACHE': 'default',
     },
+    "payments": {
+        "HOST": "localhost",
+        "PORT": 6379,
+        "DB": 0,
+        "DEFAULT_TIMEOUT": 360,
+        'USE_REDIS_CACHE': 'default',
+    },
 }
@@ -0,0 +1,79 @@
+from django.core.cache import caches
+import logging
+import math
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# How often a worker waiting on another worker's rebuild checks for the result.
+POLL_INTERVAL = 0.05
+
+
+def _safe(operation, *args, **kwargs):
+    # The cache is an optimization, when it is unreachable we compute instead of failing.
+    try:
+        return operation(*args, **kwargs)
+    except Exception as e:
+        logger.warning(f"Cache unavailable for {args[0]}: {e!r}")
+        return None
+
+
+def get_or_set(key, build, timeout, stale_timeout=0, lock_timeout=10, beta=1.0, alias='default',
+               cacheable=None):
+    """
+    Read-through cache protected against stampedes.
+
+    - Single flight: only the worker holding the key's lock (cache.add, SET NX on Redis)
+      runs build(), the others serve the current value or wait for the new one.
+    - Probabilistic early refresh (XFetch): the closer an entry is to expiry and the
+      slower it was to build, the likelier a request refreshes it ahead of time.
+      beta > 1 favours earlier refreshes, 0 disables them.
+    - Stale-while-revalidate: entries are kept stale_timeout seconds past freshness,
+      served while one worker rebuilds, and when build() raises (e.g. database down).
+    - cacheable(value), when given, returning False keeps a built value out of the cache.
+
+    Returns the cached or freshly built value.
+    """
+    cache = caches[alias]
+    lock_key = f'{key}:lock'
+
+    entry = _safe(cache.get, key)
+    if entry is not None:
+        value, fresh_until, delta = entry
+        # 1 - random() is in (0, 1], log() of it is <= 0
+        if time.time() - delta * beta * math.log(1 - random.random()) < fresh_until:
+            return value
+        if not _safe(cache.add, lock_key, 1, lock_timeout):
+            return value
+        try:
+            return _build(cache, key, build, timeout, stale_timeout, cacheable)
+        except Exception as e:
+            logger.warning(f"Rebuilding {key} failed, serving stale value: {e}")
+            return value
+        finally:
+            _safe(cache.delete, lock_key)
+
+    if _safe(cache.add, lock_key, 1, lock_timeout) is False:
+        # Another worker is building, wait for it rather than piling onto the database.
+        deadline = time.time() + lock_timeout
+        while time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = _safe(cache.get, key)
+            if entry is not None:
+                return entry[0]
+    try:
+        return _build(cache, key, build, timeout, stale_timeout, cacheable)
+    finally:
+        _safe(cache.delete, lock_key)
+
+
+def _build(cache, key, build, timeout, stale_timeout, cacheable=None):
+    start = time.time()
+    value = build()
+    delta = time.time() - start
+    if cacheable is not None and not cacheable(value):
+        return value
+    _safe(cache.set, key, (value, start + delta + timeout, delta),
+          timeout + stale_timeout)
+    return value
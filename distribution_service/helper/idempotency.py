@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.core.cache import cache
+from drf_spectacular.utils import OpenApiParameter
+from functools import wraps
+from rest_framework import status
+from rest_framework.response import Response
+import hashlib
+import json
+import logging
+import time
+
+from helper.cache import POLL_INTERVAL, _safe
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Response headers stored with the response and sent again on replay
+REPLAYED_HEADERS = ('Location', 'Content-Type')
+
+IDEMPOTENCY_KEY_PARAMETER = OpenApiParameter(
+    IDEMPOTENCY_HEADER, str, OpenApiParameter.HEADER, required=False,
+    description="Unique client generated key, retries with the same key replay the first response "
+                "instead of repeating the operation.")
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path} {body}'.encode()).hexdigest()
+
+
+def _stored_headers(response):
+    headers = {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)}
+    # A DRF Response only sets Content-Type when rendered, from its content_type
+    if getattr(response, 'content_type', None):
+        headers['Content-Type'] = response.content_type
+    return headers
+
+
+def _replay(request, stored):
+    if stored['fingerprint'] != _fingerprint(request):
+        return Response({"detail": f"{IDEMPOTENCY_HEADER} was already used for a different request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    headers = dict(stored.get('headers', {}))
+    response = Response(stored['data'], status=stored['status'],
+                        content_type=headers.pop('Content-Type', None), headers=headers)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+        Makes a DRF function view honour the Idempotency-Key request header,
+        apply it below @api_view. Without the header the view runs as usual.
+
+        The first response for a user and key, with its REPLAYED_HEADERS, is stored for
+        IDEMPOTENCY_KEY_TIMEOUT seconds and replayed to retries, marked with an
+        Idempotent-Replayed header.
+        While it runs, duplicates wait for its response up to IDEMPOTENCY_LOCK_TIMEOUT
+        seconds, then get a 409. Server errors are not stored, the next retry runs the view.
+        Reusing a key for a different request is rejected with a 422.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            return view(request, *args, **kwargs)
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            return Response({"detail": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        key_hash = hashlib.sha256(idempotency_key.encode()).hexdigest()
+        key = f'idempotency:{request.user.pk}:{view.__name__}:{key_hash}'
+        lock_key = f'{key}:lock'
+        lock_timeout = settings.IDEMPOTENCY_LOCK_TIMEOUT
+
+        deadline = time.time() + lock_timeout
+        while True:
+            stored = _safe(cache.get, key)
+            locked = None
+            if stored is None:
+                # None when the cache is unavailable, the view then runs unprotected
+                locked = _safe(cache.add, lock_key, 1, lock_timeout)
+                if locked:
+                    # The first request may have stored its response and let go of the
+                    # lock between the read above and the add
+                    stored = _safe(cache.get, key)
+                    if stored is not None:
+                        _safe(cache.delete, lock_key)
+            if stored is not None:
+                logger.info(f"Replaying {view.__name__} response for {IDEMPOTENCY_HEADER} {idempotency_key}")
+                return _replay(request, stored)
+            if locked is not False:
+                break
+            if time.time() >= deadline:
+                return Response({"detail": f"A request with this {IDEMPOTENCY_HEADER} is still in progress."},
+                                status=status.HTTP_409_CONFLICT)
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            response = view(request, *args, **kwargs)
+            if response.status_code < 500:
+                _safe(cache.set, key, {'fingerprint': _fingerprint(request),
+                                       'status': response.status_code,
+                                       'data': response.data,
+                                       'headers': _stored_headers(response)},
+                      settings.IDEMPOTENCY_KEY_TIMEOUT)
+            return response
+        finally:
+            if locked:
+                _safe(cache.delete, lock_key)
+
+    return wrapper
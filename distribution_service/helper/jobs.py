@@ -0,0 +1,25 @@
+from datetime import timedelta
+from rq.job import Job
+import django_rq
+
+
+def schedule_job(func, delay, queue='default'):
+    """
+        Enqueues func to run delay seconds from now.
+        Needs a worker started with --with-scheduler.
+    """
+    return django_rq.get_queue(queue).enqueue_in(timedelta(seconds=delay), func)
+
+
+def restart_job(func, queue='default'):
+    """
+        Starts a self rescheduling job now, replacing any pending run of func
+        so that calling it again never starts a second chain.
+    """
+    rq_queue = django_rq.get_queue(queue)
+    registry = rq_queue.scheduled_job_registry
+    func_name = f'{func.__module__}.{func.__qualname__}'
+    for job in Job.fetch_many(registry.get_job_ids(), connection=rq_queue.connection):
+        if job is not None and job.func_name == func_name:
+            registry.remove(job, delete_job=True)
+    return schedule_job(func, 0, queue)
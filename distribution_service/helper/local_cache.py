@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from django_redis import get_redis_connection
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """
+    Bounded, thread-safe in-process LRU cache with a per-entry TTL.
+    Values are kept as is (no pickling), callers must treat them as immutable.
+    Every clear() starts a new generation: a value computed from data read
+    before a clear is dropped by set() instead of being cached.
+    """
+
+    def __init__(self, max_entries=256, timeout=30):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class InvalidationListener:
+    """
+    Clears a LocalCache whenever a message is published on a Redis channel,
+    so that every worker process on every node drops its copy together.
+    The listener runs in a daemon thread started lazily, and restarted after a fork.
+    While it is not subscribed the local cache must not be trusted, see is_ready().
+    """
+
+    def __init__(self, local_cache, channel, alias='default'):
+        self.local_cache = local_cache
+        self.channel = channel
+        self.alias = alias
+        self._pid = None
+        self._run = 0
+        self._supported = True
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        Forgets the listener state, the next is_ready() call starts over,
+        e.g. after the cache settings changed.
+        """
+        with self._lock:
+            self._pid = None
+            self._run += 1
+            self._supported = True
+            self._ready.clear()
+
+    def publish(self, message=''):
+        if not self._supported:
+            return
+        try:
+            get_redis_connection(self.alias).publish(self.channel, message)
+        except NotImplementedError:
+            self._supported = False
+
+    def is_ready(self):
+        """
+        Whether the local cache can be used, starting the listener if needed.
+        Without a Redis backend there is nothing to listen to and only
+        in-process invalidation applies.
+        """
+        if self._pid != os.getpid():
+            self._start()
+        return not self._supported or self._ready.is_set()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            try:
+                get_redis_connection(self.alias)
+            except NotImplementedError:
+                self._supported = False
+            else:
+                self._run += 1
+                self._ready.clear()
+                threading.Thread(target=self._listen, args=(self._run,), daemon=True,
+                                 name=f'invalidation-listener:{self.channel}').start()
+            self._pid = os.getpid()
+
+    def _listen(self, run):
+        # A reset or restart supersedes this thread, it then exits.
+        while run == self._run:
+            try:
+                pubsub = get_redis_connection(self.alias).pubsub(
+                    ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published while we were not subscribed is lost.
+                self.local_cache.clear()
+                self._ready.set()
+                for _ in pubsub.listen():
+                    if run != self._run:
+                        break
+                    self.local_cache.clear()
+                pubsub.close()
+            except Exception as e:
+                if run != self._run:
+                    break
+                self._ready.clear()
+                self.local_cache.clear()
+                logger.warning(
+                    f"Invalidation listener on {self.channel} disconnected: {e}")
+                time.sleep(1)
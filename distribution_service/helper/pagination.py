@@ -0,0 +1,134 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from drf_spectacular.utils import inline_serializer
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.serializers import CharField
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination on (created_at, id), the columns every model
+    gets from helper.model.Meta. Each page is a single indexed range scan
+    bounded by the page size, so it costs the same however deep it is.
+    The cursor is the opaque position of the last row of the previous page.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, descending=True):
+        self.descending = descending
+        self.next_cursor = None
+        self.request = None
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request):
+        """
+        Returns the (created_at, id) position encoded in the request cursor, or None.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            created_at, pk = urlsafe_b64decode(
+                encoded.encode('ascii')).decode('ascii').split('|')
+            return datetime.fromisoformat(created_at), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        created_at, pk = position
+        return urlsafe_b64encode(
+            f'{created_at.isoformat()}|{pk}'.encode('ascii')).decode('ascii')
+
+    def get_cache_key_parts(self, request):
+        """
+        Normalized page parameters, for caching rendered pages.
+        """
+        position = self.decode_cursor(request)
+        cursor = self.encode_cursor(position) if position else ''
+        return request.get_host(), cursor, self.get_page_size(request)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        if self.descending:
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            queryset = queryset.order_by('created_at', 'id')
+
+        if position is not None:
+            created_at, pk = position
+            if self.descending:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+
+        # One extra row tells whether a next page exists without a COUNT.
+        results = list(queryset[:page_size + 1])
+        if len(results) > page_size:
+            results = results[:page_size]
+            last = results[-1]
+            self.next_cursor = self.encode_cursor((last.created_at, last.id))
+        else:
+            self.next_cursor = None
+        return results
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+
+def paginated(serializer_class):
+    """
+    Schema helper for function views, describes a KeysetPagination page of serializer_class.
+    """
+    return inline_serializer(
+        name=f'Paginated{serializer_class.__name__}',
+        fields={
+            'next': CharField(allow_null=True),
+            'results': serializer_class(many=True),
+        },
+    )
@@ -0,0 +1,93 @@
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.regex_helper import _lazy_re_compile
+from rest_framework.renderers import JSONRenderer
+import gzip
+import hashlib
+import time
+
+re_accepts_gzip = _lazy_re_compile(r"\bgzip\b")
+
+# Below this size gzip framing costs more than it saves.
+GZIP_MIN_LENGTH = 200
+
+
+def render_payload(data, compress=True, last_modified=None):
+    """
+        Renders serialized data to JSON once and returns a cacheable payload:
+        the body bytes, its gzip encoding (or None), a sha256 of the body and
+        last_modified, the unix time the data last changed, used as Last-Modified.
+        It defaults to the render time.
+    """
+    body = JSONRenderer().render(data)
+    compressed = None
+    if compress and len(body) >= GZIP_MIN_LENGTH:
+        compressed = gzip.compress(body, mtime=0)
+    return {
+        'body': body,
+        'gzip': compressed,
+        'hash': hashlib.sha256(body).hexdigest(),
+        'last_modified': int(time.time() if last_modified is None else last_modified),
+    }
+
+
+def settled_last_modified(last_modified):
+    """
+        Returns last_modified, a unix timestamp, once its second is over, None before:
+        another change within that second would carry the same date and a client
+        holding the older body would be answered 304 to If-Modified-Since.
+    """
+    last_modified = int(last_modified)
+    return last_modified if last_modified < int(time.time()) else None
+
+
+def set_validators(response, etag, last_modified=None):
+    """
+        Sets the ETag and, when given, the Last-Modified header on a response.
+        last_modified is a unix timestamp.
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def not_modified_response(request, etag, last_modified=None):
+    """
+        Returns a 304 response carrying the validators when the request's
+        If-None-Match/If-Modified-Since headers match, otherwise None.
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def payload_response(request, payload, status=200):
+    """
+        Builds a JSON response straight from a rendered payload,
+        serving the gzip body to clients that accept it.
+        Conditional requests matching the payload's ETag or Last-Modified get a 304,
+        Last-Modified is left out until its second is over (see settled_last_modified).
+    """
+    accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    gzipped = payload['gzip'] is not None and re_accepts_gzip.search(accept_encoding)
+    # Each encoding is a distinct representation and needs its own strong ETag.
+    etag = f'"{payload["hash"]}-gzip"' if gzipped else f'"{payload["hash"]}"'
+    last_modified = settled_last_modified(payload['last_modified'])
+
+    response = None
+    if status == 200:
+        response = not_modified_response(request, etag, last_modified)
+    if response is None:
+        response = HttpResponse(content_type='application/json', status=status)
+        if gzipped:
+            response.content = payload['gzip']
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response.content = payload['body']
+        set_validators(response, etag, last_modified)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,172 @@
+from django.core.cache import cache, caches
+from django.test import SimpleTestCase, override_settings
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from unittest import mock
+
+from helper.cache import get_or_set
+from helper.idempotency import idempotent
+from helper.local_cache import LocalCache
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class LocalCacheTestCase(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        local_cache = LocalCache(max_entries=2, timeout=60)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+        local_cache.get('a')
+        local_cache.set('c', 3)
+
+        self.assertEqual(local_cache.get('a'), 1)
+        self.assertIsNone(local_cache.get('b'))
+        self.assertEqual(local_cache.get('c'), 3)
+
+    def test_entries_expire(self):
+        local_cache = LocalCache(max_entries=2, timeout=10)
+        with mock.patch('helper.local_cache.time.monotonic', return_value=100):
+            local_cache.set('a', 1)
+        with mock.patch('helper.local_cache.time.monotonic', return_value=111):
+            self.assertIsNone(local_cache.get('a'))
+
+    def test_value_from_previous_generation_is_dropped(self):
+        local_cache = LocalCache()
+        generation = local_cache.generation
+        local_cache.clear()
+        local_cache.set('a', 1, generation=generation)
+
+        self.assertIsNone(local_cache.get('a'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GetOrSetTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.build = mock.Mock(return_value='fresh')
+
+    def test_builds_once(self):
+        self.assertEqual(get_or_set('key', self.build, timeout=60), 'fresh')
+        self.assertEqual(get_or_set('key', self.build, timeout=60), 'fresh')
+        self.build.assert_called_once()
+
+    def test_stale_value_served_when_rebuild_fails(self):
+        cache.set('key', ('stale', 0, 0.1), 60)
+        self.build.side_effect = RuntimeError('database unavailable')
+        self.assertEqual(get_or_set('key', self.build,
+                         timeout=60, stale_timeout=60), 'stale')
+
+    def test_stale_value_served_while_another_worker_rebuilds(self):
+        cache.set('key', ('stale', 0, 0.1), 60)
+        cache.add('key:lock', 1)
+        self.assertEqual(get_or_set('key', self.build, timeout=60), 'stale')
+        self.build.assert_not_called()
+
+    def test_expired_value_rebuilt_by_lock_holder(self):
+        cache.set('key', ('stale', 0, 0.1), 60)
+        self.assertEqual(get_or_set('key', self.build, timeout=60), 'fresh')
+        self.assertIsNone(cache.get('key:lock'))
+
+    def test_miss_waits_for_another_worker(self):
+        cache.add('key:lock', 1)
+
+        def other_worker_finishes(seconds):
+            cache.set('key', ('built elsewhere', 2 ** 40, 0.1), 60)
+
+        with mock.patch('helper.cache.time.sleep', side_effect=other_worker_finishes):
+            self.assertEqual(get_or_set('key', self.build,
+                             timeout=60), 'built elsewhere')
+        self.build.assert_not_called()
+
+    def test_uncacheable_value_not_stored(self):
+        self.assertEqual(get_or_set('key', self.build, timeout=60, cacheable=bool), 'fresh')
+        self.build.return_value = ''
+        self.assertEqual(get_or_set('other', self.build, timeout=60, cacheable=bool), '')
+        self.assertIsNotNone(cache.get('key'))
+        self.assertIsNone(cache.get('other'))
+
+    def test_unreachable_cache_falls_back_to_build(self):
+        with mock.patch.object(caches['default'], 'get', side_effect=ConnectionError):
+            self.assertEqual(get_or_set('key', self.build, timeout=60), 'fresh')
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@idempotent
+def idempotent_view(request):
+    idempotent_view.calls += 1
+    if request.data.get('fail'):
+        return Response({"detail": "failed"}, status=500)
+    return Response({"call": idempotent_view.calls}, status=201,
+                    headers={'Location': f'/orders/{idempotent_view.calls}/'})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IdempotentTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        idempotent_view.calls = 0
+        self.factory = APIRequestFactory()
+
+    def post(self, data, key='key-1'):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return idempotent_view(self.factory.post('/orders/', data, format='json', **headers))
+
+    def test_retry_replays_first_response(self):
+        first = self.post({'a': 1})
+        retry = self.post({'a': 1})
+        self.assertEqual(idempotent_view.calls, 1)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_without_key_view_always_runs(self):
+        self.post({'a': 1}, key=None)
+        self.post({'a': 1}, key=None)
+        self.assertEqual(idempotent_view.calls, 2)
+
+    def test_key_reused_for_different_request(self):
+        self.post({'a': 1})
+        self.assertEqual(self.post({'a': 2}).status_code, 422)
+
+    def test_server_errors_are_not_stored(self):
+        self.post({'fail': True})
+        self.post({'fail': True})
+        self.assertEqual(idempotent_view.calls, 2)
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT=0.1)
+    def test_request_in_progress(self):
+        with mock.patch('helper.idempotency.cache.add', return_value=False):
+            response = self.post({'a': 1})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(idempotent_view.calls, 0)
+
+    def test_replay_keeps_headers(self):
+        first = self.post({'a': 1})
+        retry = self.post({'a': 1})
+        self.assertEqual(retry['Location'], first['Location'])
+
+    def test_response_stored_between_read_and_lock(self):
+        first = self.post({'a': 1})
+        get = cache.get
+        reads = []
+
+        def first_read_misses(*args, **kwargs):
+            # As if the first request stored its response and let go of the lock
+            # right after this one looked for it
+            reads.append(args)
+            return None if len(reads) == 1 else get(*args, **kwargs)
+
+        with mock.patch('helper.idempotency.cache.get', side_effect=first_read_misses):
+            retry = self.post({'a': 1})
+        self.assertEqual(idempotent_view.calls, 1)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        # The lock taken meanwhile was let go
+        self.assertTrue(cache.add(f'{reads[0][0]}:lock', 1))
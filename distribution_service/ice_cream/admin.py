@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from ice_cream.models import IceCreamItem, IceCream
+from ice_cream.models import IceCreamItem, IceCream, Stock
 
 admin.site.register(IceCream)
 admin.site.register(IceCreamItem)
+admin.site.register(Stock)
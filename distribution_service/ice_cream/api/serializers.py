@@ -1,4 +1,5 @@
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import ModelSerializer, Serializer, CharField, DecimalField, IntegerField, \
+    DictField, ListField, ValidationError
 
 from ice_cream.models import IceCreamItem, IceCream
 
@@ -23,3 +24,77 @@ class IceCreamItemSerializer(ModelSerializer):
     class Meta:
         model = IceCreamItem
         fields = ['id', 'quantity', 'ice_cream', 'created_at']
+
+
+class ProductSearchSerializer(Serializer):
+    flavor = CharField(required=False, max_length=100,
+                       help_text="Exact flavor.")
+    min_price = DecimalField(required=False, max_digits=5, decimal_places=2,
+                             help_text="Minimum price, inclusive.")
+    max_price = DecimalField(required=False, max_digits=5, decimal_places=2,
+                             help_text="Maximum price, inclusive.")
+    q = CharField(required=False, max_length=200,
+                  help_text="Free text matched against title and description.")
+
+    def validate_q(self, value):
+        # Normalized, equivalent queries share one cached search
+        return ' '.join(value.casefold().split())
+
+    def validate(self, data):
+        min_price, max_price = data.get('min_price'), data.get('max_price')
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise ValidationError("min_price must not be greater than max_price.")
+        return data
+
+
+class ProductImportErrorSerializer(Serializer):
+    line = IntegerField(help_text="Line number of the rejected row.")
+    errors = DictField(help_text="Validation errors by field.")
+
+
+class ProductImportReportSerializer(Serializer):
+    created = IntegerField(help_text="Number of products created.")
+    updated = IntegerField(help_text="Number of existing products updated.")
+    errors = ProductImportErrorSerializer(many=True)
+
+
+class ProductBulkSelectionSerializer(Serializer):
+    ids = ListField(child=IntegerField(), required=False, allow_empty=False,
+                    help_text="Ids of the products to act on.")
+    filter = ProductSearchSerializer(required=False,
+                                     help_text="Act on every product matching these search filters, {} matches all.")
+
+    def validate(self, data):
+        if ('ids' in data) == ('filter' in data):
+            raise ValidationError("Provide exactly one of ids or filter.")
+        return data
+
+
+class ProductBulkUpdateSerializer(ProductBulkSelectionSerializer):
+    price = DecimalField(required=False, max_digits=5, decimal_places=2, min_value=0.01,
+                         help_text="New price.")
+    price_delta = DecimalField(required=False, max_digits=5, decimal_places=2,
+                               help_text="Amount added to the current price, can be negative.")
+    price_percent = DecimalField(required=False, max_digits=5, decimal_places=2, min_value=-99,
+                                 help_text="Percentage applied to the current price, 5 for +5%.")
+    flavor = CharField(required=False, max_length=100)
+    description = CharField(required=False, max_length=500)
+
+    def validate(self, data):
+        data = super().validate(data)
+        price_changes = [field for field in (
+            'price', 'price_delta', 'price_percent') if field in data]
+        if len(price_changes) > 1:
+            raise ValidationError(
+                "Provide only one of price, price_delta or price_percent.")
+        if not price_changes and 'flavor' not in data and 'description' not in data:
+            raise ValidationError("Nothing to update.")
+        return data
+
+
+class ProductBulkUpdateResultSerializer(Serializer):
+    updated = IntegerField(help_text="Number of products updated.")
+
+
+class ProductBulkDeleteResultSerializer(Serializer):
+    deleted = IntegerField(help_text="Number of products deleted.")
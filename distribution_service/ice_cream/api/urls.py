@@ -1,12 +1,17 @@
 from django.urls import path
 
-from ice_cream.api.views import get_all_products, create_product, delete_product, update_product
+from ice_cream.api.views import get_all_products, search_products, create_product, delete_product, update_product, \
+    import_products, bulk_update_products, bulk_delete_products
 
 urlpatterns = [
     path('all-products/', get_all_products, name='all_products'),
+    path('search/', search_products, name='search_products'),
     path('create-product/', create_product, name='create_product'),
     path('delete-product/<int:product_id>/',
          delete_product, name='delete_product'),
     path('update-product/<int:product_id>/',
          update_product, name='update_product'),
+    path('import-products/', import_products, name='import_products'),
+    path('bulk-update/', bulk_update_products, name='bulk_update_products'),
+    path('bulk-delete/', bulk_delete_products, name='bulk_delete_products'),
 ]
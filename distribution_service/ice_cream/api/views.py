@@ -3,37 +3,77 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAdminUser
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import F, Max, Min
+from django.db.models.functions import Round
+from django.utils import timezone
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema
 
-from django.core.cache import cache
+from decimal import Decimal
+import codecs
 import logging
 
-from ice_cream.api.serializers import IceCreamSerializer, IceCreamRequestSerializer
+from helper.pagination import paginated
+from helper.payload import payload_response
+from ice_cream.api.serializers import IceCreamSerializer, IceCreamRequestSerializer, ProductSearchSerializer, \
+    ProductImportReportSerializer, ProductBulkSelectionSerializer, ProductBulkUpdateSerializer, \
+    ProductBulkUpdateResultSerializer, ProductBulkDeleteResultSerializer
+from ice_cream.cache import get_catalog_payload, get_search_payload, invalidate_catalog, single_invalidation
+from ice_cream.importer import iter_rows, import_products as run_import, CSV, JSON_LINES
 from ice_cream.models import IceCream
+from ice_cream.search import search_products as filter_products
 
 logger = logging.getLogger(__name__)
 
+# Bounds of IceCream.price, DecimalField(max_digits=5, decimal_places=2) with MinValueValidator(0.01)
+MIN_PRICE = Decimal('0.01')
+MAX_PRICE = Decimal('999.99')
+
+
+def _select_products(data):
+    if 'ids' in data:
+        return IceCream.objects.filter(id__in=data['ids'])
+    return filter_products(**data['filter'])
+
 
 @extend_schema(
     request=None,
-    responses={status.HTTP_200_OK: IceCreamSerializer(many=True)},
+    responses={status.HTTP_200_OK: paginated(IceCreamSerializer)},
 )
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_all_products(request):
     """
-        Returns all saved products,
+        Returns all saved products, a page at a time,
+        follow the "next" link (cursor) for the following page, page_size is optional.
         Authentication not required.
+        The rendered response body is cached, gzip encoded when the client accepts it.
     """
+    payload = get_catalog_payload(request)
 
-    products = cache.get('ice_cream_products')
-    if not products:
-        products = IceCream.objects.all()
-        cache.set('ice_cream_products', products,
-                  timeout=3600)
-    serializer = IceCreamSerializer(products, many=True)
+    return payload_response(request, payload)
 
-    return Response(serializer.data)
+
+@extend_schema(
+    request=None,
+    parameters=[ProductSearchSerializer],
+    responses={status.HTTP_200_OK: paginated(IceCreamSerializer)},
+)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def search_products(request):
+    """
+        Search products by flavor, price range and free text (q) over title and description.
+        All filters are optional and combined, results are paginated like all-products.
+        Authentication not required.
+    """
+    serializer = ProductSearchSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    payload = get_search_payload(request, serializer.validated_data)
+
+    return payload_response(request, payload)
 
 
 @extend_schema(
@@ -103,3 +143,104 @@ def update_product(request, product_id):
         return Response(serializer.data)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@extend_schema(
+    request={'application/x-ndjson': OpenApiTypes.STR,
+             'text/csv': OpenApiTypes.STR},
+    responses={status.HTTP_200_OK: ProductImportReportSerializer},
+)
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def import_products(request):
+    """
+        Bulk create or update products, only admin user is allowed to perform this action.
+        The body is streamed, either JSON Lines (application/x-ndjson) or CSV (text/csv) with a header row,
+        each row holding title, flavor, description and price.
+        Products are matched on title and flavor, existing ones get their description and price updated.
+        Invalid rows are reported by line number and skipped.
+    """
+    fmt = CSV if request.content_type.startswith('text/csv') else JSON_LINES
+    lines = codecs.iterdecode(request.stream or [], 'utf-8-sig')
+    report = run_import(iter_rows(lines, fmt))
+    logger.info(
+        f"Products imported by {request.user.username}: {report['created']} created, {report['updated']} updated")
+
+    return Response(report)
+
+
+@extend_schema(
+    request=ProductBulkUpdateSerializer,
+    responses={status.HTTP_200_OK: ProductBulkUpdateResultSerializer},
+)
+@api_view(['PATCH'])
+@permission_classes([IsAdminUser])
+def bulk_update_products(request):
+    """
+        Update many products with a single UPDATE statement, only admin user is allowed to perform this action.
+        Select products with either "ids" or "filter" (same filters as search, {} selects all).
+        Request body, e.g. all vanilla products +5%:
+        {
+        "filter": {"flavor": "vanilla"},
+        "price_percent": "5"
+        }
+        Use one of price, price_delta or price_percent, flavor and description can be set too.
+        Returns the number of updated products.
+    """
+    serializer = ProductBulkUpdateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+    products = _select_products(data)
+
+    changes = {field: data[field]
+               for field in ('price', 'flavor', 'description') if field in data}
+    price = None
+    if 'price_delta' in data:
+        price = F('price') + data['price_delta']
+    elif 'price_percent' in data:
+        price = Round(F('price') * (1 + data['price_percent'] / 100), 2)
+    # update() bypasses auto_now
+    changes['updated_at'] = timezone.now()
+
+    with transaction.atomic():
+        if price is not None:
+            # Locks the selected rows first, the prices checked are the prices updated
+            products = IceCream.objects.filter(
+                id__in=list(products.select_for_update().values_list('id', flat=True)))
+            bounds = products.aggregate(low=Min(price), high=Max(price))
+            if bounds['low'] is not None and (bounds['low'] < MIN_PRICE or bounds['high'] > MAX_PRICE):
+                return Response({"price": [f"Resulting prices must be between {MIN_PRICE} and {MAX_PRICE}."]},
+                                status=status.HTTP_400_BAD_REQUEST)
+            changes['price'] = price
+        updated = products.update(**changes)
+        if updated:
+            invalidate_catalog()
+    logger.info(f"{updated} products have been bulk updated")
+
+    return Response({"updated": updated})
+
+
+@extend_schema(
+    request=ProductBulkSelectionSerializer,
+    responses={status.HTTP_200_OK: ProductBulkDeleteResultSerializer},
+)
+@api_view(['DELETE'])
+@permission_classes([IsAdminUser])
+def bulk_delete_products(request):
+    """
+        Delete many products at once, only admin user is allowed to perform this action.
+        Select products with either "ids" or "filter" (same filters as search, {} selects all).
+        Returns the number of deleted products.
+    """
+    serializer = ProductBulkSelectionSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    products = _select_products(serializer.validated_data)
+
+    with transaction.atomic(), single_invalidation():
+        _, per_model = products.delete()
+    deleted = per_model.get(IceCream._meta.label, 0)
+    logger.info(f"{deleted} products have been bulk deleted")
+
+    return Response({"deleted": deleted})
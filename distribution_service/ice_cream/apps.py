@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class IceCreamConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ice_cream'
+
+    def ready(self):
+        import ice_cream.signals  # noqa: F401
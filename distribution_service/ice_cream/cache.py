@@ -0,0 +1,239 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from helper.cache import get_or_set
+from helper.local_cache import LocalCache, InvalidationListener
+from helper.pagination import KeysetPagination
+from helper.payload import render_payload
+from ice_cream.api.serializers import IceCreamSerializer
+from ice_cream.models import IceCream
+from ice_cream.search import search_products, is_plain_query
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_KEY = 'ice_cream_products'
+CATALOG_VERSION_KEY = f'{CATALOG_CACHE_KEY}:version'
+CATALOG_MODIFIED_KEY = f'{CATALOG_CACHE_KEY}:modified'
+
+_invalidation = threading.local()
+
+# Per-process L1 in front of the shared cache, keyed without the version so a hit
+# never leaves the process. Emptied on every bump, here and, via pub/sub, in every
+# other worker; the timeout bounds staleness should a message be missed.
+local_catalog = LocalCache(max_entries=settings.CATALOG_L1_MAX_ENTRIES,
+                           timeout=settings.CATALOG_L1_TIMEOUT)
+local_catalog_listener = InvalidationListener(
+    local_catalog, channel=f'{CATALOG_CACHE_KEY}:invalidate')
+
+PRODUCT_SNAPSHOT_FIELDS = ('id', 'uuid_slug', 'title', 'flavor', 'description', 'price',
+                           'created_at', 'updated_at')
+
+
+class ProductSnapshot:
+    """
+        Compact read-only copy of an IceCream row kept in the L1 cache,
+        it exposes the same attributes templates use on the model.
+    """
+    __slots__ = PRODUCT_SNAPSHOT_FIELDS
+
+    def __init__(self, *values):
+        for field, value in zip(PRODUCT_SNAPSHOT_FIELDS, values):
+            setattr(self, field, value)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}: {self.title}"
+
+
+def _new_version():
+    # Seeded from the clock so a lost version key never hands out a
+    # generation whose entries may still be sitting in the cache.
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    """
+        Returns the current catalog generation.
+        The version key never expires, it is created on first use.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def get_catalog_modified():
+    """
+        Returns when the catalog last changed, the unix time of the last bump.
+        Unlike max(updated_at) it also moves forward on deletes. Should the key be
+        lost it restarts from now, which only costs clients a full response.
+    """
+    modified = cache.get(CATALOG_MODIFIED_KEY)
+    if modified is None:
+        cache.add(CATALOG_MODIFIED_KEY, time.time(), timeout=None)
+        modified = cache.get(CATALOG_MODIFIED_KEY)
+    return modified
+
+
+def bump_catalog_version():
+    """
+        Moves the catalog to a new generation, every key built by catalog_key
+        before the bump is no longer read and simply ages out.
+    """
+    try:
+        version = cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = _new_version()
+        cache.set(CATALOG_VERSION_KEY, version, timeout=None)
+    # Written after the commit and read before the rows by _get_page_payload, so a
+    # page is never stamped with a change time newer than its rows
+    cache.set(CATALOG_MODIFIED_KEY, time.time(), timeout=None)
+    local_catalog.clear()
+    local_catalog_listener.publish(version)
+    logger.info(f"Catalog cache version bumped to {version}")
+    return version
+
+
+def invalidate_catalog():
+    """
+        Schedules a catalog version bump for when the current transaction commits,
+        so a reader can never cache the old rows under the new version.
+    """
+    if getattr(_invalidation, 'deferred', False):
+        _invalidation.pending = True
+    else:
+        transaction.on_commit(bump_catalog_version)
+
+
+@contextmanager
+def single_invalidation():
+    """
+        Collapses every invalidate_catalog call made inside the block,
+        e.g. one post_delete signal per deleted row, into a single bump.
+    """
+    if getattr(_invalidation, 'deferred', False):
+        yield
+        return
+    _invalidation.deferred, _invalidation.pending = True, False
+    try:
+        yield
+    finally:
+        _invalidation.deferred = False
+        if _invalidation.pending:
+            transaction.on_commit(bump_catalog_version)
+
+
+def catalog_key(*parts):
+    """
+        Builds a cache key scoped to the current catalog generation.
+    """
+    return ':'.join([CATALOG_CACHE_KEY, str(get_catalog_version()), *map(str, parts)])
+
+
+def _read_through(parts, build, to_local=None, timeout=None, cacheable=None):
+    """
+        Reads a catalog entry from the L1 cache, then the shared cache
+        (see helper.cache.get_or_set), building it on a miss. to_local converts the shared value for L1 storage.
+        timeout defaults to CATALOG_CACHE_TIMEOUT, cacheable(value) returning False keeps
+        a built value out of both caches.
+    """
+    local_key = ':'.join(map(str, parts))
+    use_local = settings.CATALOG_L1_ENABLED and local_catalog_listener.is_ready()
+    generation = local_catalog.generation
+    if use_local:
+        value = local_catalog.get(local_key)
+        if value is not None:
+            return value
+
+    # A bump empties every key at once, single-flight keeps the rebuild to one worker.
+    value = get_or_set(catalog_key(*parts), build,
+                       timeout=settings.CATALOG_CACHE_TIMEOUT if timeout is None else timeout,
+                       cacheable=cacheable)
+    if cacheable is not None and not cacheable(value):
+        use_local = False
+
+    if to_local is not None:
+        value = to_local(value)
+    if use_local:
+        local_catalog.set(local_key, value, generation=generation)
+    return value
+
+
+def _catalog_rows():
+    return list(IceCream.objects.values_list(*PRODUCT_SNAPSHOT_FIELDS))
+
+
+def get_catalog_products():
+    """
+        Returns all products as ProductSnapshot objects, read through the catalog caches.
+        The shared cache holds plain row tuples, cheaper to pickle than model instances.
+    """
+    return _read_through(
+        ('products',), _catalog_rows,
+        lambda rows: [ProductSnapshot(*row) for row in rows])
+
+
+def get_catalog_product_map():
+    """
+        Same as get_catalog_products, as a dict of ProductSnapshot by product id.
+    """
+    return _read_through(
+        ('product_map',), _catalog_rows,
+        lambda rows: {row[0]: ProductSnapshot(*row) for row in rows})
+
+
+def _get_page_payload(request, queryset, *key_parts, timeout=None, cache=True, cache_empty=True):
+    paginator = KeysetPagination(descending=False)
+    empty = False
+
+    def build():
+        nonlocal empty
+        # Cached with the page, hits do not read it again
+        last_modified = get_catalog_modified()
+        page = paginator.paginate_queryset(queryset, request)
+        empty = not page
+        serializer = IceCreamSerializer(page, many=True)
+        return render_payload(
+            paginator.get_paginated_data(serializer.data),
+            compress=settings.CATALOG_CACHE_GZIP, last_modified=last_modified)
+
+    # Keys are built from client input, only a fixed set of page sizes is cached
+    # and pages past the first expire quickly
+    if not cache or paginator.get_page_size(request) not in settings.CATALOG_CACHE_PAGE_SIZES:
+        return build()
+    if paginator.decode_cursor(request) is not None:
+        timeout = settings.CATALOG_CACHE_SHORT_TIMEOUT
+    return _read_through(
+        (*key_parts, *paginator.get_cache_key_parts(request)), build, timeout=timeout,
+        cacheable=None if cache_empty else lambda payload: not empty)
+
+
+def get_catalog_payload(request):
+    """
+        Returns the rendered JSON payload (see helper.payload) of the catalog
+        page requested, so a cache hit needs no model instances or serializer work.
+        Pages are cached per normalized cursor and page size, for the page sizes in
+        CATALOG_CACHE_PAGE_SIZES only, pages after the first for CATALOG_CACHE_SHORT_TIMEOUT.
+    """
+    return _get_page_payload(request, IceCream.objects.all(), 'payload')
+
+
+def get_search_payload(request, filters):
+    """
+        Same as get_catalog_payload for a page of search results, cached per normalized
+        set of filters (see ProductSearchSerializer) for CATALOG_CACHE_SHORT_TIMEOUT.
+        Searches without results and q that is not plain words are not cached.
+    """
+    normalized = json.dumps(filters, sort_keys=True, default=str)
+    digest = hashlib.sha1(normalized.encode()).hexdigest()
+    return _get_page_payload(
+        request, search_products(**filters), 'search', digest,
+        timeout=settings.CATALOG_CACHE_SHORT_TIMEOUT,
+        cache=is_plain_query(filters.get('q') or ''), cache_empty=False)
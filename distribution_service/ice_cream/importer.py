@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from itertools import islice
+import csv
+import json
+import logging
+
+from ice_cream.api.serializers import IceCreamRequestSerializer
+from ice_cream.cache import invalidate_catalog
+from ice_cream.models import IceCream
+
+logger = logging.getLogger(__name__)
+
+CSV = 'csv'
+JSON_LINES = 'jsonl'
+
+
+def iter_rows(lines, fmt=JSON_LINES):
+    """
+        Parses an iterable of text lines lazily,
+        yields (line_number, row, error) where exactly one of row or error is set.
+    """
+    if fmt == CSV:
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line), None
+        except ValueError as e:
+            yield line_number, None, {'non_field_errors': [f"Invalid JSON: {e}"]}
+
+
+def _import_chunk(chunk, report):
+    valid = {}
+    for line_number, row, error in chunk:
+        if error is None:
+            serializer = IceCreamRequestSerializer(data=row)
+            if serializer.is_valid():
+                data = serializer.validated_data
+                # A later row for the same product wins.
+                valid[(data['title'], data['flavor'])] = data
+                continue
+            error = serializer.errors
+        report['errors'].append({'line': line_number, 'errors': error})
+
+    if not valid:
+        return
+
+    titles = {title for title, _ in valid}
+    existing = {}
+    for product in IceCream.objects.filter(title__in=titles):
+        existing.setdefault((product.title, product.flavor), product)
+
+    now = timezone.now()
+    to_create, to_update = [], []
+    for key, data in valid.items():
+        product = existing.get(key)
+        if product is None:
+            to_create.append(IceCream(**data))
+        else:
+            product.description = data['description']
+            product.price = data['price']
+            # bulk_update skips auto_now
+            product.updated_at = now
+            to_update.append(product)
+
+    with transaction.atomic():
+        IceCream.objects.bulk_create(to_create)
+        IceCream.objects.bulk_update(
+            to_update, ['description', 'price', 'updated_at'])
+    report['created'] += len(to_create)
+    report['updated'] += len(to_update)
+
+
+def import_products(rows, chunk_size=None):
+    """
+        Upserts products from (line_number, row, error) tuples as produced by iter_rows.
+        Rows are validated with IceCreamRequestSerializer and written chunk by chunk
+        with bulk_create/bulk_update, keyed on title and flavor.
+        Invalid rows are reported and skipped without aborting the batch.
+        The catalog cache is invalidated once, after the last chunk.
+        Returns a report: {"created": int, "updated": int, "errors": [{"line": int, "errors": ...}]}
+    """
+    chunk_size = chunk_size or settings.PRODUCT_IMPORT_CHUNK_SIZE
+    report = {'created': 0, 'updated': 0, 'errors': []}
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        _import_chunk(chunk, report)
+
+    if report['created'] or report['updated']:
+        invalidate_catalog()
+    logger.info(
+        f"Product import: {report['created']} created, {report['updated']} updated, "
+        f"{len(report['errors'])} rejected")
+    return report
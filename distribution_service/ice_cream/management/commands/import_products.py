@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+import sys
+
+from ice_cream.importer import iter_rows, import_products, CSV, JSON_LINES
+
+
+class Command(BaseCommand):
+    help = 'Bulk create or update products from a JSON Lines or CSV file, keyed on title and flavor.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='File to import, "-" reads from stdin.')
+        parser.add_argument('--format', choices=[JSON_LINES, CSV],
+                            help='Input format, guessed from the file extension by default.')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Rows validated and written per batch.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or (CSV if path.endswith('.csv') else JSON_LINES)
+
+        try:
+            source = sys.stdin if path == '-' else open(
+                path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(e)
+
+        with source:
+            report = import_products(
+                iter_rows(source, fmt), chunk_size=options['chunk_size'])
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {dict(error['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['created']} created, {report['updated']} updated, {len(report['errors'])} rejected"))
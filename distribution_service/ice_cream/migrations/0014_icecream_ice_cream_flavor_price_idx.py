@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 06:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ice_cream', '0013_alter_icecream_created_at_alter_icecream_flavor_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='icecream',
+            index=models.Index(fields=['flavor', 'price'], name='ice_cream_flavor_price_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def move_cart_links(apps, schema_editor):
+    """
+    Copies the Cart.items M2M links onto IceCreamItem.cart, merging
+    the items a cart holds for the same product into a single one.
+    """
+    Cart = apps.get_model('order', 'Cart')
+    IceCreamItem = apps.get_model('ice_cream', 'IceCreamItem')
+    Link = Cart.items.through
+
+    for cart_id in Link.objects.values_list('cart_id', flat=True).distinct():
+        item_ids = Link.objects.filter(cart_id=cart_id).values('icecreamitem_id')
+        lines = (IceCreamItem.objects.filter(id__in=item_ids)
+                 .values('ice_cream_id').annotate(quantity=Sum('quantity')))
+        for line in lines:
+            items = IceCreamItem.objects.filter(
+                id__in=item_ids, ice_cream_id=line['ice_cream_id']).order_by('id')
+            kept = items.first()
+            IceCreamItem.objects.filter(id=kept.id).update(
+                cart_id=cart_id, quantity=line['quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ice_cream', '0015_icecream_full_text_index'),
+        ('order', '0007_remove_cart_current_user_remove_cart_deleted_and_more'),
+    ]
+
+    operations = [
+        # Reverse accessor renamed to items once the M2M is gone, see 0017.
+        migrations.AddField(
+            model_name='icecreamitem',
+            name='cart',
+            field=models.ForeignKey(blank=True, help_text='The cart this item was added to.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='order.cart'),
+        ),
+        migrations.RunPython(move_cart_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ice_cream', '0016_icecreamitem_cart'),
+        ('order', '0008_remove_cart_items'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='icecreamitem',
+            name='cart',
+            field=models.ForeignKey(blank=True, help_text='The cart this item was added to.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='order.cart'),
+        ),
+        migrations.AddConstraint(
+            model_name='icecreamitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'ice_cream'), name='ice_cream_item_cart_product_unique'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ice_cream', '0017_alter_icecreamitem_cart_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('quantity', models.IntegerField(default=0, help_text='Units on hand, before deducting the sales not yet reconciled.')),
+                ('ice_cream', models.OneToOneField(help_text='The product stocked.', on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='ice_cream.icecream')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -31,6 +31,10 @@ class IceCream(Meta):
 
     class Meta(Meta.Meta):
         unique_together = [("title", "uuid_slug")]
+        indexes = [
+            models.Index(fields=['flavor', 'price'],
+                         name='ice_cream_flavor_price_idx'),
+        ]
 
 
 class IceCreamItem(Meta):
@@ -42,11 +46,39 @@ class IceCreamItem(Meta):
      The quantity field tracks the number of units for the associated product,
      facilitating inventory and order management. This model is essential for
      representing individual product selections and their respective quantities
-     within the system.
+     within the system. A cart holds at most one item per product,
+     adding the product again increases the item quantity.
     """
     ice_cream = models.ForeignKey(
         IceCream, related_name='ice_cream_item', on_delete=models.CASCADE)
+    cart = models.ForeignKey(
+        'order.Cart', related_name='items', on_delete=models.CASCADE, null=True, blank=True,
+        help_text='The cart this item was added to.')
     quantity = models.IntegerField(default=1)
 
     def __repr__(self):
         return f"{self.__class__.__name__}: {self.ice_cream.title}"
+
+    class Meta(Meta.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'ice_cream'],
+                                    name='ice_cream_item_cart_product_unique'),
+        ]
+
+
+class Stock(Meta):
+    """
+    The Stock model holds the number of units on hand of an IceCream product.
+    Products without a Stock row are not tracked and can always be ordered.
+    Checkouts never write this table: units are reserved in Redis when added to a cart
+    (see order.stock) and sales are deducted from quantity by the periodic
+    reconciliation, so concurrent buyers of one product never wait on its row lock.
+    quantity goes negative when more was sold than was on hand.
+    """
+    ice_cream = models.OneToOneField(
+        IceCream, related_name='stock', on_delete=models.CASCADE, help_text='The product stocked.')
+    quantity = models.IntegerField(
+        default=0, help_text='Units on hand, before deducting the sales not yet reconciled.')
+
+    def __str__(self):
+        return f"{self.quantity} x {self.ice_cream.title}"
@@ -0,0 +1,57 @@
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+import re
+
+from ice_cream.models import IceCream
+
+FTS_TABLE = 'ice_cream_icecream_fts'
+# A plain search word, optionally ending with * for a prefix match
+PLAIN_TERM_RE = re.compile(r'\w+\*?')
+
+
+def _fts5_query(text):
+    # Every word becomes a quoted prefix term, so user input can never be
+    # parsed as FTS5 query syntax; terms are implicitly AND-ed.
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in text.split())
+
+
+def is_plain_query(text):
+    """
+        Whether text is only plain words, without the quotes, operators or
+        parentheses some backends read as query syntax.
+    """
+    return all(PLAIN_TERM_RE.fullmatch(word) for word in text.split())
+
+
+def full_text_filter(queryset, text):
+    """
+        Filters products whose title or description match text, using the
+        full-text index created by migration 0015 for the current database.
+    """
+    if connection.vendor == 'postgresql':
+        return queryset.annotate(
+            search=SearchVector('title', 'description', config='english'),
+        ).filter(search=SearchQuery(text, config='english', search_type='websearch'))
+    if connection.vendor == 'sqlite':
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [_fts5_query(text)]))
+    return queryset.filter(Q(title__icontains=text) | Q(description__icontains=text))
+
+
+def search_products(flavor=None, min_price=None, max_price=None, q=None):
+    """
+        Returns a queryset of products matching all given filters.
+        flavor is matched exactly so the (flavor, price) index can be used.
+    """
+    queryset = IceCream.objects.all()
+    if flavor:
+        queryset = queryset.filter(flavor=flavor)
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+    if q:
+        queryset = full_text_filter(queryset, q)
+    return queryset
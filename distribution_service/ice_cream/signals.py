@@ -0,0 +1,18 @@
+from django.core.signals import setting_changed
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from ice_cream.cache import invalidate_catalog, local_catalog, local_catalog_listener
+from ice_cream.models import IceCream
+
+
+@receiver([post_save, post_delete], sender=IceCream)
+def invalidate_catalog_cache(sender, **kwargs):
+    invalidate_catalog()
+
+
+@receiver(setting_changed)
+def reset_local_catalog(setting, **kwargs):
+    if setting == 'CACHES':
+        local_catalog.clear()
+        local_catalog_listener.reset()
@@ -1,11 +1,31 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from decimal import Decimal
+import gzip
+import io
+import tempfile
+import time
+from unittest import mock
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils.http import http_date
 from rest_framework import status
 from rest_framework.test import APIClient
+from helper.cache import get_or_set
+from helper.payload import render_payload
 from .models import IceCream
 from .api.serializers import IceCreamSerializer
+from .cache import get_catalog_products, get_catalog_version, bump_catalog_version, local_catalog, get_catalog_modified
 from django.contrib.auth.models import User
 
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 
 class IceCreamTests(TestCase):
     def setUp(self):
@@ -88,3 +108,381 @@ class ProductUpdateTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.ice_cream.refresh_from_db()
         self.assertEqual(self.ice_cream.title, "Patched Flavor")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogCacheInvalidationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_catalog.clear()
+        self.client = APIClient()
+        self.admin_user = User.objects.create_superuser(
+            'admin', 'admin@test.com', 'password')
+        self.client.force_authenticate(user=self.admin_user)
+        self.ice_cream = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", description="Classic", price=2.50)
+
+    def test_catalog_is_served_from_cache(self):
+        get_catalog_products()
+        with self.assertNumQueries(0):
+            products = get_catalog_products()
+        self.assertEqual([p.id for p in products], [self.ice_cream.id])
+
+    def test_catalog_is_served_from_local_cache(self):
+        products = get_catalog_products()
+        with mock.patch('ice_cream.cache.cache') as shared_cache:
+            self.assertIs(get_catalog_products(), products)
+        shared_cache.get.assert_not_called()
+
+    def test_bump_clears_local_cache(self):
+        products = get_catalog_products()
+        bump_catalog_version()
+        self.assertEqual(len(local_catalog), 0)
+        self.assertIsNot(get_catalog_products(), products)
+
+    def test_update_invalidates_catalog(self):
+        get_catalog_products()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('update_product', kwargs={
+                'product_id': self.ice_cream.id}), {"price": "3.75"})
+        response = self.client.get(reverse('all_products'))
+        self.assertEqual(response.json()['results'][0]['price'], '3.75')
+
+    def test_delete_invalidates_catalog(self):
+        get_catalog_products()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('delete_product', kwargs={
+                'product_id': self.ice_cream.id}))
+        self.assertEqual(get_catalog_products(), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductListFragmentCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_catalog.clear()
+        self.user = User.objects.create_user(
+            username='user', password='password')
+        self.client.force_login(self.user)
+        self.ice_cream = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", description="Classic", price=2.50)
+
+    def test_product_card_is_cached(self):
+        response = self.client.get(reverse('ice_cream_list'))
+        self.assertContains(response, "Vanilla")
+        key = make_template_fragment_key(
+            'product_card', [self.ice_cream.id, self.ice_cream.updated_at])
+        self.assertIsNotNone(cache.get(key))
+
+    def test_csrf_token_is_not_cached(self):
+        self.client.get(reverse('ice_cream_list'))
+        # Tokens are masked per render, a cached one would not match this response.
+        response = self.client.get(reverse('ice_cream_list'))
+        self.assertContains(response, str(response.context['csrf_token']))
+
+    def test_update_renders_new_card(self):
+        self.client.get(reverse('ice_cream_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ice_cream.price = 3.75
+            self.ice_cream.save()
+        response = self.client.get(reverse('ice_cream_list'))
+        self.assertContains(response, "Price: $3.75")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogPayloadCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_catalog.clear()
+        self.client = APIClient()
+        for i in range(5):
+            IceCream.objects.create(
+                title=f"Flavor {i}", flavor="vanilla", description="Classic vanilla", price=2.5)
+
+    def test_cache_hit_skips_database(self):
+        self.client.get(reverse('all_products'))
+        # Only the EndpointPerformance insert from ResponseTimeMiddleware.
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('all_products'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_payload_matches_serializer(self):
+        expected = IceCreamSerializer(
+            IceCream.objects.order_by('created_at', 'id'), many=True).data
+        self.client.get(reverse('all_products'))
+        response = self.client.get(reverse('all_products'))
+        self.assertEqual(response.json()['results'],
+                         [dict(item) for item in expected])
+
+    def test_gzip_served_when_accepted(self):
+        plain = self.client.get(reverse('all_products'))
+        response = self.client.get(
+            reverse('all_products'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_catalog.clear()
+        self.client = APIClient()
+        self.ice_cream = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", description="Classic vanilla", price=2.5)
+
+    def test_if_none_match_returns_not_modified(self):
+        response = self.client.get(reverse('all_products'))
+        etag = response['ETag']
+        response = self.client.get(
+            reverse('all_products'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def respond_at(self, now):
+        clock = mock.patch('helper.payload.time')
+        clock.start().time.return_value = now
+        self.addCleanup(clock.stop)
+
+    def test_if_modified_since_returns_not_modified(self):
+        self.respond_at(time.time() + 2)
+        response = self.client.get(reverse('all_products'))
+        response = self.client.get(
+            reverse('all_products'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_last_modified_is_the_last_change(self):
+        self.respond_at(time.time() + 2)
+        last_modified = self.client.get(reverse('all_products'))['Last-Modified']
+        with mock.patch('ice_cream.cache.time') as clock, self.captureOnCommitCallbacks(execute=True):
+            clock.time.return_value = time.time() + 1
+            self.ice_cream.price = 3.5
+            self.ice_cream.save()
+        self.respond_at(time.time() + 5)
+        response = self.client.get(
+            reverse('all_products'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Last-Modified'], http_date(get_catalog_modified()))
+
+    def test_last_modified_served_from_cached_page(self):
+        with mock.patch('ice_cream.cache.get_catalog_modified', wraps=get_catalog_modified) as modified:
+            self.client.get(reverse('all_products'))
+            self.client.get(reverse('all_products'))
+        modified.assert_called_once()
+
+    def test_last_modified_withheld_within_its_second(self):
+        # Another change in the same second would get the same date
+        self.respond_at(int(get_catalog_modified()) + 0.5)
+        response = self.client.get(reverse('all_products'))
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('ETag', response)
+
+    def test_change_invalidates_etag(self):
+        etag = self.client.get(reverse('all_products'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ice_cream.price = 3.5
+            self.ice_cream.save()
+        response = self.client.get(
+            reverse('all_products'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogPaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_catalog.clear()
+        self.client = APIClient()
+        self.products = [IceCream.objects.create(
+            title=f"Flavor {i}", flavor="vanilla", description="Classic", price=2.5) for i in range(5)]
+
+    def test_cursor_walks_every_product_once(self):
+        ids = []
+        url = reverse('all_products') + '?page_size=2'
+        while url:
+            body = self.client.get(url).json()
+            self.assertLessEqual(len(body['results']), 2)
+            ids.extend(item['id'] for item in body['results'])
+            url = body['next']
+        self.assertEqual(ids, [product.id for product in self.products])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('all_products') + '?cursor=bogus')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(CATALOG_CACHE_PAGE_SIZES=(2,), CATALOG_CACHE_SHORT_TIMEOUT=30)
+    def test_cached_pages(self):
+        with mock.patch('ice_cream.cache.get_or_set', wraps=get_or_set) as cached:
+            self.client.get(reverse('all_products') + '?page_size=3')
+            cached.assert_not_called()
+            first = self.client.get(reverse('all_products') + '?page_size=2').json()
+            self.client.get(first['next'])
+        self.assertEqual([call.kwargs['timeout'] for call in cached.call_args_list],
+                         [settings.CATALOG_CACHE_TIMEOUT, 30])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_catalog.clear()
+        self.client = APIClient()
+        self.url = reverse('search_products')
+        self.vanilla = IceCream.objects.create(
+            title="Vanilla Bean", flavor="vanilla", description="Madagascar vanilla pods", price=2.5)
+        self.cheap_vanilla = IceCream.objects.create(
+            title="Soft Serve", flavor="vanilla", description="Classic cone", price=1.0)
+        self.chocolate = IceCream.objects.create(
+            title="Dark Chocolate", flavor="chocolate", description="Rich cocoa", price=3.0)
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_filter_by_flavor_and_price(self):
+        self.assertEqual(self.search(flavor='vanilla'), [
+                         self.vanilla.id, self.cheap_vanilla.id])
+        self.assertEqual(self.search(flavor='vanilla', min_price='2.00'), [
+                         self.vanilla.id])
+        self.assertEqual(self.search(max_price='2.75'), [
+                         self.vanilla.id, self.cheap_vanilla.id])
+
+    def test_full_text(self):
+        self.assertEqual(self.search(q='cocoa'), [self.chocolate.id])
+        self.assertEqual(self.search(q='  VANILLA  bean'), [self.vanilla.id])
+        self.assertEqual(self.search(q='"pods'), [self.vanilla.id])
+
+    def test_full_text_follows_updates(self):
+        self.chocolate.description = "Belgian truffle"
+        self.chocolate.save()
+        self.assertEqual(self.search(q='truffle'), [self.chocolate.id])
+
+    def test_invalid_price_range(self):
+        response = self.client.get(
+            self.url, {'min_price': '5', 'max_price': '1'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_plain_queries_with_results_cached(self):
+        with mock.patch('ice_cream.cache.get_or_set', wraps=get_or_set) as cached, \
+                mock.patch('ice_cream.cache.render_payload', wraps=render_payload) as rendered:
+            for q in ('cocoa', '  COCOA', 'nothing', 'nothing', '"pods', '"pods'):
+                self.search(q=q)
+        self.assertEqual(rendered.call_count, 5)
+        self.assertEqual({call.kwargs['timeout'] for call in cached.call_args_list},
+                         {settings.CATALOG_CACHE_SHORT_TIMEOUT})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductImportTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_catalog.clear()
+        self.client = APIClient()
+        self.admin_user = User.objects.create_superuser(
+            'admin', 'admin@test.com', 'password')
+        self.client.force_authenticate(user=self.admin_user)
+        self.url = reverse('import_products')
+        self.existing = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", description="Old", price=2.00)
+
+    def test_import_json_lines(self):
+        body = "\n".join([
+            '{"title": "Vanilla", "flavor": "vanilla", "description": "New", "price": "2.50"}',
+            '{"title": "Mango", "flavor": "mango", "description": "Sorbet", "price": "3.00"}',
+            '{"title": "Broken", "flavor": "x", "description": "Bad", "price": "-1"}',
+            'not json',
+        ])
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(
+                self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual([e['line'] for e in response.data['errors']], [3, 4])
+        self.assertEqual(len(callbacks), 1)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.description, "New")
+        self.assertTrue(IceCream.objects.filter(title="Mango").exists())
+
+    def test_import_csv(self):
+        body = "title,flavor,description,price\nMango,mango,Sorbet,3.00\nLemon,lemon,Zest,2.25\n"
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'], [])
+
+    def test_import_requires_admin(self):
+        user = User.objects.create_user(username='user', password='password')
+        self.client.force_authenticate(user=user)
+        response = self.client.post(
+            self.url, '', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as source:
+            source.write("title,flavor,description,price\nMango,mango,Sorbet,3.00\n")
+            source.flush()
+            out = io.StringIO()
+            call_command('import_products', source.name,
+                         chunk_size=1, stdout=out)
+        self.assertIn('1 created', out.getvalue())
+        self.assertTrue(IceCream.objects.filter(title="Mango").exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductBulkOperationsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_catalog.clear()
+        self.client = APIClient()
+        self.admin_user = User.objects.create_superuser(
+            'admin', 'admin@test.com', 'password')
+        self.client.force_authenticate(user=self.admin_user)
+        self.vanilla = [IceCream.objects.create(
+            title=f"Vanilla {i}", flavor="vanilla", description="Classic", price=2.00) for i in range(3)]
+        self.mint = IceCream.objects.create(
+            title="Mint", flavor="mint", description="Fresh", price=3.00)
+
+    def test_bulk_percent_update_by_filter(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.patch(reverse('bulk_update_products'), {
+                "filter": {"flavor": "vanilla"}, "price_percent": "5"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertEqual(
+            set(IceCream.objects.filter(flavor='vanilla').values_list('price', flat=True)), {Decimal('2.10')})
+        self.mint.refresh_from_db()
+        self.assertEqual(self.mint.price, Decimal('3.00'))
+
+    def test_bulk_update_by_ids(self):
+        response = self.client.patch(reverse('bulk_update_products'), {
+            "ids": [self.mint.id], "price": "4.00", "description": "Peppermint"}, format='json')
+        self.assertEqual(response.data['updated'], 1)
+        self.mint.refresh_from_db()
+        self.assertEqual(self.mint.description, "Peppermint")
+
+    def test_bulk_update_rejects_out_of_range_prices(self):
+        response = self.client.patch(reverse('bulk_update_products'), {
+            "filter": {}, "price_delta": "-2.50"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.mint.refresh_from_db()
+        self.assertEqual(self.mint.price, Decimal('3.00'))
+
+    def test_bulk_update_requires_selection(self):
+        response = self.client.patch(reverse('bulk_update_products'), {
+            "price": "4.00"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_delete_invalidates_once(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.delete(reverse('bulk_delete_products'), {
+                "filter": {"flavor": "vanilla"}}, format='json')
+        self.assertEqual(response.data['deleted'], 3)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(list(IceCream.objects.all()), [self.mint])
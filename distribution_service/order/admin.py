@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Order, Cart
+from .models import Order, OrderLine, Cart
 
 admin.site.register(Order)
+admin.site.register(OrderLine)
 admin.site.register(Cart)
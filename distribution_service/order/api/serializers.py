@@ -1,19 +1,72 @@
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import ModelSerializer, Serializer, IntegerField, DateTimeField, ChoiceField, \
+    CharField, ValidationError
 
 from ice_cream.api.serializers import IceCreamItemSerializer
-from order.models import Order, Cart
+from order.checkout_queue import PENDING, COMPLETED, FAILED
+from order.models import Order, OrderLine
+from payment.models import Payment
+
+
+class OrderLineSerializer(ModelSerializer):
+
+    class Meta:
+        model = OrderLine
+        fields = ['id', 'ice_cream', 'title', 'flavor', 'quantity', 'unit_price', 'line_total']
 
 
 class OrderSerializer(ModelSerializer):
+    lines = OrderLineSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
         fields = "__all__"
 
 
-class CartSerializer(ModelSerializer):
-    items = IceCreamItemSerializer(many=True)
+class OrderPaymentSerializer(ModelSerializer):
+
+    class Meta:
+        model = Payment
+        fields = ['payment_id', 'payment_status', 'amount', 'created_at']
+
+
+class OrderHistorySerializer(ModelSerializer):
+    """
+        An order of the user's history with its lines and payment, items are left out,
+        the lines already describe them.
+    """
+    lines = OrderLineSerializer(many=True, read_only=True)
+    payment = OrderPaymentSerializer(read_only=True, allow_null=True)
 
     class Meta:
-        model = Cart
-        fields = ['id', 'user', 'items', 'created_at']
+        model = Order
+        fields = ['id', 'order_number', 'status', 'total', 'content', 'created_at', 'lines', 'payment']
+
+
+class OrderHistoryFilterSerializer(Serializer):
+    status = CharField(required=False, max_length=30,
+                       help_text="Exact order status, e.g. paid or unpaid.")
+    created_after = DateTimeField(required=False,
+                                  help_text="Orders created at or after this time.")
+    created_before = DateTimeField(required=False,
+                                   help_text="Orders created before this time.")
+
+    def validate(self, data):
+        created_after, created_before = data.get('created_after'), data.get('created_before')
+        if created_after is not None and created_before is not None and created_after >= created_before:
+            raise ValidationError("created_after must be earlier than created_before.")
+        return data
+
+
+class CartSerializer(Serializer):
+    """
+        Serializes the CartContents returned by the cart backends (see order.cart).
+    """
+    id = IntegerField()
+    user = IntegerField(source='user_id')
+    items = IceCreamItemSerializer(many=True)
+    created_at = DateTimeField()
+
+
+class CheckoutTicketSerializer(Serializer):
+    order_number = IntegerField(help_text="Order number reserved for the checkout.")
+    status = ChoiceField(choices=[PENDING, COMPLETED, FAILED])
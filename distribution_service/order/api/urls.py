@@ -1,9 +1,11 @@
 
 from django.urls import path
 
-from order.api.views import add_item_to_cart, delete_item_from_cart, get_cart_details, empty_cart, create_order
+from order.api.views import add_item_to_cart, delete_item_from_cart, get_cart_details, empty_cart, create_order, \
+    checkout_status, order_history
 
 urlpatterns = [
+    path('', order_history, name='order_history'),
     path('add-item-to-cart/<int:product_id>/',
          add_item_to_cart, name='add_item_to_cart'),
     path('delete-from-cart/<int:item_id>/',
@@ -13,4 +15,6 @@ urlpatterns = [
     path('empty-cart/<int:cart_id>/',
          empty_cart, name='empty_cart'),
     path('create-order/<int:cart_id>/', create_order, name='create_order'),
+    path('checkout-status/<int:order_number>/',
+         checkout_status, name='checkout_status'),
 ]
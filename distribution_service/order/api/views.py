@@ -2,61 +2,157 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
+from django.conf import settings
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from drf_spectacular.utils import extend_schema
-from django.db.models import Max, F, Sum
 import logging
 
-from ice_cream.models import IceCream, IceCreamItem
-from order.api.serializers import OrderSerializer, CartSerializer
-from order.models import Cart, Order
-from payment.api.views import create_and_process_payment
+from helper.idempotency import idempotent, IDEMPOTENCY_KEY_PARAMETER
+from helper.pagination import KeysetPagination, paginated
+from helper.payload import not_modified_response, set_validators, settled_last_modified
+from ice_cream.cache import get_catalog_version
+from order.api.serializers import OrderSerializer, CartSerializer, CheckoutTicketSerializer, \
+    OrderHistorySerializer, OrderHistoryFilterSerializer
+from order.cart import get_cart_backend, CartLocked
+from order.checkout_queue import submit_checkout, get_ticket, PENDING, FAILED
+from order.models import Order
+from order.services import checkout
+from order.stock import reserve, release, OutOfStock
 
 logger = logging.getLogger(__name__)
 
 
+def _cart_etag(cart):
+    # Items nest the full product, so a catalog change must change the tag too.
+    return f'"{cart.id}-{cart.updated_at.timestamp()}-{get_catalog_version()}"'
+
+
+def _found(cart):
+    if cart is None:
+        raise Http404("No cart matches the given query.")
+    return cart
+
+
+def _out_of_stock_response(error):
+    return Response({"detail": f"Not enough stock of product {error.product_id}."},
+                    status=status.HTTP_409_CONFLICT)
+
+
+def _ticket_response(ticket, response_status):
+    serializer = CheckoutTicketSerializer(ticket)
+    return Response(serializer.data, status=response_status, headers={
+        'Location': reverse('checkout_status', kwargs={'order_number': ticket['order_number']})})
+
+
 @extend_schema(
     request=None,
-    responses={status.HTTP_201_CREATED: OrderSerializer},
+    parameters=[IDEMPOTENCY_KEY_PARAMETER],
+    responses={status.HTTP_201_CREATED: OrderSerializer,
+               status.HTTP_202_ACCEPTED: CheckoutTicketSerializer,
+               status.HTTP_409_CONFLICT: None},
 )
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_order(request, cart_id=None):
     """
         Submit an order. Items from the cart will be added to the order.
         The total cost is calculated for payment, which is then queued for processing. 
         This function returns the order details. A valid cart_id must be provided.
+        Retries sent with the same Idempotency-Key header get the first response back
+        instead of placing the order, and its payment, again.
+        With queued checkout enabled, the order number is reserved and 202 is returned,
+        poll the checkout status URL given in the Location header for the order.
+        Returns 409 when a product is no longer in stock or the cart is being checked out,
+        404 when there is no such cart or it is empty.
     """
-    cart = get_object_or_404(Cart, id=cart_id, user=request.user)
-    items = cart.items.prefetch_related('ice_cream')
+    try:
+        if settings.CHECKOUT_QUEUED:
+            ticket = submit_checkout(request.user, cart_id)
+            if ticket is None:
+                raise Http404("No cart matches the given query.")
+            return _ticket_response(ticket, status.HTTP_202_ACCEPTED)
+
+        order = checkout(request.user, cart_id)
+    except OutOfStock as e:
+        return _out_of_stock_response(e)
+    except CartLocked:
+        return Response({"detail": "The cart is already being checked out."},
+                        status=status.HTTP_409_CONFLICT)
+    if order is None:
+        raise Http404("No cart matches the given query.")
 
-    last_order_number = Order.objects.all().aggregate(
-        Max('order_number'))['order_number__max']
+    serializer = OrderSerializer(order)
 
-    next_order_number = (last_order_number or 1000) + 1
-    order = Order.objects.create(
-        order_number=next_order_number, created_by=request.user)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@extend_schema(
+    request=None,
+    parameters=[OrderHistoryFilterSerializer],
+    responses={status.HTTP_200_OK: paginated(OrderHistorySerializer)},
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def order_history(request):
+    """
+        List the authenticated user's orders with their lines and payment status,
+        optionally filtered by status and creation date range.
+        Results are paginated newest first, follow the "next" link (cursor) for older orders.
+        Every page costs two queries however long the history.
+    """
+    filters = OrderHistoryFilterSerializer(data=request.query_params)
+    if not filters.is_valid():
+        return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    total = items.annotate(item_total=Sum(
-        F('quantity') * F('ice_cream__price'))).aggregate(total=Sum('item_total'))['total']
-    order.items.add(*[item.ice_cream for item in items])
-    order.total = total or 0
-    order.save()
-    logger.info(f"Order {order.order_number} has been created")
+    orders = Order.objects.filter(created_by=request.user)
+    if 'status' in filters.validated_data:
+        orders = orders.filter(status=filters.validated_data['status'])
+    if 'created_after' in filters.validated_data:
+        orders = orders.filter(created_at__gte=filters.validated_data['created_after'])
+    if 'created_before' in filters.validated_data:
+        orders = orders.filter(created_at__lt=filters.validated_data['created_before'])
 
-    cart.items.clear()
-    logger.info(f"Cart with ID :  {cart_id} has been cleared")
-    print(order)
-    create_and_process_payment(order)
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(
+        orders.select_related('payment').prefetch_related('lines'), request)
+    serializer = OrderHistorySerializer(page, many=True)
 
+    return paginator.get_paginated_response(serializer.data)
+
+
+@extend_schema(
+    request=None,
+    responses={status.HTTP_200_OK: OrderSerializer,
+               status.HTTP_202_ACCEPTED: CheckoutTicketSerializer,
+               status.HTTP_409_CONFLICT: CheckoutTicketSerializer},
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def checkout_status(request, order_number=None):
+    """
+        Status of a queued checkout: 202 while pending, 409 if it failed,
+        the order details once written.
+    """
+    ticket = get_ticket(order_number)
+    if ticket is not None and ticket['user_id'] != request.user.id:
+        raise Http404("No order matches the given query.")
+    if ticket is not None and ticket['status'] == PENDING:
+        return _ticket_response(ticket, status.HTTP_202_ACCEPTED)
+    if ticket is not None and ticket['status'] == FAILED:
+        return _ticket_response(ticket, status.HTTP_409_CONFLICT)
+
+    order = get_object_or_404(Order, order_number=order_number, created_by=request.user)
     serializer = OrderSerializer(order)
 
-    return Response(serializer.data, status=status.HTTP_201_CREATED)
+    return Response(serializer.data)
 
 
 @extend_schema(
     request=None,
-    responses={status.HTTP_200_OK: CartSerializer},
+    responses={status.HTTP_200_OK: CartSerializer, status.HTTP_409_CONFLICT: None},
 )
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -65,21 +161,23 @@ def add_item_to_cart(request, product_id=None):
         Create an item for the product identified by product_id. It ensures a cart exists for the user, 
         either by retrieving an existing one or creating a new one, 
         before proceeding to add the specified item.
+        The units are reserved for the cart, 409 is returned when not enough are in stock.
         product_id is required
     """
-    user = request.user
-    # validate and get ice-cream product
-    ice_cream = get_object_or_404(IceCream, id=product_id)
-    quantity = request.data.get('quantity', 1)
-
-    cart, _ = Cart.objects.get_or_create(user=user)
-
-    # create shopping item
-    item = IceCreamItem.objects.create(
-        ice_cream=ice_cream, quantity=quantity)
-
-    cart.items.add(item)
-    cart.save()
+    try:
+        quantity = int(request.data.get('quantity', 1))
+        if quantity < 1:
+            raise ValueError("Invalid quantity")
+    except (TypeError, ValueError):
+        return Response({"quantity": ["A positive integer is required."]},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        reserve(request.user, {product_id: quantity})
+    except OutOfStock as e:
+        return _out_of_stock_response(e)
+    # validates the product and ensures a cart exists for the user
+    cart = _found(get_cart_backend().add(request.user, product_id, quantity))
     logger.info(f"Item  for product {product_id} added to cart")
     serializer = CartSerializer(cart)
 
@@ -98,9 +196,8 @@ def delete_item_from_cart(request, item_id=None):
     from their shopping cart
     item_id is required
     """
-    cart = get_object_or_404(Cart, user=request.user)
-    item = get_object_or_404(IceCreamItem, id=item_id, cart=cart)
-    cart.items.remove(item)
+    cart = _found(get_cart_backend().remove(request.user, item_id))
+    release(request.user.id, cart.quantities())
     logger.info(f"Item with ID {item_id} removed from cart")
     serializer = CartSerializer(cart)
 
@@ -116,12 +213,19 @@ def delete_item_from_cart(request, item_id=None):
 def get_cart_details(request):
     """
     Enables authenticated users to retrieve the details of their current shopping cart, if existed.
+    Supports conditional requests, If-None-Match or If-Modified-Since returns 304 when the cart is unchanged.
     """
-    cart = get_object_or_404(Cart, user=request.user)
+    cart = _found(get_cart_backend().get(request.user))
+    etag = _cart_etag(cart)
+    last_modified = settled_last_modified(cart.updated_at.timestamp())
+
+    response = not_modified_response(request, etag, last_modified)
+    if response is not None:
+        return response
 
     serializer = CartSerializer(cart)
 
-    return Response(serializer.data)
+    return set_validators(Response(serializer.data), etag, last_modified)
 
 
 @extend_schema(
@@ -135,12 +239,12 @@ def empty_cart(request, cart_id=None):
     Allows authenticated user to remove all items from their cart.
     Allows admin user to empty cart givven it's id.
     """
+    cart_backend = get_cart_backend()
     if request.user.is_superuser:
-        cart = get_object_or_404(Cart, id=cart_id)
+        cart = _found(cart_backend.clear_by_id(cart_id))
     else:
-        cart = get_object_or_404(Cart, user=request.user)
-
-    cart.items.clear()
+        cart = _found(cart_backend.clear(request.user))
+    release(cart.user_id, {})
     logger.info(
         f"Cart with ID {cart_id} was emptied by {request.user.username}")
     serializer = CartSerializer(cart)
@@ -0,0 +1,324 @@
+from collections import Counter
+from datetime import datetime, timezone
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone as django_timezone
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+import time
+
+from ice_cream.cache import get_catalog_product_map
+from ice_cream.models import IceCream, IceCreamItem
+from order.models import Cart
+
+
+class CartLocked(Exception):
+    """
+        Another checkout of the cart held its lock for longer than CART_LOCK_TIMEOUT.
+    """
+
+    def __init__(self, cart_id):
+        super().__init__(f"Cart {cart_id} is being checked out")
+        self.cart_id = cart_id
+
+
+class CartItem:
+    """
+        One cart line, it exposes the attributes IceCreamItemSerializer reads.
+    """
+    __slots__ = ('id', 'ice_cream', 'quantity', 'created_at')
+
+    def __init__(self, id, ice_cream, quantity, created_at):
+        self.id = id
+        self.ice_cream = ice_cream
+        self.quantity = quantity
+        self.created_at = created_at
+
+
+class CartContents:
+    """
+        Backend independent snapshot of a cart, as returned by every cart backend.
+        updated_at versions the cart for conditional GETs and cached fragments.
+    """
+    __slots__ = ('id', 'user_id', 'items', 'created_at', 'updated_at')
+
+    def __init__(self, id, user_id, items, created_at, updated_at):
+        self.id = id
+        self.user_id = user_id
+        self.items = items
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    def quantities(self):
+        """
+            Returns the quantity ordered by product id.
+        """
+        quantities = Counter()
+        for item in self.items:
+            quantities[item.ice_cream.id] += item.quantity
+        return dict(quantities)
+
+
+def get_cart_backend():
+    """
+        Returns an instance of the backend configured by settings.CART_BACKEND.
+    """
+    return import_string(settings.CART_BACKEND)()
+
+
+class DatabaseCartBackend:
+    """
+        Stores carts as Cart rows with one IceCreamItem row per product.
+        Item ids are IceCreamItem ids.
+    """
+
+    def get(self, user):
+        return self._contents(Cart.objects.filter(user=user).first())
+
+    def get_by_id(self, cart_id):
+        return self._contents(Cart.objects.filter(id=cart_id).first())
+
+    def add(self, user, product_id, quantity):
+        with transaction.atomic():
+            # Waits for a checkout holding the cart's row lock (see lock()), whose clear
+            # would otherwise delete the item without it being ordered
+            cart, _ = Cart.objects.select_for_update().get_or_create(user=user)
+            if not self._merge(cart, product_id, quantity):
+                if not IceCream.objects.filter(id=product_id).exists():
+                    return None
+                try:
+                    with transaction.atomic():
+                        IceCreamItem.objects.create(
+                            cart=cart, ice_cream_id=product_id, quantity=quantity)
+                except IntegrityError:
+                    # A concurrent request created the item first, (cart, ice_cream) is unique
+                    self._merge(cart, product_id, quantity)
+            cart.touch()
+        return self._contents(cart)
+
+    @staticmethod
+    def _merge(cart, product_id, quantity):
+        # Atomic in the database, concurrent adds of the same product never lose an update
+        return IceCreamItem.objects.filter(cart=cart, ice_cream_id=product_id).update(
+            quantity=F('quantity') + quantity, updated_at=django_timezone.now())
+
+    def remove(self, user, item_id):
+        cart = Cart.objects.filter(user=user).first()
+        if cart is None or not cart.items.filter(id=item_id).delete()[0]:
+            return None
+        cart.touch()
+        return self._contents(cart)
+
+    def lock(self, user, cart_id):
+        """
+            Returns the user's cart with id cart_id, None if there is none, with its row
+            locked until the end of the current transaction (checkout).
+        """
+        return self._contents(
+            Cart.objects.select_for_update().filter(id=cart_id, user=user).first())
+
+    def unlock(self, cart_id):
+        # The row lock is released by the end of the transaction
+        pass
+
+    def clear_ordered(self, cart):
+        """
+            Empties a cart returned by lock(), within the checkout transaction.
+            Adds wait for the row lock, the cart holds nothing but what was ordered.
+        """
+        IceCreamItem.objects.filter(cart_id=cart.id).delete()
+        Cart.objects.filter(id=cart.id).update(updated_at=django_timezone.now())
+
+    def clear_on_checkout(self, cart):
+        self.clear_ordered(cart)
+
+    def clear(self, user):
+        return self._clear(Cart.objects.filter(user=user).first())
+
+    def clear_by_id(self, cart_id):
+        return self._clear(Cart.objects.filter(id=cart_id).first())
+
+    def _clear(self, cart):
+        if cart is None:
+            return None
+        cart.items.all().delete()
+        cart.touch()
+        return self._contents(cart)
+
+    def _contents(self, cart):
+        if cart is None:
+            return None
+        items = [CartItem(item.id, item.ice_cream, item.quantity, item.created_at)
+                 for item in cart.items.select_related('ice_cream')]
+        return CartContents(cart.id, cart.user_id, items, cart.created_at, cart.updated_at)
+
+
+class RedisCartBackend:
+    """
+        Stores each cart as a Redis hash, product id -> quantity, plus its created_at
+        and updated_at timestamps, keyed by user id: the cart id is the user id and
+        item ids are product ids. Adding the same product again adds to its quantity.
+        Every change is a single round trip and refreshes the cart's CART_TIMEOUT,
+        abandoned carts simply expire. Products are read from the catalog cache.
+        Checkouts lock the cart with a Redis lock, see lock().
+    """
+    key_prefix = 'cart'
+    alias = 'default'
+    meta_fields = (b'created_at', b'updated_at')
+
+    # KEYS[1] cart, ARGV[1] product id, ARGV[2] now, ARGV[3] timeout
+    remove_script = """
+        if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+            return false
+        end
+        redis.call('HSET', KEYS[1], 'updated_at', ARGV[2])
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+        return redis.call('HGETALL', KEYS[1])
+    """
+    # KEYS[1] cart, ARGV[1] now, ARGV[2] timeout, then product id, quantity pairs.
+    # Takes the quantities ordered off the cart, lines added meanwhile are kept.
+    take_script = """
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            return false
+        end
+        for i = 3, #ARGV, 2 do
+            if redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1])) <= 0 then
+                redis.call('HDEL', KEYS[1], ARGV[i])
+            end
+        end
+        redis.call('HSET', KEYS[1], 'updated_at', ARGV[1])
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+        return redis.call('HGETALL', KEYS[1])
+    """
+    # KEYS[1] cart, ARGV[1] now, ARGV[2] timeout
+    clear_script = """
+        local fields = redis.call('HKEYS', KEYS[1])
+        if #fields == 0 then
+            return false
+        end
+        for _, field in ipairs(fields) do
+            if field ~= 'created_at' and field ~= 'updated_at' then
+                redis.call('HDEL', KEYS[1], field)
+            end
+        end
+        redis.call('HSET', KEYS[1], 'updated_at', ARGV[1])
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+        return redis.call('HGETALL', KEYS[1])
+    """
+
+    def __init__(self):
+        self.redis = get_redis_connection(self.alias)
+        self.timeout = settings.CART_TIMEOUT
+        self.locks = {}
+
+    def _key(self, cart_id):
+        return f'{self.key_prefix}:{cart_id}'
+
+    def _lock_key(self, cart_id):
+        return f'{self.key_prefix}:{cart_id}:lock'
+
+    def get(self, user):
+        return self.get_by_id(user.id)
+
+    def get_by_id(self, cart_id):
+        return self._contents(cart_id, self.redis.hgetall(self._key(cart_id)))
+
+    def add(self, user, product_id, quantity):
+        if product_id not in get_catalog_product_map():
+            return None
+        key, now = self._key(user.id), time.time()
+        pipe = self.redis.pipeline()
+        pipe.hincrby(key, product_id, quantity)
+        pipe.hsetnx(key, 'created_at', now)
+        pipe.hset(key, 'updated_at', now)
+        pipe.expire(key, self.timeout)
+        pipe.hgetall(key)
+        return self._contents(user.id, pipe.execute()[-1])
+
+    def remove(self, user, item_id):
+        data = self.redis.eval(self.remove_script, 1, self._key(user.id),
+                               item_id, time.time(), self.timeout)
+        return self._contents(user.id, self._pairs(data))
+
+    def lock(self, user, cart_id):
+        """
+            Returns the user's cart with id cart_id, None if there is none, holding its
+            Redis lock (SET NX, expiring after CART_LOCK_TIMEOUT should the process die)
+            until clear_on_checkout has emptied it after the commit, or until unlock().
+            Waits up to CART_LOCK_TIMEOUT for a concurrent checkout, then raises CartLocked.
+        """
+        if cart_id != user.id:
+            return None
+        lock = self.redis.lock(self._lock_key(cart_id), timeout=settings.CART_LOCK_TIMEOUT,
+                               blocking_timeout=settings.CART_LOCK_TIMEOUT)
+        if not lock.acquire():
+            raise CartLocked(cart_id)
+        self.locks[cart_id] = lock
+        cart = self.get(user)
+        if cart is None:
+            self.unlock(cart_id)
+        return cart
+
+    def unlock(self, cart_id):
+        lock = self.locks.pop(cart_id, None)
+        if lock is not None:
+            try:
+                lock.release()
+            except LockError:
+                # Expired, maybe taken by another checkout since
+                pass
+
+    def clear_ordered(self, cart):
+        """
+            Takes the lines of cart, as returned by lock(), off the stored cart.
+            Adds are not locked out, anything added since lock() stays in the cart.
+        """
+        pairs = [value for product_id, quantity in cart.quantities().items()
+                 for value in (product_id, quantity)]
+        data = self.redis.eval(self.take_script, 1, self._key(cart.id),
+                               time.time(), self.timeout, *pairs)
+        return self._contents(cart.id, self._pairs(data))
+
+    def clear_on_checkout(self, cart):
+        # Redis is not part of the transaction, a rolled back checkout keeps the cart
+        def clear():
+            try:
+                self.clear_ordered(cart)
+            finally:
+                self.unlock(cart.id)
+        transaction.on_commit(clear)
+
+    def clear(self, user):
+        return self.clear_by_id(user.id)
+
+    def clear_by_id(self, cart_id):
+        data = self.redis.eval(self.clear_script, 1, self._key(cart_id),
+                               time.time(), self.timeout)
+        return self._contents(cart_id, self._pairs(data))
+
+    @staticmethod
+    def _pairs(data):
+        # HGETALL replies from a script come back as a flat list
+        return dict(zip(data[::2], data[1::2])) if data else {}
+
+    @staticmethod
+    def _timestamp(value):
+        return datetime.fromtimestamp(float(value), tz=timezone.utc)
+
+    def _contents(self, cart_id, data):
+        if not data:
+            return None
+        created_at = self._timestamp(data[b'created_at'])
+        products = get_catalog_product_map()
+        items = []
+        for field, quantity in data.items():
+            if field in self.meta_fields:
+                continue
+            product = products.get(int(field))
+            # Deleted products drop out of the cart
+            if product is not None:
+                items.append(CartItem(product.id, product, int(quantity), created_at))
+        return CartContents(int(cart_id), int(cart_id), items, created_at,
+                            self._timestamp(data[b'updated_at']))
@@ -0,0 +1,191 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+import json
+import logging
+import socket
+import time
+
+from ice_cream.models import IceCream
+from order.cart import get_cart_backend
+from order.models import Order, OrderLine
+from order.numbering import next_order_number
+from order.stock import reserve, hold_for_order, settle_orders
+from payment.api.views import create_and_process_payments
+
+logger = logging.getLogger(__name__)
+
+CHECKOUT_STREAM = 'checkout:stream'
+CHECKOUT_GROUP = 'checkout-writers'
+
+PENDING = 'pending'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+# Errors a checkout's own data causes, it would fail again however often it is retried.
+CHECKOUT_DATA_ERRORS = (IntegrityError, DataError)
+# Seconds before entries left pending by a failed batch are read again.
+RETRY_DELAY = 1
+
+
+def ticket_key(order_number):
+    return f'checkout:ticket:{order_number}'
+
+
+def get_ticket(order_number):
+    """
+        Returns {"order_number", "user_id", "status"} for a queued checkout,
+        None once expired or if it never existed.
+    """
+    return cache.get(ticket_key(order_number))
+
+
+def _set_tickets(tickets, status):
+    cache.set_many({ticket_key(ticket['order_number']): {
+        'order_number': ticket['order_number'], 'user_id': ticket['user_id'], 'status': status}
+        for ticket in tickets}, settings.CHECKOUT_TICKET_TIMEOUT)
+
+
+def submit_checkout(user, cart_id):
+    """
+        Queued counterpart of order.services.checkout: snapshots the cart, reserves
+        an order number and appends the checkout to a Redis stream, the order itself
+        is written later by consume(). The ordered lines are taken off the cart right
+        away, all under the cart's lock (see the cart backends' lock()), so a concurrent
+        submit of the same cart finds it empty, items added meanwhile stay in the cart.
+        Prices are those of the products when the order is written, the units are
+        reserved now, raises OutOfStock when they are no longer available.
+        Returns the pending ticket, None when the user has no cart with this id or it is empty.
+    """
+    cart_backend = get_cart_backend()
+    with transaction.atomic():
+        cart = cart_backend.lock(user, cart_id)
+        if cart is None:
+            return None
+        try:
+            if not cart.items:
+                return None
+            quantities = cart.quantities()
+            reserve(user, quantities, cover=True)
+            ticket = {'order_number': next_order_number(), 'user_id': user.id,
+                      'quantities': quantities}
+            _set_tickets([ticket], PENDING)
+            # MULTI/EXEC, the consumer can only settle the reservation once it was moved
+            pipe = get_redis_connection().pipeline()
+            hold_for_order(user.id, ticket['order_number'], quantities, pipe)
+            pipe.xadd(CHECKOUT_STREAM, {'ticket': json.dumps(ticket)})
+            pipe.execute()
+            cart_backend.clear_ordered(cart)
+        finally:
+            cart_backend.unlock(cart.id)
+    logger.info(f"Checkout of cart {cart_id} queued as order {ticket['order_number']}")
+    return {'order_number': ticket['order_number'], 'user_id': user.id, 'status': PENDING}
+
+
+def write_batch(tickets):
+    """
+        Writes the orders of many queued checkouts in one transaction, with one grouped
+        INSERT per table whatever the batch size. Tickets whose order already exists,
+        e.g. redelivered after a crash, are skipped.
+        Returns the orders created.
+    """
+    with transaction.atomic():
+        order_numbers = [ticket['order_number'] for ticket in tickets]
+        transaction.on_commit(lambda: settle_orders(order_numbers))
+        done = set(Order.objects.filter(order_number__in=order_numbers)
+                   .values_list('order_number', flat=True))
+        tickets = [ticket for ticket in tickets if ticket['order_number'] not in done]
+        products = IceCream.objects.in_bulk(
+            {int(product_id) for ticket in tickets for product_id in ticket['quantities']})
+
+        orders, lines, order_items = [], [], []
+        for ticket in tickets:
+            quantities = {int(product_id): quantity
+                          for product_id, quantity in ticket['quantities'].items()}
+            ordered = {product_id: products[product_id]
+                       for product_id in quantities if product_id in products}
+            order = Order(order_number=ticket['order_number'], created_by_id=ticket['user_id'])
+            lines += order.build_lines(ordered, quantities)
+            order_items += [(order, product_id) for product_id in ordered]
+            orders.append(order)
+
+        Order.objects.bulk_create(orders)
+        OrderLine.objects.bulk_create(lines)
+        Order.items.through.objects.bulk_create([
+            Order.items.through(order_id=order.id, icecream_id=product_id)
+            for order, product_id in order_items])
+        create_and_process_payments(orders)
+    return orders
+
+
+def _ensure_group(redis):
+    try:
+        redis.xgroup_create(CHECKOUT_STREAM, CHECKOUT_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def _process(redis, entries):
+    """
+        Writes the checkouts of a batch of stream entries and acknowledges them.
+        A checkout whose data the database rejects fails on its own, the others are
+        written one by one. Any other error, e.g. the database being unreachable,
+        is raised with the entries left pending: they are delivered again and
+        write_batch skips the orders already written.
+    """
+    tickets = {entry_id: json.loads(fields[b'ticket']) for entry_id, fields in entries}
+    try:
+        write_batch(list(tickets.values()))
+        _set_tickets(tickets.values(), COMPLETED)
+    except CHECKOUT_DATA_ERRORS as e:
+        # One bad checkout must not hold back the others, retry them one by one
+        logger.error(f"Writing {len(tickets)} queued checkouts failed, retrying one by one: {e}")
+        for ticket in tickets.values():
+            try:
+                write_batch([ticket])
+                _set_tickets([ticket], COMPLETED)
+            except CHECKOUT_DATA_ERRORS as e:
+                logger.error(f"Queued checkout for order {ticket['order_number']} failed: {e}")
+                _set_tickets([ticket], FAILED)
+                settle_orders([ticket['order_number']], written=False)
+    redis.xack(CHECKOUT_STREAM, CHECKOUT_GROUP, *tickets)
+    redis.xdel(CHECKOUT_STREAM, *tickets)
+
+
+def consume(batch_size=None, block=5000, consumer=None, once=False):
+    """
+        Drains the checkout stream as a member of the CHECKOUT_GROUP consumer group,
+        writing up to batch_size checkouts per transaction (see write_batch).
+        Entries delivered to this consumer but never acknowledged, e.g. before a crash,
+        are written first: give each consumer a stable name.
+        Waits up to block milliseconds for new entries, returns when none came if once.
+        Should writing a batch fail, e.g. on a database outage, its entries are read
+        again from the pending ones RETRY_DELAY seconds later.
+    """
+    redis = get_redis_connection()
+    batch_size = batch_size or settings.CHECKOUT_BATCH_SIZE
+    consumer = consumer or socket.gethostname()
+    _ensure_group(redis)
+
+    last_id = '0'
+    while True:
+        response = redis.xreadgroup(CHECKOUT_GROUP, consumer, {CHECKOUT_STREAM: last_id},
+                                    count=batch_size, block=None if last_id == '0' else block)
+        entries = response[0][1] if response else []
+        if entries:
+            try:
+                _process(redis, entries)
+            except Exception as e:
+                if once:
+                    raise
+                logger.error(f"Writing {len(entries)} queued checkouts failed, retrying: {e}")
+                close_old_connections()
+                time.sleep(RETRY_DELAY)
+                last_id = '0'
+        elif last_id == '0':
+            last_id = '>'
+        elif once:
+            return
@@ -0,0 +1,76 @@
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+import logging
+import time
+
+from helper.jobs import schedule_job, restart_job
+from ice_cream.models import IceCreamItem
+from order.models import Cart
+
+logger = logging.getLogger(__name__)
+
+
+def _delete_in_batches(queryset, batch_size, pause=0):
+    """
+        Deletes the rows of queryset batch_size primary keys at a time, each batch in its
+        own short transaction so no lock is held for long. Deleted rows no longer match,
+        an interrupted run simply resumes where it stopped.
+        Returns the number of queryset rows deleted, cascades excluded.
+    """
+    label = queryset.model._meta.label
+    total = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return total
+        # Filtering on queryset again skips rows that stopped matching meanwhile
+        _, deleted = queryset.filter(pk__in=ids).delete()
+        total += deleted.get(label, 0)
+        if pause:
+            time.sleep(pause)
+
+
+def delete_orphaned_items(batch_size=None, pause=0):
+    """
+        Deletes the IceCreamItem rows that no longer belong to any cart.
+    """
+    deleted = _delete_in_batches(IceCreamItem.objects.filter(cart__isnull=True),
+                                 batch_size or settings.CART_CLEANUP_BATCH_SIZE, pause)
+    logger.info(f"Deleted {deleted} orphaned cart items")
+    return deleted
+
+
+def delete_abandoned_carts(idle_timeout=None, batch_size=None, pause=0):
+    """
+        Deletes the database carts, and their items, not changed for idle_timeout seconds
+        (CART_TIMEOUT by default). Redis carts expire on their own.
+    """
+    cutoff = timezone.now() - timedelta(seconds=idle_timeout or settings.CART_TIMEOUT)
+    deleted = _delete_in_batches(Cart.objects.filter(updated_at__lt=cutoff),
+                                 batch_size or settings.CART_CLEANUP_BATCH_SIZE, pause)
+    logger.info(f"Deleted {deleted} carts idle since {cutoff}")
+    return deleted
+
+
+def cleanup_carts():
+    """
+        RQ job running both cleanups, then scheduling its next run CART_CLEANUP_INTERVAL
+        seconds later. Needs a worker started with --with-scheduler.
+    """
+    try:
+        delete_orphaned_items()
+        delete_abandoned_carts()
+    finally:
+        schedule_cleanup()
+
+
+def schedule_cleanup(delay=None):
+    return schedule_job(cleanup_carts, settings.CART_CLEANUP_INTERVAL if delay is None else delay)
+
+
+def start_cleanup():
+    """
+        Starts the recurring cleanup_carts job now, replacing any pending run.
+    """
+    return restart_job(cleanup_carts)
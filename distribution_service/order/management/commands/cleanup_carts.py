@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from order.cleanup import delete_orphaned_items, delete_abandoned_carts, start_cleanup
+
+
+class Command(BaseCommand):
+    help = 'Delete orphaned cart items and database carts idle for longer than CART_TIMEOUT, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-timeout', type=int,
+                            help='Seconds without change after which a cart is deleted, CART_TIMEOUT by default.')
+        parser.add_argument('--batch-size', type=int,
+                            help='Rows deleted per statement, CART_CLEANUP_BATCH_SIZE by default.')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches.')
+        parser.add_argument('--schedule', action='store_true',
+                            help='Start the recurring cleanup job on the default queue instead.')
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            start_cleanup()
+            self.stdout.write(self.style.SUCCESS("Cart cleanup job scheduled"))
+            return
+
+        items = delete_orphaned_items(options['batch_size'], options['pause'])
+        carts = delete_abandoned_carts(
+            options['idle_timeout'], options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{items} orphaned items and {carts} abandoned carts deleted"))
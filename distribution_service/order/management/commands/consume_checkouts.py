@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from order.checkout_queue import consume
+
+
+class Command(BaseCommand):
+    help = 'Write the orders of queued checkouts (CHECKOUT_QUEUED) from the Redis stream, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            help='Checkouts written per transaction, CHECKOUT_BATCH_SIZE by default.')
+        parser.add_argument('--block', type=int, default=5000,
+                            help='Milliseconds to wait for new checkouts.')
+        parser.add_argument('--consumer',
+                            help='Stable consumer name, the host name by default.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the stream is drained.')
+
+    def handle(self, *args, **options):
+        consume(batch_size=options['batch_size'], block=options['block'],
+                consumer=options['consumer'], once=options['once'])
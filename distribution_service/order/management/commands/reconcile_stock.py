@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from order.stock import expire_reservations, count_sales, sync_stock, start_reconcile
+
+
+class Command(BaseCommand):
+    help = 'Release expired stock reservations and deduct the units sold from Stock.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            help='Order lines counted per transaction, STOCK_RECONCILE_BATCH_SIZE by default.')
+        parser.add_argument('--schedule', action='store_true',
+                            help='Start the recurring reconcile job on the default queue instead.')
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            start_reconcile()
+            self.stdout.write(self.style.SUCCESS("Stock reconcile job scheduled"))
+            return
+
+        released = expire_reservations(options['batch_size'])
+        sold = count_sales(options['batch_size'])
+        sync_stock()
+        self.stdout.write(self.style.SUCCESS(
+            f"{released} reserved units released and {sold} sold units deducted"))
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ice_cream', '0016_icecreamitem_cart'),
+        ('order', '0007_remove_cart_current_user_remove_cart_deleted_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='cart',
+            name='items',
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:07
+
+from django.db import migrations, models
+from django.db.models import Max
+
+SEQUENCE = 'order_order_number_seq'
+
+
+def create_sequence(apps, schema_editor):
+    # Other databases use the OrderNumberCounter hi/lo table, seeded on first use.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Order = apps.get_model('order', 'Order')
+    last = Order.objects.aggregate(Max('order_number'))['order_number__max']
+    start = max(last or 0, 1000) + 1
+    schema_editor.execute(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE} START WITH {int(start)}")
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"DROP SEQUENCE IF EXISTS {SEQUENCE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0008_remove_cart_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.BigIntegerField(help_text='First order number of the next block.')),
+            ],
+        ),
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
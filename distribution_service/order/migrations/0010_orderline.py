@@ -0,0 +1,34 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ice_cream', '0017_alter_icecreamitem_cart_and_more'),
+        ('order', '0009_order_number_allocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('title', models.CharField(help_text='Product title at checkout.', max_length=300)),
+                ('flavor', models.CharField(help_text='Product flavor at checkout.', max_length=100)),
+                ('quantity', models.PositiveIntegerField(help_text='Number of units ordered.')),
+                ('unit_price', models.DecimalField(decimal_places=2, help_text='Product price at checkout.', max_digits=5)),
+                ('line_total', models.DecimalField(decimal_places=2, help_text='unit_price times quantity.', max_digits=12)),
+                ('ice_cream', models.ForeignKey(help_text='The product ordered, null once deleted.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='ice_cream.icecream')),
+                ('order', models.ForeignKey(help_text='The order this line belongs to.', on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='order.order')),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['flavor', 'order'], name='order_line_flavor_order_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:21
+
+from django.db import migrations, models
+
+
+def mark_existing_lines_counted(apps, schema_editor):
+    # Sales made before stock was tracked are not deducted from it.
+    OrderLine = apps.get_model('order', 'OrderLine')
+    OrderLine.objects.update(stock_counted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ice_cream', '0018_stock'),
+        ('order', '0010_orderline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderline',
+            name='stock_counted',
+            field=models.BooleanField(default=False, help_text='Whether the quantity was deducted from the product stock.'),
+        ),
+        migrations.RunPython(mark_existing_lines_counted, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='orderline',
+            index=models.Index(condition=models.Q(('stock_counted', False)), fields=['id'], name='order_line_uncounted_idx'),
+        ),
+    ]
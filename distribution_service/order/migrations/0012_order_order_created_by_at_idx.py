@@ -0,0 +1,20 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ice_cream', '0018_stock'),
+        ('order', '0011_orderline_stock_counted'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_by', 'created_at'], name='order_created_by_at_idx'),
+        ),
+    ]
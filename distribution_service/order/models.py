@@ -1,7 +1,7 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
-from ice_cream.models import Meta, IceCream, IceCreamItem
+from ice_cream.models import Meta, IceCream
 
 User = get_user_model()
 
@@ -34,8 +34,28 @@ class Order(Meta):
     def __str__(self):
         return f"order {self.order_number} for {self.created_by.username}"
 
+    def build_lines(self, products, quantities):
+        """
+        Returns one unsaved OrderLine per product, snapshotting the product's current
+        title, flavor and price, and sets total from them. Save the order first,
+        then write the lines with a single bulk_create.
+        products maps product ids to IceCream instances, quantities product ids to quantities.
+        """
+        lines = [
+            OrderLine(order=self, ice_cream=product, title=product.title, flavor=product.flavor,
+                      quantity=quantities[product_id], unit_price=product.price,
+                      line_total=product.price * quantities[product_id])
+            for product_id, product in products.items()
+        ]
+        self.total = sum(line.line_total for line in lines)
+        return lines
+
     class Meta(Meta.Meta):
         unique_together = [("order_number", "status")]
+        indexes = [
+            # A user's order history, newest first (see order_history)
+            models.Index(fields=['created_by', 'created_at'], name='order_created_by_at_idx'),
+        ]
 
     @classmethod
     def get_total_orders(cls):
@@ -43,26 +63,77 @@ class Order(Meta):
 
     @classmethod
     def get_orders_by_flavor(cls, flavor):
-        return cls.objects.filter(items__ice_cream__flavor=flavor)
+        # Single table, covered by the (flavor, order) index
+        return OrderLine.objects.filter(flavor=flavor).values('order_id').distinct().count()
 
     @classmethod
     def get_average_order_value(cls):
         return cls.objects.annotate(order_value=models.F('total')).aggregate(models.Avg('order_value'))
 
 
+class OrderLine(Meta):
+    """
+    The OrderLine model records one product of an order as it was at checkout:
+    its title, flavor and unit price are copied from the IceCream, together with the
+    quantity and the resulting line total. Later price changes or deleted products
+    do not alter past orders, and revenue or flavor figures are read from this table
+    alone, without joining the live catalog.
+    """
+    order = models.ForeignKey(
+        Order, related_name='lines', on_delete=models.CASCADE, help_text='The order this line belongs to.')
+    ice_cream = models.ForeignKey(
+        IceCream, related_name='order_lines', on_delete=models.SET_NULL, null=True,
+        help_text='The product ordered, null once deleted.')
+    title = models.CharField(max_length=300, help_text='Product title at checkout.')
+    flavor = models.CharField(max_length=100, help_text='Product flavor at checkout.')
+    quantity = models.PositiveIntegerField(help_text='Number of units ordered.')
+    unit_price = models.DecimalField(max_digits=5, decimal_places=2,
+                                     help_text='Product price at checkout.')
+    line_total = models.DecimalField(max_digits=12, decimal_places=2,
+                                     help_text='unit_price times quantity.')
+    stock_counted = models.BooleanField(
+        default=False, help_text='Whether the quantity was deducted from the product stock.')
+
+    def __str__(self):
+        return f"{self.quantity} x {self.title}"
+
+    class Meta(Meta.Meta):
+        indexes = [
+            models.Index(fields=['flavor', 'order'], name='order_line_flavor_order_idx'),
+            # Only the lines still to reconcile, see order.stock.count_sales
+            models.Index(fields=['id'], condition=models.Q(stock_counted=False),
+                         name='order_line_uncounted_idx'),
+        ]
+
+
 class Cart(Meta):
     """
     The Cart model, inheriting from Meta, is designed to represent a user's shopping cart
     in the system. It establishes a one-to-one relationship with the User model, 
-    ensuring each user has a unique cart. The cart can contain multiple IceCreamItem instances, 
-    allowing users to add various ice cream items to their cart. 
+    ensuring each user has a unique cart. The cart can contain multiple IceCreamItem instances
+    (IceCreamItem.cart, one per product), allowing users to add various ice cream items to their cart. 
     This model is key to managing the shopping cart functionality within the application, 
     offering a straightforward way to track user selections before purchase.
     """
     user = models.OneToOneField(
         User, related_name='cart', on_delete=models.CASCADE, help_text='cart owner.')
-    items = models.ManyToManyField(
-        IceCreamItem, related_name='cart', help_text='Items added to the cart.')
 
     def __str__(self) -> str:
         return f"Cart for {self.user.username}"
+
+    def touch(self):
+        """
+        Bumps updated_at, which versions the cart for conditional GETs.
+        Must be called whenever the cart items change.
+        """
+        self.save(update_fields=['updated_at'])
+
+
+class OrderNumberCounter(models.Model):
+    """
+    Single row hi/lo counter used to allocate order numbers on databases without
+    sequences (see order.numbering). next_value is the first number of the next
+    block to hand out, every allocation moves it forward by a whole block.
+    """
+    next_value = models.BigIntegerField(
+        help_text='First order number of the next block.')
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Max
+import threading
+
+from order.models import Order, OrderNumberCounter
+
+# Created by migration order 0009 on PostgreSQL.
+ORDER_NUMBER_SEQUENCE = 'order_order_number_seq'
+FIRST_ORDER_NUMBER = 1001
+
+
+def first_order_number():
+    """
+        The number following the highest one in use, used to seed the allocators.
+    """
+    last = Order.objects.aggregate(Max('order_number'))['order_number__max']
+    return max(last or 0, FIRST_ORDER_NUMBER - 1) + 1
+
+
+class HiLoAllocator:
+    """
+        Hands out order numbers from blocks of block_size reserved in OrderNumberCounter,
+        a single row UPDATE per block. Numbers are unique but, across processes,
+        neither ordered nor gapless.
+        A block reserved inside a transaction is only reused once that transaction
+        commits: after a rollback another process may be handed the same block.
+    """
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size or settings.ORDER_NUMBER_BLOCK_SIZE
+        self._next = self._high = 0
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        with self._lock:
+            if self._next < self._high:
+                number = self._next
+                self._next += 1
+                return number
+
+        low = self._reserve()
+        transaction.on_commit(lambda: self._keep(low + 1, low + self.block_size))
+        return low
+
+    def _keep(self, low, high):
+        with self._lock:
+            self._next, self._high = low, high
+
+    def _reserve(self):
+        counter = OrderNumberCounter.objects.filter(pk=1)
+        with transaction.atomic():
+            if not counter.update(next_value=F('next_value') + self.block_size):
+                OrderNumberCounter.objects.get_or_create(
+                    pk=1, defaults={'next_value': first_order_number()})
+                counter.update(next_value=F('next_value') + self.block_size)
+            return counter.values_list('next_value', flat=True).get() - self.block_size
+
+
+_hilo = HiLoAllocator()
+
+
+def next_order_number():
+    """
+        Returns a new unique order number in O(1), without locking the orders table.
+        PostgreSQL reads its sequence (nextval never blocks nor rolls back),
+        other databases fall back to HiLoAllocator.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [ORDER_NUMBER_SEQUENCE])
+            return cursor.fetchone()[0]
+    return _hilo.allocate()
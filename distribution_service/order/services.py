@@ -0,0 +1,52 @@
+from django.db import transaction
+import logging
+
+from ice_cream.models import IceCream
+from order.cart import get_cart_backend
+from order.models import Order, OrderLine
+from order.numbering import next_order_number
+from order.stock import reserve, sell
+from payment.api.views import create_and_process_payment
+
+logger = logging.getLogger(__name__)
+
+
+def checkout(user, cart_id):
+    """
+        Turns the user's cart into an order in a single transaction: locks the cart,
+        reads the current prices, writes the order, its lines (one bulk_create) and its
+        payment, and empties the cart. The payment job is queued once committed.
+        The number of queries does not depend on the cart size.
+        Units whose reservation expired are reserved again, raises OutOfStock
+        when they are no longer available.
+        Returns the order, None when the user has no cart with this id or it is empty,
+        e.g. emptied by a concurrent checkout of the same cart.
+    """
+    cart_backend = get_cart_backend()
+    with transaction.atomic():
+        cart = cart_backend.lock(user, cart_id)
+        if cart is None:
+            return None
+        if not cart.items:
+            cart_backend.unlock(cart.id)
+            return None
+        try:
+            quantities = cart.quantities()
+            reserve(user, quantities, cover=True)
+            # Prices are read from the database, never from the catalog cache.
+            products = IceCream.objects.in_bulk(quantities)
+
+            order = Order(order_number=next_order_number(), created_by=user)
+            lines = order.build_lines(products, quantities)
+            order.save()
+            OrderLine.objects.bulk_create(lines)
+            order.items.add(*products.values())
+            cart_backend.clear_on_checkout(cart)
+            create_and_process_payment(order)
+            transaction.on_commit(lambda: sell(user.id, quantities))
+        except BaseException:
+            cart_backend.unlock(cart.id)
+            raise
+
+    logger.info(f"Order {order.order_number} has been created from cart {cart_id}")
+    return order
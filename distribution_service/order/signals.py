@@ -0,0 +1,12 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from ice_cream.models import Stock
+from order.stock import sync_stock
+
+
+@receiver([post_save, post_delete], sender=Stock)
+def sync_stock_on_change(sender, instance, **kwargs):
+    product_id = instance.ice_cream_id
+    transaction.on_commit(lambda: sync_stock([product_id]))
@@ -0,0 +1,370 @@
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+from django_redis import get_redis_connection
+import logging
+import time
+
+from helper.jobs import schedule_job, restart_job
+from ice_cream.models import Stock
+from order.models import OrderLine
+
+logger = logging.getLogger(__name__)
+
+# Per product hash: available, reserved, or untracked when the product has no Stock row,
+# a mark that expires so unknown product ids do not pile up, and sold, the running count
+# of units sold, which lets sync_stock tell the sales it may have missed.
+# The units on hand are available + reserved + the sales not yet reconciled.
+STOCK_PREFIX = 'stock:'
+# Per user hash, product id -> units reserved for the user's cart.
+HOLD_PREFIX = 'stock:hold:'
+# Per queued order hash, product id -> units reserved until the order is written.
+ORDER_HOLD_PREFIX = 'stock:hold:order:'
+# User ids scored by the time their reservations expire.
+HOLDS_KEY = 'stock:holds'
+
+# KEYS[1] hold, KEYS[2] holds, KEYS[3:] product stocks,
+# ARGV[1] user id, ARGV[2] expires at, ARGV[3] 'add' or 'cover', then product id, quantity pairs.
+# 'add' reserves quantity more units, 'cover' tops the hold up to quantity units.
+# All or nothing: returns {'ok'}, {'short', product id} or {'missing', product id}.
+RESERVE_SCRIPT = """
+    local needs = {}
+    for j = 1, #KEYS - 2 do
+        local stock, product, quantity = KEYS[2 + j], ARGV[2 + 2 * j], tonumber(ARGV[3 + 2 * j])
+        if redis.call('HEXISTS', stock, 'untracked') == 0 then
+            local available = redis.call('HGET', stock, 'available')
+            if not available then
+                return {'missing', product}
+            end
+            local need = quantity
+            if ARGV[3] == 'cover' then
+                need = quantity - tonumber(redis.call('HGET', KEYS[1], product) or 0)
+            end
+            if need > tonumber(available) then
+                return {'short', product}
+            end
+            if need > 0 then
+                needs[#needs + 1] = {stock, product, need}
+            end
+        end
+    end
+    for _, need in ipairs(needs) do
+        redis.call('HINCRBY', need[1], 'available', -need[3])
+        redis.call('HINCRBY', need[1], 'reserved', need[3])
+        redis.call('HINCRBY', KEYS[1], need[2], need[3])
+    end
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+    end
+    return {'ok'}
+"""
+# KEYS[1] hold, KEYS[2] holds, KEYS[3:] product stocks, ARGV[1] user id,
+# ARGV[2] 'release' (back to available) or 'sell', ARGV[3] 'keep' or 'take',
+# ARGV[4] only if expired at that time or '', then product id, quantity pairs.
+# 'keep' lets go of every unit above quantity, 'take' of quantity units at most.
+# Sold units are added to the product's sold count. Returns the number of units let go.
+RELEASE_SCRIPT = """
+    if ARGV[4] ~= '' then
+        local expires_at = redis.call('ZSCORE', KEYS[2], ARGV[1])
+        if expires_at and tonumber(expires_at) > tonumber(ARGV[4]) then
+            return 0
+        end
+    end
+    local total = 0
+    for j = 1, #KEYS - 2 do
+        local stock, product, quantity = KEYS[2 + j], ARGV[3 + 2 * j], tonumber(ARGV[4 + 2 * j])
+        local held = tonumber(redis.call('HGET', KEYS[1], product) or 0)
+        local units = math.min(held, quantity)
+        if ARGV[3] == 'keep' then
+            units = held - units
+        end
+        if units > 0 then
+            redis.call('HINCRBY', stock, 'reserved', -units)
+            if ARGV[2] == 'release' then
+                redis.call('HINCRBY', stock, 'available', units)
+            else
+                redis.call('HINCRBY', stock, 'sold', units)
+            end
+            if units == held then
+                redis.call('HDEL', KEYS[1], product)
+            else
+                redis.call('HINCRBY', KEYS[1], product, -units)
+            end
+            total = total + units
+        end
+    end
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        redis.call('ZREM', KEYS[2], ARGV[1])
+    end
+    return total
+"""
+# KEYS[1] user hold, KEYS[2] holds, KEYS[3] order hold, ARGV[1] user id,
+# then product id, quantity pairs. Moves the units out of the expiring user hold.
+MOVE_SCRIPT = """
+    for i = 2, #ARGV, 2 do
+        local held = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or 0)
+        local units = math.min(held, tonumber(ARGV[i + 1]))
+        if units > 0 then
+            redis.call('HINCRBY', KEYS[3], ARGV[i], units)
+            if units == held then
+                redis.call('HDEL', KEYS[1], ARGV[i])
+            else
+                redis.call('HINCRBY', KEYS[1], ARGV[i], -units)
+            end
+        end
+    end
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        redis.call('ZREM', KEYS[2], ARGV[1])
+    end
+"""
+# KEYS[1] product stock, ARGV[1] units on hand less the sales not yet reconciled,
+# '' when the product is not tracked, ARGV[2] seconds the untracked mark is kept,
+# ARGV[3] the product's sold count read before the units on hand.
+# Units sold since then may have left the reservations without being in ARGV[1].
+SYNC_SCRIPT = """
+    if ARGV[1] == '' then
+        redis.call('HDEL', KEYS[1], 'available')
+        redis.call('HSET', KEYS[1], 'untracked', 1)
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+        return
+    end
+    local reserved = tonumber(redis.call('HGET', KEYS[1], 'reserved') or 0)
+    local sold = tonumber(redis.call('HGET', KEYS[1], 'sold') or 0) - tonumber(ARGV[3])
+    redis.call('HSET', KEYS[1], 'available', tonumber(ARGV[1]) - reserved - sold)
+    redis.call('HDEL', KEYS[1], 'untracked')
+    redis.call('PERSIST', KEYS[1])
+"""
+
+
+class OutOfStock(Exception):
+    """
+        Raised when fewer units of product_id are available than requested.
+    """
+    def __init__(self, product_id):
+        super().__init__(f"Product {product_id} is out of stock")
+        self.product_id = product_id
+
+
+def _redis():
+    return get_redis_connection('default')
+
+
+def _pairs(quantities):
+    return [value for product_id, quantity in quantities.items()
+            for value in (product_id, quantity)]
+
+
+def _release_args(hold, owner, mode, keep, expired_at, quantities):
+    # Every stock key the script touches is passed in KEYS
+    keys = [hold, HOLDS_KEY, *(f'{STOCK_PREFIX}{product_id}' for product_id in quantities)]
+    return (RELEASE_SCRIPT, len(keys), *keys, owner, mode, keep, expired_at or '', *_pairs(quantities))
+
+
+def _held(redis, holds):
+    """
+        Returns the product ids of each hold, read in one round trip. A product
+        reserved after the read is left out of the release, it was just renewed.
+    """
+    pipe = redis.pipeline(transaction=False)
+    for hold in holds:
+        pipe.hkeys(hold)
+    return [[int(product_id) for product_id in product_ids] for product_ids in pipe.execute()]
+
+
+def reserve(user, quantities, cover=False):
+    """
+        Reserves units for the user's cart in one atomic Redis script, all or nothing,
+        so thousands of concurrent buyers of one product only contend on a Redis key.
+        quantities maps product ids to units to add to the reservation, or with cover
+        to the units the reservation must hold (checkout). Reservations expire
+        STOCK_RESERVATION_TIMEOUT seconds after the user's last one.
+        Raises OutOfStock, does nothing unless STOCK_TRACKING.
+    """
+    if not settings.STOCK_TRACKING or not quantities:
+        return
+    redis = _redis()
+    expires_at = time.time() + settings.STOCK_RESERVATION_TIMEOUT
+    keys = [f'{HOLD_PREFIX}{user.id}', HOLDS_KEY,
+            *(f'{STOCK_PREFIX}{product_id}' for product_id in quantities)]
+    # Each retry loads one more product into Redis
+    for _ in range(len(quantities) + 1):
+        result = redis.eval(RESERVE_SCRIPT, len(keys), *keys, user.id, expires_at,
+                            'cover' if cover else 'add', *_pairs(quantities))
+        if result[0] == b'ok':
+            return
+        product_id = int(result[1])
+        if result[0] == b'short':
+            raise OutOfStock(product_id)
+        sync_stock([product_id])
+    raise RuntimeError(f"Stock of products {list(quantities)} could not be loaded")
+
+
+def release(user_id, quantities, expired_at=None):
+    """
+        Lets go of the user's reserved units above quantities, the cart's content
+        once an item was removed. Units are available again at once.
+        With expired_at, only if the reservation expired by then.
+    """
+    if not settings.STOCK_TRACKING:
+        return 0
+    redis, hold = _redis(), f'{HOLD_PREFIX}{user_id}'
+    held = {product_id: quantities.get(product_id, 0) for product_id in _held(redis, [hold])[0]}
+    return redis.eval(*_release_args(hold, user_id, 'release', 'keep', expired_at, held))
+
+
+def sell(user_id, quantities):
+    """
+        Settles the reservation of a written order, call once committed.
+        The units stay off the available count, reconciliation deducts them from Stock.
+    """
+    if not settings.STOCK_TRACKING:
+        return
+    _redis().eval(*_release_args(f'{HOLD_PREFIX}{user_id}', user_id, 'sell', 'take', None, quantities))
+
+
+def hold_for_order(user_id, order_number, quantities, redis=None):
+    """
+        Moves the units of a queued checkout out of the user's reservation, which
+        expires, into one kept until the order is written or fails (see settle_orders).
+        redis may be a pipeline, to move them along with queuing the checkout.
+    """
+    if not settings.STOCK_TRACKING:
+        return
+    # An empty pipeline is falsy
+    redis = _redis() if redis is None else redis
+    redis.eval(MOVE_SCRIPT, 3, f'{HOLD_PREFIX}{user_id}', HOLDS_KEY,
+               f'{ORDER_HOLD_PREFIX}{order_number}', user_id, *_pairs(quantities))
+
+
+def settle_orders(order_numbers, written=True):
+    """
+        Settles the reservations of queued orders, sold once written, released otherwise.
+    """
+    if not settings.STOCK_TRACKING:
+        return
+    redis = _redis()
+    holds = [f'{ORDER_HOLD_PREFIX}{order_number}' for order_number in order_numbers]
+    pipe = redis.pipeline(transaction=False)
+    for hold, product_ids in zip(holds, _held(redis, holds)):
+        pipe.eval(*_release_args(hold, '', 'sell' if written else 'release', 'keep', None,
+                                 dict.fromkeys(product_ids, 0)))
+    pipe.execute()
+
+
+def expire_reservations(batch_size=None):
+    """
+        Releases the reservations not renewed for STOCK_RESERVATION_TIMEOUT seconds,
+        the carts keep their items and are reserved again at checkout.
+    """
+    if not settings.STOCK_TRACKING:
+        return 0
+    redis = _redis()
+    batch_size = batch_size or settings.STOCK_RECONCILE_BATCH_SIZE
+    now = time.time()
+    released = 0
+    while True:
+        user_ids = redis.zrangebyscore(HOLDS_KEY, '-inf', now, start=0, num=batch_size)
+        if not user_ids:
+            break
+        holds = [f'{HOLD_PREFIX}{int(user_id)}' for user_id in user_ids]
+        pipe = redis.pipeline(transaction=False)
+        for user_id, hold, product_ids in zip(user_ids, holds, _held(redis, holds)):
+            pipe.eval(*_release_args(hold, user_id, 'release', 'keep', now,
+                                     dict.fromkeys(product_ids, 0)))
+        released += sum(pipe.execute())
+        # Renewed reservations keep their entry, stop rather than read them again
+        if len(user_ids) < batch_size:
+            break
+    logger.info(f"Released {released} units of expired stock reservations")
+    return released
+
+
+def count_sales(batch_size=None):
+    """
+        Deducts the order lines not yet counted from Stock, batch_size lines per
+        transaction with one UPDATE per product, and marks them counted.
+        Returns the number of units deducted.
+    """
+    batch_size = batch_size or settings.STOCK_RECONCILE_BATCH_SIZE
+    total = 0
+    while True:
+        with transaction.atomic():
+            lines = list(OrderLine.objects.select_for_update().filter(stock_counted=False)
+                         .order_by('pk').values_list('pk', 'ice_cream_id', 'quantity')[:batch_size])
+            if not lines:
+                break
+            sold = Counter()
+            for _, product_id, quantity in lines:
+                if product_id is not None:
+                    sold[product_id] += quantity
+            for product_id, quantity in sold.items():
+                total += quantity * Stock.objects.filter(ice_cream_id=product_id).update(
+                    quantity=F('quantity') - quantity)
+            OrderLine.objects.filter(pk__in=[pk for pk, _, _ in lines]).update(stock_counted=True)
+    logger.info(f"Deducted {total} sold units from stock")
+    return total
+
+
+def _on_hand(product_ids):
+    # Units on hand less the sales not yet counted, by product id
+    return dict(Stock.objects.filter(ice_cream_id__in=product_ids).annotate(uncounted=Coalesce(Sum(
+        'ice_cream__order_lines__quantity',
+        filter=Q(ice_cream__order_lines__stock_counted=False)), 0))
+        .values_list('ice_cream_id', F('quantity') - F('uncounted')))
+
+
+def sync_stock(product_ids=None):
+    """
+        Sets the Redis available count of products, all tracked ones by default,
+        from their Stock row less the sales not yet counted and the units reserved.
+        Corrects any drift, e.g. reservations sold by a checkout that crashed
+        before settling them.
+        A sale committed after the database read but settled (sell) before the Redis
+        write would leave the reservations without being deducted: the sold counts are
+        read first and the units sold since are deducted too. A sale committed before
+        the read and settled after it is deducted twice, until the next sync.
+    """
+    if not settings.STOCK_TRACKING:
+        return
+    if product_ids is None:
+        product_ids = list(Stock.objects.values_list('ice_cream_id', flat=True))
+    redis = _redis()
+    pipe = redis.pipeline(transaction=False)
+    for product_id in product_ids:
+        pipe.hget(f'{STOCK_PREFIX}{product_id}', 'sold')
+    sold = pipe.execute()
+
+    on_hand = _on_hand(product_ids)
+
+    pipe = redis.pipeline(transaction=False)
+    for product_id, sold_before in zip(product_ids, sold):
+        pipe.eval(SYNC_SCRIPT, 1, f'{STOCK_PREFIX}{product_id}', on_hand.get(product_id, ''),
+                  settings.STOCK_RESERVATION_TIMEOUT, int(sold_before or 0))
+    pipe.execute()
+
+
+def reconcile_stock():
+    """
+        RQ job expiring reservations and reconciling the sales with Stock and Redis,
+        then scheduling its next run STOCK_RECONCILE_INTERVAL seconds later.
+        Needs a worker started with --with-scheduler.
+    """
+    try:
+        expire_reservations()
+        count_sales()
+        sync_stock()
+    finally:
+        schedule_reconcile()
+
+
+def schedule_reconcile(delay=None):
+    return schedule_job(reconcile_stock, settings.STOCK_RECONCILE_INTERVAL if delay is None else delay)
+
+
+def start_reconcile():
+    """
+        Starts the recurring reconcile_stock job now, replacing any pending run.
+    """
+    return restart_job(reconcile_stock)
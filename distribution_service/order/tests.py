@@ -1,10 +1,55 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+import fakeredis
+import io
+import json
+import time
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.utils import timezone
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import IceCream, Cart, IceCreamItem, Order
+from .cart import DatabaseCartBackend, RedisCartBackend, CartLocked
+from .checkout_queue import write_batch, _set_tickets, submit_checkout, consume, get_ticket, \
+    CHECKOUT_STREAM, CHECKOUT_GROUP, PENDING, COMPLETED, FAILED
+from .cleanup import delete_orphaned_items, delete_abandoned_carts
+from .models import IceCream, Cart, Order, OrderLine
+from ice_cream.models import IceCreamItem, Stock
+from .numbering import HiLoAllocator, next_order_number
+from .services import checkout
+from .stock import count_sales, OutOfStock, reserve, release, sell, hold_for_order, settle_orders, \
+    expire_reservations, sync_stock, HOLDS_KEY
+from . import stock
+from payment.models import Payment, PaymentOutbox
 from django.contrib.auth.models import User
 
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class FakeRedisMixin:
+    """
+        Points the modules' Redis connections at an in-process fakeredis server,
+        Lua scripts included, empty for every test.
+    """
+    redis_modules = ('order.cart', 'order.stock', 'order.checkout_queue')
+
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        for module in self.redis_modules:
+            patcher = mock.patch(f'{module}.get_redis_connection', return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
 
 class AddItemToCartTestCase(TestCase):
     def setUp(self):
@@ -26,6 +71,152 @@ class AddItemToCartTestCase(TestCase):
         self.assertEqual(item.quantity, 2)
         self.assertEqual(item.ice_cream.id, self.ice_cream.id)
 
+    def test_add_item_invalid_quantity(self):
+        response = self.client.post(self.url, {'quantity': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_add_unknown_product(self):
+        response = self.client.post(reverse('add_item_to_cart', kwargs={
+                                    'product_id': self.ice_cream.id + 1}), format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_add_out_of_stock(self):
+        with mock.patch('order.api.views.reserve', side_effect=OutOfStock(self.ice_cream.id)):
+            response = self.client.post(self.url, {'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Cart.objects.exists())
+
+
+class DatabaseCartBackendTestCase(TestCase):
+    def setUp(self):
+        self.backend = DatabaseCartBackend()
+        self.user = User.objects.create_user(
+            username='user', password='password')
+        self.ice_cream = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", price=2.5)
+
+    def test_add_and_quantities(self):
+        self.backend.add(self.user, self.ice_cream.id, 2)
+        cart = self.backend.add(self.user, self.ice_cream.id, 3)
+        self.assertEqual(cart.user_id, self.user.id)
+        self.assertEqual(len(cart.items), 1)
+        self.assertEqual(cart.quantities(), {self.ice_cream.id: 5})
+        self.assertEqual(self.backend.get(self.user).quantities(), cart.quantities())
+
+    def test_concurrent_first_add_merges(self):
+        self.backend.add(self.user, self.ice_cream.id, 2)
+        merge = DatabaseCartBackend._merge
+        calls = []
+
+        def first_merge_misses(cart, product_id, quantity):
+            # As if another request created the item after this one looked for it
+            calls.append(quantity)
+            return 0 if len(calls) == 1 else merge(cart, product_id, quantity)
+
+        with mock.patch.object(DatabaseCartBackend, '_merge', side_effect=first_merge_misses):
+            cart = self.backend.add(self.user, self.ice_cream.id, 3)
+        self.assertEqual(cart.quantities(), {self.ice_cream.id: 5})
+        self.assertEqual(IceCreamItem.objects.count(), 1)
+
+    def test_remove_and_clear(self):
+        cart = self.backend.add(self.user, self.ice_cream.id, 2)
+        self.assertIsNone(self.backend.remove(self.user, cart.items[0].id + 1))
+        self.assertEqual(self.backend.remove(self.user, cart.items[0].id).items, [])
+        self.backend.add(self.user, self.ice_cream.id, 1)
+        self.assertEqual(self.backend.clear_by_id(cart.id).items, [])
+        self.assertIsNone(self.backend.clear_by_id(cart.id + 1))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CART_BACKEND='order.cart.RedisCartBackend', CART_LOCK_TIMEOUT=0.2)
+class RedisCartBackendTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.backend = RedisCartBackend()
+        self.user = User.objects.create_user(
+            username='user', password='password')
+        self.products = [IceCream.objects.create(title=f"Flavor {i}", flavor="vanilla", price=2.5)
+                         for i in range(2)]
+
+    def test_add_and_quantities(self):
+        self.assertIsNone(self.backend.get(self.user))
+        self.backend.add(self.user, self.products[0].id, 2)
+        cart = self.backend.add(self.user, self.products[0].id, 3)
+        self.assertEqual((cart.id, cart.user_id), (self.user.id, self.user.id))
+        self.assertEqual(len(cart.items), 1)
+        self.assertEqual(cart.quantities(), {self.products[0].id: 5})
+        self.assertEqual(self.backend.get(self.user).quantities(), cart.quantities())
+        self.assertIsNone(self.backend.add(self.user, self.products[1].id + 1, 1))
+        self.assertGreater(self.redis.ttl(f'cart:{self.user.id}'), 0)
+
+    def test_change_bumps_version(self):
+        first = self.backend.add(self.user, self.products[0].id, 1)
+        second = self.backend.add(self.user, self.products[1].id, 1)
+        self.assertEqual(second.created_at, first.created_at)
+        self.assertGreater(second.updated_at, first.updated_at)
+        self.assertGreater(self.backend.remove(self.user, self.products[1].id).updated_at, second.updated_at)
+
+    def test_remove_and_clear(self):
+        self.backend.add(self.user, self.products[0].id, 2)
+        self.assertIsNone(self.backend.remove(self.user, self.products[1].id))
+        self.assertEqual(self.backend.remove(self.user, self.products[0].id).items, [])
+        self.backend.add(self.user, self.products[1].id, 1)
+        self.assertEqual(self.backend.clear_by_id(self.user.id).items, [])
+        self.assertIsNone(self.backend.clear_by_id(self.user.id + 1))
+
+    def test_deleted_product_drops_out(self):
+        self.backend.add(self.user, self.products[0].id, 1)
+        self.backend.add(self.user, self.products[1].id, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[1].delete()
+        self.assertEqual(self.backend.get(self.user).quantities(), {self.products[0].id: 1})
+
+    def test_checkout_clears_cart_once_committed(self):
+        self.backend.add(self.user, self.products[0].id, 2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            order = checkout(self.user, self.user.id)
+            self.assertEqual(len(self.backend.get(self.user).items), 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(order.lines.get().quantity, 2)
+        self.assertEqual(self.backend.get(self.user).items, [])
+        self.assertFalse(self.redis.exists(f'cart:{self.user.id}:lock'))
+
+    def test_add_during_checkout_is_kept(self):
+        self.backend.add(self.user, self.products[0].id, 2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            order = checkout(self.user, self.user.id)
+            self.backend.add(self.user, self.products[0].id, 1)
+            self.backend.add(self.user, self.products[1].id, 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(order.lines.get().quantity, 2)
+        self.assertEqual(self.backend.get(self.user).quantities(),
+                         {self.products[0].id: 1, self.products[1].id: 1})
+
+    def test_checkout_holds_the_cart_lock(self):
+        self.backend.add(self.user, self.products[0].id, 2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            checkout(self.user, self.user.id)
+            # A concurrent checkout waits for the lock, then gives up
+            with self.assertRaises(CartLocked):
+                RedisCartBackend().lock(self.user, self.user.id)
+        for callback in callbacks:
+            callback()
+        # Once the first checkout emptied the cart there is nothing left to order
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(checkout(self.user, self.user.id))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_checkout_releases_the_lock(self):
+        self.backend.add(self.user, self.products[0].id, 2)
+        with mock.patch('order.services.create_and_process_payment', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                checkout(self.user, self.user.id)
+        self.assertEqual(len(self.backend.get(self.user).items), 1)
+        self.assertIsNotNone(RedisCartBackend().lock(self.user, self.user.id))
+
 
 class DeleteItemFromCartTestCase(TestCase):
     def setUp(self):
@@ -49,6 +240,7 @@ class DeleteItemFromCartTestCase(TestCase):
         self.assertFalse(self.cart.items.filter(id=self.item.id).exists())
 
 
+@override_settings(CACHES=LOCMEM_CACHES)
 class GetCartDetailsTestCase(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -66,6 +258,543 @@ class GetCartDetailsTestCase(TestCase):
         self.assertIn('items', response.data)
         self.assertEqual(response.data['id'], self.cart.id)
 
+    def test_get_cart_details_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_cart_change_invalidates_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        ice_cream = IceCream.objects.create(
+            title="Mint", flavor="mint", price=2.99)
+        self.client.post(reverse('add_item_to_cart', kwargs={
+                         'product_id': ice_cream.id}), {'quantity': 1}, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['items']), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CartPageFragmentCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='user', password='password')
+        self.client.force_login(self.user)
+        self.ice_cream = IceCream.objects.create(
+            title="Mint", flavor="mint", price=2.99)
+        self.url = reverse('cart_details')
+
+    def test_cart_change_renders_new_rows(self):
+        self.client.post(reverse('add_to_cart', kwargs={
+                         'product_id': self.ice_cream.id}), {'quantity': 2})
+        response = self.client.get(self.url)
+        self.assertContains(response, "<td>2</td>", html=True)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+        item = Cart.objects.get(user=self.user).items.get()
+        self.client.post(reverse('delete_from_cart', kwargs={'item_id': item.id}))
+        self.client.post(reverse('add_to_cart', kwargs={
+                         'product_id': self.ice_cream.id}), {'quantity': 5})
+        response = self.client.get(self.url)
+        self.assertContains(response, "<td>5</td>", html=True)
+        self.assertNotContains(response, "<td>2</td>", html=True)
+
+    def test_submit_while_checked_out(self):
+        self.client.post(reverse('add_to_cart', kwargs={
+                         'product_id': self.ice_cream.id}), {'quantity': 2})
+        cart = Cart.objects.get(user=self.user)
+        with mock.patch('order.views.checkout', side_effect=CartLocked(cart.id)):
+            response = self.client.post(reverse('submit_order', kwargs={'cart_id': cart.id}))
+        self.assertRedirects(response, self.url)
+        self.assertIn("The cart is already being checked out.",
+                      [str(message) for message in get_messages(response.wsgi_request)])
+
+
+class CartCleanupTestCase(TestCase):
+    def setUp(self):
+        self.ice_cream = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", price=2.5)
+        self.active = Cart.objects.create(
+            user=User.objects.create_user(username='active', password='password'))
+        self.idle = Cart.objects.create(
+            user=User.objects.create_user(username='idle', password='password'))
+        for cart in (self.active, self.idle):
+            IceCreamItem.objects.create(cart=cart, ice_cream=self.ice_cream)
+        Cart.objects.filter(id=self.idle.id).update(
+            updated_at=timezone.now() - timedelta(days=60))
+        for _ in range(3):
+            IceCreamItem.objects.create(ice_cream=self.ice_cream)
+
+    def test_delete_orphaned_items(self):
+        self.assertEqual(delete_orphaned_items(batch_size=2), 3)
+        self.assertFalse(IceCreamItem.objects.filter(cart__isnull=True).exists())
+        self.assertEqual(IceCreamItem.objects.count(), 2)
+
+    def test_delete_abandoned_carts(self):
+        self.assertEqual(delete_abandoned_carts(idle_timeout=60 * 60 * 24 * 30, batch_size=1), 1)
+        self.assertEqual(list(Cart.objects.all()), [self.active])
+        self.assertFalse(IceCreamItem.objects.filter(cart_id=self.idle.id).exists())
+
+    def test_cleanup_command(self):
+        out = io.StringIO()
+        call_command('cleanup_carts', '--batch-size', '2', stdout=out)
+        self.assertIn("3 orphaned items and 1 abandoned carts deleted", out.getvalue())
+        self.assertEqual(IceCreamItem.objects.get().cart, self.active)
+
+
+class OrderLineTestCase(TestCase):
+    def setUp(self):
+        self.vanilla = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", price=2.5)
+        self.mint = IceCream.objects.create(
+            title="Mint", flavor="mint", price=3)
+        self.order = Order.objects.create(order_number=2001)
+
+    def test_add_lines_snapshots_products(self):
+        products = {self.vanilla.id: self.vanilla, self.mint.id: self.mint}
+        lines = self.order.build_lines(products, {self.vanilla.id: 2, self.mint.id: 1})
+        self.assertEqual(self.order.total, Decimal('8.00'))
+        with self.assertNumQueries(1):
+            OrderLine.objects.bulk_create(lines)
+
+        IceCream.objects.filter(id=self.vanilla.id).update(price=9)
+        line = self.order.lines.get(ice_cream=self.vanilla)
+        self.assertEqual((line.quantity, line.unit_price, line.line_total),
+                         (2, Decimal('2.50'), Decimal('5.00')))
+
+    def test_orders_by_flavor(self):
+        OrderLine.objects.bulk_create(self.order.build_lines(
+            {self.vanilla.id: self.vanilla}, {self.vanilla.id: 1}))
+        other = Order.objects.create(order_number=2002)
+        OrderLine.objects.bulk_create(other.build_lines(
+            {self.vanilla.id: self.vanilla, self.mint.id: self.mint},
+            {self.vanilla.id: 1, self.mint.id: 4}))
+        self.assertEqual(Order.get_orders_by_flavor('vanilla'), 2)
+        self.assertEqual(Order.get_orders_by_flavor('mint'), 1)
+
+
+class CheckoutTestCase(TestCase):
+    # SAVEPOINT, lock cart, items, prices, order, lines, order items,
+    # empty cart, touch cart, payment, payment outbox, RELEASE SAVEPOINT
+    QUERY_BUDGET = 12
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='user', password='password')
+        self.backend = DatabaseCartBackend()
+        self.products = [IceCream.objects.create(title=f"Flavor {i}", flavor=f"flavor {i}", price=2 + i)
+                         for i in range(5)]
+
+    def fill_cart(self, products):
+        for product in products:
+            cart = self.backend.add(self.user, product.id, 2)
+        return cart
+
+    @mock.patch('order.services.next_order_number', side_effect=[3001, 3002])
+    def test_query_budget(self, _):
+        # Order number allocation left out, a single nextval on PostgreSQL
+        for products in (self.products[:1], self.products):
+            cart = self.fill_cart(products)
+            with self.assertNumQueries(self.QUERY_BUDGET):
+                order = checkout(self.user, cart.id)
+            self.assertEqual(order.lines.count(), len(products))
+
+        self.assertEqual(order.total, sum(2 * product.price for product in self.products))
+        self.assertEqual(self.backend.get(self.user).items, [])
+
+    def test_payment_job_written_to_outbox(self):
+        cart = self.fill_cart(self.products[:1])
+        order = checkout(self.user, cart.id)
+        self.assertEqual(PaymentOutbox.objects.get().payment, order.payment)
+        self.assertEqual(order.payment.amount, order.total)
+
+    def test_failure_rolls_back(self):
+        cart = self.fill_cart(self.products[:2])
+        with mock.patch('order.services.create_and_process_payment', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                checkout(self.user, cart.id)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(len(self.backend.get(self.user).items), 2)
+
+    def test_unknown_cart(self):
+        cart = self.fill_cart(self.products[:1])
+        other = User.objects.create_user(username='other', password='password')
+        self.assertIsNone(checkout(other, cart.id))
+
+    def test_out_of_stock(self):
+        cart = self.fill_cart(self.products[:2])
+        with mock.patch('order.services.reserve', side_effect=OutOfStock(self.products[0].id)):
+            with self.assertRaises(OutOfStock):
+                checkout(self.user, cart.id)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(len(self.backend.get(self.user).items), 2)
+
+
+class QueuedCheckoutWriteBatchTestCase(TestCase):
+    # SAVEPOINT, existing orders, prices, orders, lines, order items, payments,
+    # payment outbox, RELEASE SAVEPOINT
+    QUERY_BUDGET = 9
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'user{i}', password='password')
+                      for i in range(3)]
+        self.vanilla = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", price=2.5)
+        self.mint = IceCream.objects.create(
+            title="Mint", flavor="mint", price=3)
+
+    def tickets(self, first_number, users):
+        # Keys are strings once the ticket went through the stream
+        return [{'order_number': first_number + i, 'user_id': user.id,
+                 'quantities': {str(self.vanilla.id): 2, str(self.mint.id): i + 1}}
+                for i, user in enumerate(users)]
+
+    def test_grouped_inserts(self):
+        for first_number, users in ((4001, self.users[:1]), (4101, self.users)):
+            with self.assertNumQueries(self.QUERY_BUDGET):
+                orders = write_batch(self.tickets(first_number, users))
+            self.assertEqual(len(orders), len(users))
+
+        order = Order.objects.get(order_number=4103)
+        self.assertEqual(order.created_by, self.users[2])
+        self.assertEqual(order.total, Decimal('14.00'))
+        self.assertEqual(order.lines.count(), 2)
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(order.payment.amount, order.total)
+        self.assertEqual(PaymentOutbox.objects.count(), 4)
+
+    def test_redelivered_tickets_are_skipped(self):
+        write_batch(self.tickets(4001, self.users[:1]))
+        orders = write_batch(self.tickets(4001, self.users))
+        self.assertEqual([order.order_number for order in orders], [4002, 4003])
+        self.assertEqual(Order.objects.count(), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, STOCK_TRACKING=True, CART_BACKEND='order.cart.RedisCartBackend',
+                   CART_LOCK_TIMEOUT=0.2)
+class QueuedCheckoutTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='password')
+        self.vanilla = IceCream.objects.create(title="Vanilla", flavor="vanilla", price=2.5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.create(ice_cream=self.vanilla, quantity=10)
+        RedisCartBackend().add(self.user, self.vanilla.id, 4)
+
+    def stock(self):
+        return {field.decode(): int(value) for field, value in
+                self.redis.hgetall(f'stock:{self.vanilla.id}').items()}
+
+    def test_concurrent_submits_of_one_cart(self):
+        submit = submit_checkout
+        concurrent = []
+
+        def submitted_meanwhile(*args):
+            # Another request for the same cart while this one holds its lock
+            with self.assertRaises(CartLocked):
+                submit(self.user, self.user.id)
+            concurrent.append(True)
+            return next_order_number()
+
+        with mock.patch('order.checkout_queue.next_order_number', side_effect=submitted_meanwhile):
+            ticket = submit_checkout(self.user, self.user.id)
+        self.assertEqual(concurrent, [True])
+        # Once it let go, the cart is empty and there is nothing left to queue
+        self.assertIsNone(submit_checkout(self.user, self.user.id))
+        self.assertEqual(self.redis.xlen(CHECKOUT_STREAM), 1)
+        self.assertEqual(self.stock(), {'available': 6, 'reserved': 4})
+        self.assertEqual(ticket['status'], PENDING)
+
+    def test_add_during_submit_is_kept(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            chocolate = IceCream.objects.create(title="Chocolate", flavor="chocolate", price=3)
+
+        def added_meanwhile(*args):
+            RedisCartBackend().add(self.user, chocolate.id, 1)
+            return next_order_number()
+
+        with mock.patch('order.checkout_queue.next_order_number', side_effect=added_meanwhile):
+            submit_checkout(self.user, self.user.id)
+        self.assertEqual(RedisCartBackend().get(self.user).quantities(), {chocolate.id: 1})
+        ticket = json.loads(self.redis.xrange(CHECKOUT_STREAM)[0][1][b'ticket'])
+        self.assertEqual(ticket['quantities'], {str(self.vanilla.id): 4})
+
+    def test_database_outage_leaves_checkouts_pending(self):
+        ticket = submit_checkout(self.user, self.user.id)
+        with mock.patch('order.checkout_queue.write_batch', side_effect=OperationalError("server closed the connection")):
+            with self.assertRaises(OperationalError):
+                consume(block=1, consumer='writer', once=True)
+        self.assertEqual(self.redis.xpending(CHECKOUT_STREAM, CHECKOUT_GROUP)['pending'], 1)
+        self.assertEqual(get_ticket(ticket['order_number'])['status'], PENDING)
+        self.assertEqual(self.stock(), {'available': 6, 'reserved': 4})
+
+        # Delivered again once the database is back
+        with self.captureOnCommitCallbacks(execute=True):
+            consume(block=1, consumer='writer', once=True)
+        self.assertEqual(self.redis.xpending(CHECKOUT_STREAM, CHECKOUT_GROUP)['pending'], 0)
+        self.assertEqual(get_ticket(ticket['order_number'])['status'], COMPLETED)
+        self.assertEqual(Order.objects.get().order_number, ticket['order_number'])
+        self.assertEqual(self.stock(), {'available': 6, 'reserved': 0, 'sold': 4})
+
+    def test_rejected_checkout_fails_alone(self):
+        ticket = submit_checkout(self.user, self.user.id)
+        with mock.patch('order.checkout_queue.write_batch', side_effect=IntegrityError):
+            consume(block=1, consumer='writer', once=True)
+        self.assertEqual(self.redis.xlen(CHECKOUT_STREAM), 0)
+        self.assertEqual(get_ticket(ticket['order_number'])['status'], FAILED)
+        self.assertEqual(self.stock(), {'available': 10, 'reserved': 0})
+
+
+class OrderHistoryTestCase(TestCase):
+    # Orders with their payment, lines, EndpointPerformance insert from ResponseTimeMiddleware
+    PAGE_QUERIES = 3
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='user', password='password')
+        self.client.force_authenticate(user=self.user)
+        self.vanilla = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", price=2.5)
+        now = timezone.now()
+        for i in range(6):
+            order = Order.objects.create(order_number=6001 + i, created_by=self.user,
+                                         status='paid' if i % 2 else 'unpaid')
+            OrderLine.objects.bulk_create(order.build_lines(
+                {self.vanilla.id: self.vanilla}, {self.vanilla.id: i + 1}))
+            Payment.objects.create(order=order, amount=order.total,
+                                   payment_status='successful' if i % 2 else 'PENDING')
+            Order.objects.filter(id=order.id).update(created_at=now - timedelta(days=6 - i))
+        other = User.objects.create_user(username='other', password='password')
+        Order.objects.create(order_number=6101, created_by=other)
+        self.url = reverse('order_history')
+
+    def test_pages_cost_a_fixed_number_of_queries(self):
+        numbers, url = [], f'{self.url}?page_size=4'
+        while url:
+            with self.assertNumQueries(self.PAGE_QUERIES):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            numbers += [order['order_number'] for order in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(numbers, list(range(6006, 6000, -1)))
+
+        latest = self.client.get(self.url).data['results'][0]
+        self.assertEqual(latest['payment']['payment_status'], 'successful')
+        self.assertEqual(latest['lines'][0]['quantity'], 6)
+
+    def test_filters(self):
+        response = self.client.get(self.url, {
+            'status': 'paid', 'created_after': (timezone.now() - timedelta(days=4)).isoformat()})
+        self.assertEqual([order['order_number'] for order in response.data['results']], [6006, 6004])
+
+    def test_invalid_date_range(self):
+        now = timezone.now()
+        response = self.client.get(self.url, {
+            'created_after': now.isoformat(), 'created_before': (now - timedelta(days=1)).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StockReconcileTestCase(TestCase):
+    def setUp(self):
+        self.vanilla = IceCream.objects.create(
+            title="Vanilla", flavor="vanilla", price=2.5)
+        self.mint = IceCream.objects.create(
+            title="Mint", flavor="mint", price=3)
+        self.stock = Stock.objects.create(ice_cream=self.vanilla, quantity=10)
+        for order_number in (5001, 5002, 5003):
+            order = Order.objects.create(order_number=order_number)
+            OrderLine.objects.bulk_create(order.build_lines(
+                {self.vanilla.id: self.vanilla, self.mint.id: self.mint},
+                {self.vanilla.id: 2, self.mint.id: 1}))
+
+    def test_count_sales(self):
+        # Untracked products are marked counted without a Stock change
+        self.assertEqual(count_sales(batch_size=4), 6)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 4)
+        self.assertFalse(OrderLine.objects.filter(stock_counted=False).exists())
+        self.assertEqual(count_sales(), 0)
+
+    def test_reconcile_command(self):
+        out = io.StringIO()
+        call_command('reconcile_stock', stdout=out)
+        self.assertIn("0 reserved units released and 6 sold units deducted", out.getvalue())
+
+
+@override_settings(STOCK_TRACKING=True)
+class StockReservationTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='user', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        self.vanilla, self.mint, self.untracked = [IceCream.objects.create(
+            title=flavor, flavor=flavor, price=2.5) for flavor in ('vanilla', 'mint', 'lemon')]
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in (self.vanilla, self.mint):
+                Stock.objects.create(ice_cream=product, quantity=10)
+
+    def stock(self, product):
+        return {field.decode(): int(value) for field, value in
+                self.redis.hgetall(f'stock:{product.id}').items()}
+
+    def held(self, user):
+        return {int(product_id): int(quantity) for product_id, quantity in
+                self.redis.hgetall(f'stock:hold:{user.id}').items()}
+
+    def test_reserve(self):
+        reserve(self.user, {self.vanilla.id: 4})
+        reserve(self.user, {self.vanilla.id: 1})
+        self.assertEqual(self.held(self.user), {self.vanilla.id: 5})
+        self.assertEqual(self.stock(self.vanilla), {'available': 5, 'reserved': 5})
+        self.assertIsNotNone(self.redis.zscore(HOLDS_KEY, self.user.id))
+
+    def test_out_of_stock_reserves_nothing(self):
+        reserve(self.user, {self.vanilla.id: 4})
+        with self.assertRaises(OutOfStock) as raised:
+            reserve(self.other, {self.mint.id: 2, self.vanilla.id: 7})
+        self.assertEqual(raised.exception.product_id, self.vanilla.id)
+        self.assertEqual(self.held(self.other), {})
+        self.assertEqual(self.stock(self.mint)['available'], 10)
+
+    def test_cover_tops_the_reservation_up(self):
+        reserve(self.user, {self.vanilla.id: 3})
+        reserve(self.user, {self.vanilla.id: 5}, cover=True)
+        reserve(self.user, {self.vanilla.id: 5}, cover=True)
+        self.assertEqual(self.held(self.user), {self.vanilla.id: 5})
+        self.assertEqual(self.stock(self.vanilla)['available'], 5)
+        with self.assertRaises(OutOfStock):
+            reserve(self.user, {self.vanilla.id: 11}, cover=True)
+
+    def test_untracked_product(self):
+        reserve(self.user, {self.untracked.id: 100})
+        self.assertEqual(self.held(self.user), {})
+        self.assertEqual(self.stock(self.untracked), {'untracked': 1})
+
+    def test_release_above_cart_quantities(self):
+        reserve(self.user, {self.vanilla.id: 5, self.mint.id: 2})
+        self.assertEqual(release(self.user.id, {self.vanilla.id: 2}), 5)
+        self.assertEqual(self.held(self.user), {self.vanilla.id: 2})
+        self.assertEqual((self.stock(self.vanilla)['available'], self.stock(self.mint)['available']), (8, 10))
+        release(self.user.id, {})
+        self.assertEqual(self.held(self.user), {})
+        self.assertIsNone(self.redis.zscore(HOLDS_KEY, self.user.id))
+
+    def test_sell(self):
+        reserve(self.user, {self.vanilla.id: 3})
+        sell(self.user.id, {self.vanilla.id: 3})
+        self.assertEqual(self.held(self.user), {})
+        self.assertEqual(self.stock(self.vanilla), {'available': 7, 'reserved': 0, 'sold': 3})
+
+    def test_expired_reservations_are_released(self):
+        with override_settings(STOCK_RESERVATION_TIMEOUT=-1):
+            reserve(self.user, {self.vanilla.id: 3})
+        reserve(self.other, {self.vanilla.id: 2})
+        self.assertEqual(expire_reservations(), 3)
+        self.assertEqual((self.held(self.user), self.held(self.other)), ({}, {self.vanilla.id: 2}))
+        self.assertEqual(self.stock(self.vanilla)['available'], 8)
+
+    def test_queued_order_hold(self):
+        reserve(self.user, {self.vanilla.id: 4})
+        hold_for_order(self.user.id, 9001, {self.vanilla.id: 3})
+        self.assertEqual(self.held(self.user), {self.vanilla.id: 1})
+        # The order's units do not expire with the user's reservation
+        release(self.user.id, {}, expired_at=time.time() + 10 ** 6)
+        self.assertEqual(self.stock(self.vanilla), {'available': 7, 'reserved': 3})
+        settle_orders([9001], written=False)
+        self.assertEqual(self.stock(self.vanilla), {'available': 10, 'reserved': 0})
+
+        reserve(self.user, {self.vanilla.id: 2})
+        hold_for_order(self.user.id, 9002, {self.vanilla.id: 2})
+        settle_orders([9002])
+        self.assertEqual(self.stock(self.vanilla), {'available': 8, 'reserved': 0, 'sold': 2})
+
+    def test_sync_deducts_uncounted_sales_and_reservations(self):
+        reserve(self.user, {self.vanilla.id: 3})
+        order = Order.objects.create(order_number=9001)
+        OrderLine.objects.bulk_create(order.build_lines({self.vanilla.id: self.vanilla}, {self.vanilla.id: 2}))
+        self.redis.hset(f'stock:{self.vanilla.id}', 'available', 99)
+        sync_stock()
+        self.assertEqual(self.stock(self.vanilla)['available'], 5)
+        count_sales()
+        sync_stock()
+        self.assertEqual(self.stock(self.vanilla)['available'], 5)
+
+    def test_sale_settled_during_sync_is_deducted(self):
+        reserve(self.user, {self.vanilla.id: 3})
+        on_hand = stock._on_hand
+
+        def sale_committed_after_read(product_ids):
+            result = on_hand(product_ids)
+            order = Order.objects.create(order_number=9001)
+            OrderLine.objects.bulk_create(order.build_lines({self.vanilla.id: self.vanilla}, {self.vanilla.id: 3}))
+            sell(self.user.id, {self.vanilla.id: 3})
+            return result
+
+        with mock.patch('order.stock._on_hand', side_effect=sale_committed_after_read):
+            sync_stock([self.vanilla.id])
+        self.assertEqual(self.stock(self.vanilla)['available'], 7)
+        sync_stock()
+        self.assertEqual(self.stock(self.vanilla)['available'], 7)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CheckoutStatusTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='user', password='password')
+        self.client.force_authenticate(user=self.user)
+        self.ticket = {'order_number': 5001, 'user_id': self.user.id, 'quantities': {}}
+        self.url = reverse('checkout_status', kwargs={'order_number': 5001})
+
+    def test_pending(self):
+        _set_tickets([self.ticket], PENDING)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {'order_number': 5001, 'status': PENDING})
+
+    def test_failed(self):
+        _set_tickets([self.ticket], FAILED)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_409_CONFLICT)
+
+    def test_completed(self):
+        write_batch([self.ticket])
+        _set_tickets([self.ticket], COMPLETED)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['order_number'], 5001)
+
+    def test_other_users_ticket(self):
+        _set_tickets([self.ticket], PENDING)
+        self.client.force_authenticate(User.objects.create_user(
+            username='other', password='password'))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class OrderNumberAllocationTestCase(TestCase):
+    def test_seeded_after_existing_orders(self):
+        Order.objects.create(order_number=5000)
+        self.assertEqual(HiLoAllocator(block_size=10).allocate(), 5001)
+
+    def test_block_is_used_after_commit(self):
+        allocator = HiLoAllocator(block_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            first = allocator.allocate()
+        with self.assertNumQueries(0):
+            numbers = [allocator.allocate() for _ in range(9)]
+        self.assertEqual(numbers, list(range(first + 1, first + 10)))
+        self.assertEqual(allocator.allocate(), first + 10)
+
+    def test_uncommitted_block_is_not_used(self):
+        allocator, other = HiLoAllocator(block_size=10), HiLoAllocator(block_size=10)
+        first = allocator.allocate()
+        self.assertEqual(other.allocate(), first + 10)
+        self.assertEqual(allocator.allocate(), first + 20)
+
 
 class EmptyCartTestCase(TestCase):
     def setUp(self):
@@ -119,3 +848,14 @@ class CreateOrderTestCase(TestCase):
         self.assertEqual(order.created_by, self.user)
         self.assertEqual(order.items.count(), 1)
         self.assertEqual(order.items.first(), self.ice_cream)
+
+    def test_cart_being_checked_out(self):
+        with mock.patch('order.api.views.checkout', side_effect=CartLocked(self.cart.id)):
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_empty_cart(self):
+        self.cart.items.clear()
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Order.objects.exists())
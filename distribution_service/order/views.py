@@ -1,25 +1,29 @@
-from django.shortcuts import redirect, render, get_object_or_404
-from django.db.models import F, Sum, Max
+from django.shortcuts import redirect, render
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.http import Http404
 import logging
-from ice_cream.models import IceCreamItem, IceCream
-from order.models import Cart, Order
-from payment.api.views import create_and_process_payment
+from order.cart import get_cart_backend, CartLocked
+from order.services import checkout
+from order.stock import reserve, release, OutOfStock
 
 logger = logging.getLogger(__name__)
 
 
 @login_required
 def cart_details(request):
-    try:
-        cart = Cart.objects.get(user=request.user)
-        items = cart.items.prefetch_related('ice_cream')
+    cart = get_cart_backend().get(request.user)
+    if cart is not None:
+        items = cart.items
         cart_id = cart.id
-    except Cart.DoesNotExist:
+        # Keys the cached row fragments, see checkout/cart_details.html
+        cart_version = cart.updated_at.timestamp()
+    else:
         items = None
         cart_id = None
-    return render(request, 'checkout/cart_details.html', {'cart_items': items, 'cart_id': cart_id})
+        cart_version = None
+    return render(request, 'checkout/cart_details.html',
+                  {'cart_items': items, 'cart_id': cart_id, 'cart_version': cart_version})
 
 
 @login_required
@@ -33,13 +37,14 @@ def add_to_cart(request, product_id=None):
         messages.error(request, "Invalid quantity.")
         return redirect('ice_cream_list')
 
-    cart, _ = Cart.objects.get_or_create(user=request.user)
-    ice_cream = get_object_or_404(IceCream, id=product_id)
-
-    item = IceCreamItem.objects.create(
-        ice_cream=ice_cream, quantity=quantity)
+    try:
+        reserve(request.user, {product_id: quantity})
+    except OutOfStock:
+        messages.error(request, "Not enough stock for this product.")
+        return redirect('ice_cream_list')
 
-    cart.items.add(item)
+    if get_cart_backend().add(request.user, product_id, quantity) is None:
+        raise Http404("No IceCream matches the given query.")
 
     messages.success(request, "Item added to cart successfully.")
     return redirect('ice_cream_list')
@@ -47,33 +52,26 @@ def add_to_cart(request, product_id=None):
 
 @login_required
 def delete_from_cart(request, item_id=None):
-    # Ensures cart exists for the user
-    cart = get_object_or_404(Cart, user=request.user)
     # Validates item is in user's cart
-    item = get_object_or_404(IceCreamItem, id=item_id, cart=cart)
-    cart.items.remove(item)
+    cart = get_cart_backend().remove(request.user, item_id)
+    if cart is None:
+        raise Http404("No item matches the given query.")
+    release(request.user.id, cart.quantities())
 
     return redirect('cart_details')
 
 
 @login_required
 def submit_order(request, cart_id=None):
-    cart = get_object_or_404(Cart, id=cart_id, user=request.user)
-    items = cart.items.prefetch_related('ice_cream')
-
-    last_order_number = Order.objects.all().aggregate(
-        Max('order_number'))['order_number__max']
-
-    next_order_number = (last_order_number or 1000) + 1
-    order = Order.objects.create(
-        order_number=next_order_number, created_by=request.user)
-
-    total = items.annotate(item_total=Sum(
-        F('quantity') * F('ice_cream__price'))).aggregate(total=Sum('item_total'))['total']
-    order.items.add(*[item.ice_cream for item in items])
-    order.total = total or 0
-    order.save()
-    cart.items.clear()
-    create_and_process_payment(order)
+    try:
+        order = checkout(request.user, cart_id)
+    except OutOfStock:
+        messages.error(request, "Some items are no longer in stock.")
+        return redirect('cart_details')
+    except CartLocked:
+        messages.error(request, "The cart is already being checked out.")
+        return redirect('cart_details')
+    if order is None:
+        raise Http404("No cart matches the given query.")
 
     return render(request, 'checkout/order_submited.html', {'order_number': order.order_number})
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from payment.models import Payment
+from payment.models import Payment, PaymentOutbox
 
 admin.site.register(Payment)
+admin.site.register(PaymentOutbox)
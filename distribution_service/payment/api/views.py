@@ -2,72 +2,158 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.utils import timezone
 
 from drf_spectacular.utils import extend_schema
 
-import django_rq
-import random
+from rq import Queue, Retry
 import time
 import logging
 
+from helper.pagination import KeysetPagination, paginated
+from order.models import Order
 from payment.api.serializers import PaymentSerializer
-from payment.models import Payment
+from payment.gateway import get_gateway
+from payment.models import Payment, PaymentOutbox
 
 logger = logging.getLogger(__name__)
 
 
-def update_order_and_payment(order, payment, payment_status, start_time):
-    payment.payment_status = payment_status
-    payment.processing_time_seconds = time.time() - start_time
-    payment.save()
+def get_pending_amount(payment_id):
+    """
+        Returns the amount of a payment still waiting for processing, None once processed:
+        a redelivered job must not charge twice.
+    """
+    return Payment.objects.filter(id=payment_id, payment_status='PENDING').values_list(
+        'amount', flat=True).first()
+
+
+def update_order_and_payment(payment_id, order_id, payment_status, start_time):
+    """
+        Records the outcome with targeted UPDATEs of the fresh rows, only while the payment
+        is still PENDING so a duplicate job can never overwrite it. Returns whether it did.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        updated = Payment.objects.filter(id=payment_id, payment_status='PENDING').update(
+            payment_status=payment_status, processing_time_seconds=time.time() - start_time,
+            updated_at=now)
+        if updated and payment_status == 'successful':
+            Order.objects.filter(id=order_id, status='unpaid').update(status='paid', updated_at=now)
+    return bool(updated)
 
-    if payment_status == 'successful':
-        order.status = 'paid'
-        order.save()
+
+def get_pending_amounts(payment_ids):
+    """
+        Bulk version of get_pending_amount: one query for the payments still pending,
+        returns their amounts by id.
+    """
+    return dict(Payment.objects.filter(id__in=payment_ids, payment_status='PENDING').values_list(
+        'id', 'amount'))
 
 
-def process_payment(order, payment):
+def update_orders_and_payments(outcomes, start_time):
     """
-        This function simulate a payment process adding a delay and randomly generating an output.
-        Output can be either False or True.
-        It takes (order, payment) as parameters and calls "update_order_and_payment" to update
-        both order and payment data.
+        Bulk version of update_order_and_payment, outcomes maps payment ids to whether they
+        were approved. The payments still PENDING are locked and written with one bulk_update,
+        the orders of the approved ones are marked paid with one UPDATE.
+        Returns the ids of the payments written.
     """
-    logger.info(f'payment for order {order.order_number} initiated')
+    now = timezone.now()
+    processing_time = time.time() - start_time
+    with transaction.atomic():
+        payments = list(Payment.objects.select_for_update()
+                        .filter(id__in=outcomes, payment_status='PENDING')
+                        .only('id', 'order_id'))
+        for payment in payments:
+            payment.payment_status = 'successful' if outcomes[payment.id] else 'faild'
+            payment.processing_time_seconds = processing_time
+            payment.updated_at = now
+        Payment.objects.bulk_update(
+            payments, ['payment_status', 'processing_time_seconds', 'updated_at'])
+        paid = [payment.order_id for payment in payments if outcomes[payment.id]]
+        if paid:
+            Order.objects.filter(id__in=paid, status='unpaid').update(status='paid', updated_at=now)
+    return [payment.id for payment in payments]
+
+
+def process_payment(payment_id, order_id, order_number):
+    """
+        Charges the payment through the configured gateway (see payment.gateway).
+        Output can be either False or True. GatewayError is raised when the outcome is
+        unknown, the payment then stays PENDING and the job is retried (see payment_job_data).
+        The job carries ids only, rows are read and written by update_order_and_payment,
+        order_number is for logging.
+    """
+    amount = get_pending_amount(payment_id)
+    if amount is None:
+        logger.info(f'payment for order {order_number} already processed')
+        return None
+    logger.info(f'payment for order {order_number} initiated')
     start_time = time.time()
-    time.sleep(random.randint(1, 10))  # Simulate processing delay
-    payment_successful = random.choice([True, False])
+    payment_successful = get_gateway().charge(payment_reference(payment_id), amount)
     if payment_successful:
-        update_order_and_payment(order, payment, 'successful', start_time)
-        logger.info(f'payment for order {order.order_number} successful')
+        update_order_and_payment(payment_id, order_id, 'successful', start_time)
+        logger.info(f'payment for order {order_number} successful')
     else:
-        logger.error(f"Payment for order {order.order_number} failed.")
-        update_order_and_payment(order, payment, 'faild', start_time)
+        logger.error(f"Payment for order {order_number} failed.")
+        update_order_and_payment(payment_id, order_id, 'faild', start_time)
     return payment_successful
 
 
+def payment_reference(payment_id):
+    # Also the job id and the gateway's idempotency key
+    return f'payment-{payment_id}'
+
+
+def payment_job_data(payment_id, order_id, order_number):
+    """
+        Enqueue arguments of the payment's processing job: a few integers instead of
+        pickled model instances, and short TTLs so finished job hashes do not pile up.
+        The job id is derived from the payment, a job dispatched twice replaces itself.
+        A failed job, e.g. on a GatewayError, is retried after each of PAYMENT_RETRY_INTERVALS.
+    """
+    intervals = settings.PAYMENT_RETRY_INTERVALS
+    return Queue.prepare_data(
+        process_payment, (payment_id, order_id, order_number), job_id=payment_reference(payment_id),
+        result_ttl=settings.PAYMENT_RESULT_TTL, failure_ttl=settings.PAYMENT_FAILURE_TTL,
+        retry=Retry(max=len(intervals), interval=intervals) if intervals else None)
+
+
 def create_and_process_payment(order):
     """
         Create an initiate the payment.
-        Returns payment details
+        Its processing job is written to the outbox in the caller's transaction,
+        the relay queues it once committed (see payment.outbox).
+        Returns the payment
     """
-    print(order)
     payment = Payment.objects.create(
         order=order, amount=order.total, payment_id=f"PAY{order.order_number}")
-    payment.save()
+    PaymentOutbox.objects.create(payment=payment)
 
-    queue = django_rq.get_queue('default')
-    queue.enqueue(process_payment, order, payment)
+    return payment
 
-    serializer = PaymentSerializer(payment)
 
-    return Response(serializer.data)
+def create_and_process_payments(orders):
+    """
+        Bulk version of create_and_process_payment: one INSERT for all the payments,
+        one for their outbox entries.
+        Returns the payments
+    """
+    payments = Payment.objects.bulk_create([
+        Payment(order=order, amount=order.total, payment_id=f"PAY{order.order_number}")
+        for order in orders])
+    PaymentOutbox.objects.bulk_create([PaymentOutbox(payment=payment) for payment in payments])
+
+    return payments
 
 
 @extend_schema(
     request=None,
-    responses={status.HTTP_200_OK: PaymentSerializer},
+    responses={status.HTTP_200_OK: paginated(PaymentSerializer)},
 )
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -77,14 +163,18 @@ def get_all_payments(request):
     Superusers can view all payments across the platform, 
     while other authenticated users can only see payments related to their own orders. 
     The response provid detailed information on each payment in a structured format.
+    Results are paginated newest first, follow the "next" link (cursor) for older payments.
     """
     if request.user.is_superuser:
         payments = Payment.objects.all()
     else:
         payments = Payment.objects.filter(order__created_by=request.user)
 
-    serializer = PaymentSerializer(payments, many=True)
-    return Response(serializer.data)
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(
+        payments.select_related('order'), request)
+    serializer = PaymentSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @extend_schema(
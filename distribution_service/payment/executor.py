@@ -0,0 +1,266 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rq.exceptions import DequeueTimeout
+from rq.job import JobStatus
+from rq.queue import Queue
+from rq.scheduler import RQScheduler
+from rq.utils import utcnow
+import asyncio
+import django_rq
+import logging
+import signal
+import socket
+import time
+import traceback
+
+from payment.api.views import (
+    process_payment, update_order_and_payment, get_pending_amount, payment_reference,
+    get_pending_amounts, update_orders_and_payments)
+from payment.gateway import get_gateway, GatewayError
+
+logger = logging.getLogger(__name__)
+
+# Seconds a dequeue blocks, how quickly a stop request is noticed.
+DEQUEUE_TIMEOUT = 1
+RESULT_TTL = 500
+
+
+def _in_thread(func):
+    def run(*args):
+        # Runs in the default executor's threads, each with its own database connection
+        close_old_connections()
+        return func(*args)
+    return sync_to_async(run, thread_sensitive=False)
+
+
+async def process_payment_async(payment_id, order_id, order_number):
+    """
+        Same as process_payment, the wait on the gateway yields to the event loop
+        instead of blocking the process.
+    """
+    amount = await _in_thread(get_pending_amount)(payment_id)
+    if amount is None:
+        logger.info(f'payment for order {order_number} already processed')
+        return None
+    logger.info(f'payment for order {order_number} initiated')
+    start_time = time.time()
+    payment_successful = await get_gateway().charge_async(payment_reference(payment_id), amount)
+    update = _in_thread(update_order_and_payment)
+    if payment_successful:
+        await update(payment_id, order_id, 'successful', start_time)
+        logger.info(f'payment for order {order_number} successful')
+    else:
+        logger.error(f"Payment for order {order_number} failed.")
+        await update(payment_id, order_id, 'faild', start_time)
+    return payment_successful
+
+
+async def process_payments_async(payments):
+    """
+        Batch version of process_payment_async, payments are (payment_id, order_id,
+        order_number) tuples: one query for the amounts, one gateway call for the batch
+        and one bulk write of the outcomes. Returns the outcomes by payment id, True or
+        False, or None when already processed. GatewayError is raised when the outcome
+        of the whole batch is unknown, payments left out of the gateway's answer are
+        left out of the outcomes and stay PENDING.
+    """
+    amounts = await _in_thread(get_pending_amounts)([payment[0] for payment in payments])
+    outcomes = {payment_id: None for payment_id, _, _ in payments if payment_id not in amounts}
+    if not amounts:
+        return outcomes
+    logger.info(f'payment batch of {len(amounts)} initiated')
+    start_time = time.time()
+    references = {payment_reference(payment_id): payment_id for payment_id in amounts}
+    approved = await get_gateway().charge_batch_async(
+        {reference: amounts[payment_id] for reference, payment_id in references.items()})
+    charged = {references[reference]: successful for reference, successful in approved.items()}
+    await _in_thread(update_orders_and_payments)(charged, start_time)
+    logger.info(f'payment batch of {len(amounts)} done, '
+                f'{sum(charged.values())} successful, {len(amounts) - len(charged)} unknown')
+    return {**outcomes, **charged}
+
+
+class PaymentBatcher:
+    """
+        Gathers the payment jobs of an executor into batches of up to size payments,
+        waiting at most wait seconds after the first one, and submits each batch with
+        process_payments_async. Every job awaits the outcome of its own payment.
+    """
+
+    def __init__(self, size, wait):
+        self.size = size
+        self.wait = wait
+        self.payments = []
+        self.timer = None
+        self.batches = set()
+
+    async def process_payment(self, payment_id, order_id, order_number):
+        future = asyncio.get_running_loop().create_future()
+        self.payments.append(((payment_id, order_id, order_number), future))
+        if len(self.payments) >= self.size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        payments, self.payments = self.payments, []
+        if payments:
+            task = asyncio.create_task(self._submit(payments))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def _submit(self, payments):
+        try:
+            outcomes = await process_payments_async([payment for payment, _ in payments])
+        except Exception as e:
+            outcomes = e
+        for (payment_id, _, order_number), future in payments:
+            if future.done():
+                # Its job timed out
+                continue
+            if isinstance(outcomes, Exception):
+                future.set_exception(outcomes)
+            elif payment_id not in outcomes:
+                future.set_exception(GatewayError(f"Payment for order {order_number} has no outcome"))
+            else:
+                future.set_result(outcomes[payment_id])
+
+
+# Jobs run natively on the event loop, any other job runs in a thread.
+ASYNC_JOBS = {process_payment: process_payment_async}
+
+
+class PaymentExecutor:
+    """
+        Runs the jobs of an RQ queue on an asyncio event loop, up to concurrency at once,
+        so a single process keeps hundreds of slow gateway calls in flight where an
+        rqworker process waits on one at a time. Job status, the started, finished and
+        failed registries, results and retries are kept like rqworker does, and like
+        rqworker --with-scheduler it moves the queue's due retries back to the queue.
+        With a batch_size above 1 the payment jobs are charged in batches (see PaymentBatcher),
+        the gateway round trip and the database writes are then shared by the batch.
+        Stops dequeuing on SIGINT or SIGTERM and returns once the running jobs are done.
+    """
+
+    def __init__(self, queue=None, concurrency=None, name=None, batch_size=None, batch_wait=None):
+        self.queue = django_rq.get_queue(queue or settings.PAYMENT_QUEUE)
+        self.connection = self.queue.connection
+        self.concurrency = concurrency or settings.PAYMENT_CONCURRENCY
+        self.name = name or f'payment-executor:{socket.gethostname()}'
+        self.stopping = False
+        batch_size = batch_size or settings.PAYMENT_BATCH_SIZE
+        batch_wait = settings.PAYMENT_BATCH_WAIT if batch_wait is None else batch_wait
+        self.async_jobs = dict(ASYNC_JOBS)
+        self.batcher = PaymentBatcher(batch_size, batch_wait) if batch_size > 1 else None
+        if self.batcher is not None:
+            self.async_jobs[process_payment] = self.batcher.process_payment
+
+    def run(self):
+        asyncio.run(self._run())
+
+    def stop(self):
+        self.stopping = True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        scheduling = asyncio.create_task(self._schedule())
+        logger.info(f"{self.name} executing jobs from {self.queue.name}, {self.concurrency} at a time")
+
+        while not self.stopping:
+            await semaphore.acquire()
+            job = await asyncio.to_thread(self._dequeue)
+            if job is None:
+                semaphore.release()
+                continue
+            task = asyncio.create_task(self._perform(job))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+        if tasks:
+            logger.info(f"{self.name} stopping, waiting for {len(tasks)} running jobs")
+            await asyncio.gather(*tasks)
+        await scheduling
+
+    async def _schedule(self):
+        scheduler = RQScheduler([self.queue.name], connection=self.connection)
+        while not self.stopping:
+            try:
+                await asyncio.to_thread(self._enqueue_scheduled, scheduler)
+            except Exception as e:
+                logger.error(f"{self.name} failed to enqueue scheduled jobs: {e}")
+            await asyncio.sleep(scheduler.interval)
+        if scheduler.acquired_locks:
+            await asyncio.to_thread(scheduler.release_locks)
+
+    @staticmethod
+    def _enqueue_scheduled(scheduler):
+        # One scheduler per queue at a time, the others take over should it die
+        if scheduler.should_reacquire_locks:
+            scheduler.acquire_locks()
+        if scheduler.acquired_locks:
+            scheduler.enqueue_scheduled_jobs()
+            scheduler.heartbeat()
+
+    def _dequeue(self):
+        try:
+            result = Queue.dequeue_any([self.queue], DEQUEUE_TIMEOUT, connection=self.connection)
+        except DequeueTimeout:
+            return None
+        if result is None:
+            return None
+        job, _ = result
+        timeout = job.timeout or self.queue.DEFAULT_TIMEOUT
+        # prepare_for_execution, intermediate_queue_key, _handle_success and _handle_failure
+        # are RQ internals, called the way rqworker does: rq is pinned to an exact version
+        # in requirements.txt, check these calls when upgrading it
+        with self.connection.pipeline() as pipe:
+            job.prepare_for_execution(self.name, pipe)
+            self.queue.started_job_registry.add(job, timeout + 60, pipe)
+            pipe.lrem(self.queue.intermediate_queue_key, 1, job.id)
+            pipe.execute()
+        return job
+
+    async def _perform(self, job):
+        timeout = job.timeout or self.queue.DEFAULT_TIMEOUT
+        try:
+            func = self.async_jobs.get(job.func)
+            if func is not None:
+                call = func(*job.args, **job.kwargs)
+            else:
+                call = asyncio.to_thread(job.func, *job.args, **job.kwargs)
+            job._result = await asyncio.wait_for(call, timeout)
+        except Exception:
+            logger.exception(f"Job {job.id} failed")
+            await asyncio.to_thread(self._finish, job, traceback.format_exc())
+        else:
+            await asyncio.to_thread(self._finish, job)
+
+    def _finish(self, job, exc_string=None):
+        with self.connection.pipeline() as pipe:
+            self.queue.started_job_registry.remove(job, pipeline=pipe)
+            job.ended_at = utcnow()
+            if exc_string is None:
+                result_ttl = job.get_result_ttl(RESULT_TTL)
+                if result_ttl != 0:
+                    # RQ internal, see _dequeue
+                    job._handle_success(result_ttl, pipe)
+                # Deletes the job hash right away when results are not kept
+                job.cleanup(result_ttl, pipeline=pipe, remove_from_queue=False)
+            elif job.retries_left:
+                # Scheduled after its retry interval, see _schedule
+                job.retry(self.queue, pipe)
+            else:
+                job.set_status(JobStatus.FAILED, pipeline=pipe)
+                # RQ internal, see _dequeue
+                job._handle_failure(exc_string, pipe)
+            pipe.execute()
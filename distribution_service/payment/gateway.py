@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+import asyncio
+import functools
+import random
+import requests
+import time
+import urllib.parse
+
+
+class GatewayError(Exception):
+    """
+        The gateway could not be reached or did not answer in time, the charge
+        outcome is unknown. Unlike a decline, the payment can be retried.
+    """
+
+
+@functools.cache
+def get_gateway():
+    """
+        Returns the process wide instance of settings.PAYMENT_GATEWAY, built with
+        settings.PAYMENT_GATEWAY_OPTIONS, so its connection pool is shared by every payment.
+    """
+    return import_string(settings.PAYMENT_GATEWAY)(**settings.PAYMENT_GATEWAY_OPTIONS)
+
+
+class SimulatedGateway:
+    """
+        Stands in for a gateway without any network: waits between min_latency and
+        max_latency seconds and approves approval_rate of the charges.
+    """
+
+    def __init__(self, min_latency=1, max_latency=10, approval_rate=0.5):
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.approval_rate = approval_rate
+
+    def _latency(self):
+        return random.uniform(self.min_latency, self.max_latency)
+
+    def _approved(self):
+        return random.random() < self.approval_rate
+
+    def charge(self, reference, amount):
+        """
+            Charges amount for the payment identified by reference, retries with the same
+            reference must not charge again. Returns whether it was approved,
+            raises GatewayError when the outcome is unknown.
+        """
+        time.sleep(self._latency())
+        return self._approved()
+
+    async def charge_async(self, reference, amount):
+        """
+            Same as charge, for the asyncio payment executor.
+        """
+        await asyncio.sleep(self._latency())
+        return self._approved()
+
+    def charge_batch(self, charges):
+        """
+            Charges many payments in one round trip, charges maps references to amounts.
+            Returns whether each reference was approved, a reference left out has an
+            unknown outcome. Raises GatewayError when the whole batch is unknown.
+        """
+        time.sleep(self._latency())
+        return {reference: self._approved() for reference in charges}
+
+    async def charge_batch_async(self, charges):
+        await asyncio.sleep(self._latency())
+        return {reference: self._approved() for reference in charges}
+
+
+class HttpGateway:
+    """
+        Charges through a JSON over HTTP gateway: POST {"reference", "amount"} to url,
+        answered with {"status": "approved" | "declined"}. The reference doubles as
+        Idempotency-Key. Requests go through one keep-alive requests.Session whose
+        pool holds pool_size connections, with separate connect and read timeouts.
+        charge_async runs charge in a pool of as many threads, so that many calls can
+        be in flight from one event loop.
+        Batches are posted as {"charges": [...]} to batch_url, url's batch/ by default,
+        and answered with {"results": [{"reference", "status"}, ...]}.
+        Try it against the run_stub_gateway command.
+    """
+
+    def __init__(self, url, connect_timeout=2, read_timeout=15, pool_size=None, batch_url=None):
+        self.url = url
+        self.batch_url = batch_url or urllib.parse.urljoin(url, 'batch/')
+        self.timeout = (connect_timeout, read_timeout)
+        pool_size = pool_size or settings.PAYMENT_CONCURRENCY
+        self.session = requests.Session()
+        # No retries here, an unanswered charge is retried as a whole by its job
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.threads = ThreadPoolExecutor(pool_size, thread_name_prefix='gateway')
+
+    def charge(self, reference, amount):
+        try:
+            response = self.session.post(
+                self.url, json={'reference': reference, 'amount': str(amount)},
+                headers={'Idempotency-Key': reference}, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()['status'] == 'approved'
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise GatewayError(f"Charge {reference} failed: {e}") from e
+
+    async def charge_async(self, reference, amount):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.threads, self.charge, reference, amount)
+
+    def charge_batch(self, charges):
+        try:
+            response = self.session.post(
+                self.batch_url, json={'charges': [{'reference': reference, 'amount': str(amount)}
+                                                  for reference, amount in charges.items()]},
+                timeout=self.timeout)
+            response.raise_for_status()
+            results = response.json()['results']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise GatewayError(f"Batch of {len(charges)} charges failed: {e}") from e
+        # Results with another status, e.g. "error", are left out as unknown
+        return {result['reference']: result['status'] == 'approved' for result in results
+                if result.get('reference') in charges and result.get('status') in ('approved', 'declined')}
+
+    async def charge_batch_async(self, charges):
+        return await asyncio.get_running_loop().run_in_executor(self.threads, self.charge_batch, charges)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from payment.outbox import relay
+
+
+class Command(BaseCommand):
+    help = 'Queue the payment jobs written to the outbox, in batches, until stopped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            help='Jobs claimed per transaction, PAYMENT_OUTBOX_BATCH_SIZE by default.')
+        parser.add_argument('--poll-interval', type=float,
+                            help='Seconds between polls of an empty outbox, PAYMENT_OUTBOX_POLL_INTERVAL by default.')
+        parser.add_argument('--once', action='store_true',
+                            help='Return once the outbox is empty.')
+
+    def handle(self, *args, **options):
+        relay(options['batch_size'], options['poll_interval'], options['once'])
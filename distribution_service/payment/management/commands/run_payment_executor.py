@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from payment.executor import PaymentExecutor
+
+
+class Command(BaseCommand):
+    help = 'Execute payment jobs on an asyncio event loop, many at once, until stopped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue',
+                            help='RQ queue to execute, PAYMENT_QUEUE by default.')
+        parser.add_argument('--concurrency', type=int,
+                            help='Jobs in flight at once, PAYMENT_CONCURRENCY by default.')
+        parser.add_argument('--name',
+                            help='Executor name recorded on the jobs, derived from the hostname by default.')
+        parser.add_argument('--batch-size', type=int,
+                            help='Payments charged per gateway call, PAYMENT_BATCH_SIZE by default.')
+        parser.add_argument('--batch-wait', type=float,
+                            help='Seconds a batch waits to fill, PAYMENT_BATCH_WAIT by default.')
+
+    def handle(self, *args, **options):
+        PaymentExecutor(options['queue'], options['concurrency'], options['name'],
+                        options['batch_size'], options['batch_wait']).run()
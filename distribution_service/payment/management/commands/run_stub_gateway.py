@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from payment.stub_gateway import StubGatewayServer
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stub payment gateway with configurable latency and failures, for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8100)
+        parser.add_argument('--latency', type=float, default=1.0,
+                            help='Median seconds to answer a charge.')
+        parser.add_argument('--latency-sigma', type=float, default=0.5,
+                            help='Spread of the log-normal latency, larger means a longer tail.')
+        parser.add_argument('--max-latency', type=float, default=30.0,
+                            help='Seconds no answer takes longer than.')
+        parser.add_argument('--decline-rate', type=float, default=0.1,
+                            help='Share of the charges declined.')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Share of the charges answered with a 503.')
+
+    def handle(self, *args, **options):
+        server = StubGatewayServer(
+            (options['host'], options['port']), options['latency'], options['latency_sigma'],
+            options['max_latency'], options['decline_rate'], options['error_rate'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Stub gateway charging on http://{options['host']}:{options['port']}/"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0006_remove_payment_current_user_remove_payment_deleted_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('payment', models.ForeignKey(help_text='The payment to process.', on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='payment.payment')),
+            ],
+        ),
+    ]
@@ -42,3 +42,19 @@ class Payment(Meta):
     @classmethod
     def get_average_processing_time(cls):
         return cls.objects.annotate(avg_value=models.F('processing_time_seconds')).aggregate(models.Avg('avg_value'))
+
+
+class PaymentOutbox(models.Model):
+    """
+    Transactional outbox of payment jobs: a row is written in the same transaction as
+    its Payment, so a job exists if and only if the payment was committed. The relay
+    (see payment.outbox) moves committed rows to the payment queue in batches and
+    deletes them. The table only holds jobs not dispatched yet.
+    """
+    payment = models.ForeignKey(
+        Payment, related_name='outbox', on_delete=models.CASCADE,
+        help_text="The payment to process.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'outbox entry for payment {self.payment_id}'
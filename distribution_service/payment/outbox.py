@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.db import transaction
+import django_rq
+import logging
+import time
+
+from payment.api.views import payment_job_data
+from payment.models import PaymentOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def relay_batch(batch_size=None):
+    """
+        Claims up to batch_size committed outbox entries, queues their payment jobs
+        in one pipelined round trip and deletes them, all in one transaction.
+        Entries are locked FOR UPDATE SKIP LOCKED so concurrent relays share the work.
+        Should Redis fail the transaction rolls back and the entries are claimed again;
+        should the commit fail after queuing, the jobs are queued again under the same
+        job ids and the worker skips payments no longer pending.
+        Returns the number of jobs queued.
+    """
+    batch_size = batch_size or settings.PAYMENT_OUTBOX_BATCH_SIZE
+    with transaction.atomic():
+        entries = list(PaymentOutbox.objects.select_for_update(skip_locked=True, of=('self',))
+                       .order_by('id')
+                       .values_list('id', 'payment_id', 'payment__order_id', 'payment__order__order_number')
+                       [:batch_size])
+        if not entries:
+            return 0
+        django_rq.get_queue(settings.PAYMENT_QUEUE).enqueue_many([
+            payment_job_data(payment_id, order_id, order_number)
+            for _, payment_id, order_id, order_number in entries])
+        PaymentOutbox.objects.filter(id__in=[entry[0] for entry in entries]).delete()
+    logger.info(f"Relayed {len(entries)} payment jobs")
+    return len(entries)
+
+
+def relay(batch_size=None, poll_interval=None, once=False):
+    """
+        Relays the outbox until stopped: batch after batch while entries are waiting,
+        polling every poll_interval seconds once it is empty. Returns when empty if once.
+    """
+    batch_size = batch_size or settings.PAYMENT_OUTBOX_BATCH_SIZE
+    poll_interval = settings.PAYMENT_OUTBOX_POLL_INTERVAL if poll_interval is None else poll_interval
+    while True:
+        try:
+            relayed = relay_batch(batch_size)
+        except Exception as e:
+            if once:
+                raise
+            # Redis or the database is down, the entries wait for the next attempt
+            logger.error(f"Relaying payment jobs failed: {e}")
+            relayed = 0
+        if relayed < batch_size:
+            if once:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,10 @@
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from payment.gateway import get_gateway
+
+
+@receiver(setting_changed)
+def reset_gateway(setting, **kwargs):
+    if setting in ('PAYMENT_GATEWAY', 'PAYMENT_GATEWAY_OPTIONS'):
+        get_gateway.cache_clear()
@@ -0,0 +1,77 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import math
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    """
+        Answers the charges of payment.gateway.HttpGateway like a slow real gateway.
+        Latencies follow a log-normal distribution, median latency seconds with
+        latency_sigma spread (long tail), capped at max_latency. error_rate of the
+        charges get a 503, the others are declined at decline_rate.
+        A reference seen before gets its first answer back, like an idempotent gateway.
+        POSTs to batch/ charge {"charges": [...]} at once, for HttpGateway.charge_batch.
+    """
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_POST(self):
+        server = self.server
+        batch = self.path.rstrip('/').endswith('/batch')
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            references = [charge['reference'] for charge in body['charges']] if batch else [body['reference']]
+        except (ValueError, KeyError, TypeError):
+            return self._reply(400, {'detail': 'Invalid charge.'})
+
+        # A batch waits on the gateway once, like a single charge
+        time.sleep(min(server.latency * math.exp(random.gauss(0, server.latency_sigma)),
+                       server.max_latency))
+        if random.random() < server.error_rate:
+            return self._reply(503, {'detail': 'Gateway unavailable.'})
+        with server.lock:
+            results = [{'reference': reference, 'status': server.outcomes.setdefault(
+                reference, 'declined' if random.random() < server.decline_rate else 'approved')}
+                for reference in references]
+        self._reply(200, {'results': results} if batch else results[0])
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and went away, like it would from a real gateway
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class StubGatewayServer(ThreadingHTTPServer):
+    """
+        Local stand-in for a payment gateway, one thread per connection,
+        see StubGatewayHandler for the options.
+    """
+    daemon_threads = True
+    # Bursts of new connections from a cold client pool must not overflow the listen backlog
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=1.0, latency_sigma=0.5, max_latency=30.0,
+                 decline_rate=0.1, error_rate=0.0):
+        super().__init__(address, StubGatewayHandler)
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.max_latency = max_latency
+        self.decline_rate = decline_rate
+        self.error_rate = error_rate
+        self.outcomes = {}
+        self.lock = threading.Lock()
@@ -1,11 +1,26 @@
+from decimal import Decimal
+from unittest import mock
+import asyncio
+import fakeredis
+import threading
+import time
+from django.conf import settings
 from django.urls import reverse
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework import status
+from rq import Queue
+from rq.scheduler import RQScheduler
 
 from order.models import Order
-from payment.models import Payment
+from payment.api.views import process_payment, update_order_and_payment, update_orders_and_payments, \
+    payment_job_data
+from payment.executor import PaymentExecutor, process_payment_async
+from payment.gateway import HttpGateway, GatewayError
+from payment.models import Payment, PaymentOutbox
+from payment.outbox import relay_batch
+from payment.stub_gateway import StubGatewayServer
 
 
 class GetAllPaymentsTestCase(TestCase):
@@ -25,17 +40,30 @@ class GetAllPaymentsTestCase(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         # Assuming there are payments in the database
-        self.assertTrue(len(response.data) > 0)
+        self.assertTrue(len(response.data['results']) > 0)
 
     def test_get_payments_user(self):
         self.client.force_authenticate(user=self.user)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         # Check that the user can only see their payments
-        for payment in response.data:
+        for payment in response.data['results']:
             self.assertEqual(payment['order']['created_by'], self.user.id)
 
 
+    def test_get_payments_paginated(self):
+        for number in range(2000, 2004):
+            order = Order.objects.create(
+                order_number=number, created_by=self.user)
+            Payment.objects.create(order=order, amount=1.00)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.url, {'page_size': 3})
+        self.assertEqual(len(response.data['results']), 3)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['next'])
+
+
 class GetPaymentDetailsTestCase(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -61,3 +89,231 @@ class GetPaymentDetailsTestCase(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['payment_id'], self.payment.payment_id)
+
+
+class ProcessPaymentTestCase(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(order_number=7001, total=9.99)
+        self.payment = Payment.objects.create(order=self.order, amount=9.99, payment_status='PENDING')
+
+    def test_outcome_written_once(self):
+        with self.assertNumQueries(4):
+            self.assertTrue(update_order_and_payment(self.payment.id, self.order.id, 'successful', time.time()))
+        # A duplicate job finds the payment no longer pending
+        self.assertFalse(update_order_and_payment(self.payment.id, self.order.id, 'faild', time.time()))
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual((self.payment.payment_status, self.order.status), ('successful', 'paid'))
+
+    @mock.patch('payment.api.views.get_gateway')
+    def test_processed_payment_is_not_charged_again(self, get_gateway):
+        Payment.objects.filter(id=self.payment.id).update(payment_status='faild')
+        self.assertIsNone(process_payment(self.payment.id, self.order.id, self.order.order_number))
+        get_gateway.return_value.charge.assert_not_called()
+
+    @override_settings(PAYMENT_GATEWAY_OPTIONS={'min_latency': 0, 'max_latency': 0, 'approval_rate': 1})
+    def test_approved_payment(self):
+        self.assertTrue(process_payment(self.payment.id, self.order.id, self.order.order_number))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+
+    @mock.patch('payment.api.views.get_gateway')
+    def test_unknown_outcome_keeps_payment_pending(self, get_gateway):
+        get_gateway.return_value.charge.side_effect = GatewayError
+        with self.assertRaises(GatewayError):
+            process_payment(self.payment.id, self.order.id, self.order.order_number)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.payment_status, 'PENDING')
+
+    def test_outcomes_written_in_bulk(self):
+        declined = Payment.objects.create(order=Order.objects.create(order_number=7002), amount=1)
+        processed = Payment.objects.create(order=Order.objects.create(order_number=7003), amount=1,
+                                           payment_status='faild')
+        outcomes = {self.payment.id: True, declined.id: False, processed.id: True}
+        # SAVEPOINT, lock pending payments, bulk_update, orders, RELEASE SAVEPOINT
+        with self.assertNumQueries(5):
+            written = update_orders_and_payments(outcomes, time.time())
+        self.assertEqual(sorted(written), sorted([self.payment.id, declined.id]))
+        self.assertEqual(
+            dict(Payment.objects.values_list('id', 'payment_status')),
+            {self.payment.id: 'successful', declined.id: 'faild', processed.id: 'faild'})
+        self.assertEqual(list(Order.objects.filter(status='paid')), [self.order])
+
+
+class PaymentOutboxRelayTestCase(TestCase):
+    # SAVEPOINT, claim entries, delete entries, RELEASE SAVEPOINT
+    QUERY_BUDGET = 4
+
+    def setUp(self):
+        self.payments = []
+        for number in range(8001, 8006):
+            order = Order.objects.create(order_number=number)
+            self.payments.append(Payment.objects.create(order=order, amount=1))
+        PaymentOutbox.objects.bulk_create([PaymentOutbox(payment=payment) for payment in self.payments])
+
+    @mock.patch('payment.outbox.django_rq.get_queue')
+    def test_relays_in_batches(self, get_queue):
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.assertEqual(relay_batch(batch_size=3), 3)
+        self.assertEqual(relay_batch(batch_size=3), 2)
+        self.assertEqual(relay_batch(batch_size=3), 0)
+
+        enqueue_many = get_queue.return_value.enqueue_many
+        self.assertEqual(enqueue_many.call_count, 2)
+        jobs = [job for call in enqueue_many.call_args_list for job in call.args[0]]
+        self.assertEqual([job.args for job in jobs],
+                         [(payment.id, payment.order_id, payment.order.order_number)
+                          for payment in self.payments])
+        self.assertEqual(jobs[0].job_id, f'payment-{self.payments[0].id}')
+        self.assertFalse(PaymentOutbox.objects.exists())
+
+    @mock.patch('payment.outbox.django_rq.get_queue')
+    def test_entries_kept_when_redis_fails(self, get_queue):
+        get_queue.return_value.enqueue_many.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            relay_batch()
+        self.assertEqual(PaymentOutbox.objects.count(), 5)
+
+
+class HttpGatewayTestCase(TestCase):
+    def start_gateway(self, **options):
+        server = StubGatewayServer(('127.0.0.1', 0), **{'latency': 0.01, 'latency_sigma': 0, **options})
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return HttpGateway(f'http://127.0.0.1:{server.server_address[1]}/',
+                           connect_timeout=1, read_timeout=1, pool_size=50)
+
+    def test_approved_and_declined(self):
+        self.assertTrue(self.start_gateway(decline_rate=0).charge('payment-1', Decimal('9.99')))
+        self.assertFalse(self.start_gateway(decline_rate=1).charge('payment-1', Decimal('9.99')))
+
+    def test_retried_charge_gets_the_first_outcome(self):
+        gateway = self.start_gateway(decline_rate=0.5)
+        outcome = gateway.charge('payment-1', 1)
+        self.assertEqual({gateway.charge('payment-1', 1) for _ in range(10)}, {outcome})
+
+    def test_unknown_outcome(self):
+        with self.assertRaises(GatewayError):
+            self.start_gateway(error_rate=1).charge('payment-1', 1)
+        with self.assertRaises(GatewayError):
+            self.start_gateway(latency=2).charge('payment-1', 1)
+
+    def test_charges_share_pooled_connections(self):
+        gateway = self.start_gateway(latency=0.3, decline_rate=0)
+
+        async def run():
+            return await asyncio.gather(*(gateway.charge_async(f'payment-{i}', 1) for i in range(50)))
+
+        start = time.time()
+        self.assertTrue(all(asyncio.run(run())))
+        self.assertLess(time.time() - start, 2)
+
+    def test_batch_charge(self):
+        charges = {f'payment-{i}': Decimal('9.99') for i in range(20)}
+        self.assertEqual(self.start_gateway(decline_rate=0).charge_batch(charges),
+                         dict.fromkeys(charges, True))
+        with self.assertRaises(GatewayError):
+            self.start_gateway(error_rate=1).charge_batch(charges)
+
+
+@mock.patch('payment.executor.get_pending_amount', return_value=Decimal('9.99'))
+@mock.patch('payment.executor.update_order_and_payment')
+@override_settings(PAYMENT_GATEWAY_OPTIONS={'min_latency': 1, 'max_latency': 1})
+class PaymentExecutorTestCase(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(order_number=7001)
+        self.payment = Payment.objects.create(order=self.order, amount=9.99)
+        with mock.patch('payment.executor.django_rq.get_queue'):
+            self.executor = PaymentExecutor(concurrency=10, batch_size=1)
+
+    def test_payments_wait_on_the_gateway_together(self, *_):
+        async def run():
+            return await asyncio.gather(*(process_payment_async(self.payment.id, self.order.id, 7001)
+                                          for _ in range(200)))
+
+        start = time.time()
+        asyncio.run(run())
+        # 200 one second gateway calls in little more than a second
+        self.assertLess(time.time() - start, 3)
+
+    def test_payment_job_runs_on_the_event_loop(self, update, _):
+        job = mock.Mock(func=process_payment, args=(self.payment.id, self.order.id, 7001),
+                        kwargs={}, timeout=60)
+        with mock.patch.object(self.executor, '_finish') as finish:
+            asyncio.run(self.executor._perform(job))
+        finish.assert_called_once_with(job)
+        self.assertEqual(update.call_args.args[:3], (self.payment.id, self.order.id, mock.ANY))
+
+    def test_failed_job_is_recorded(self, *_):
+        job = mock.Mock(func=mock.Mock(side_effect=RuntimeError("gateway down")),
+                        args=(), kwargs={}, timeout=60)
+        with mock.patch.object(self.executor, '_finish') as finish:
+            asyncio.run(self.executor._perform(job))
+        self.assertIn("gateway down", finish.call_args.args[1])
+
+
+@mock.patch('payment.executor.update_orders_and_payments')
+@override_settings(PAYMENT_GATEWAY_OPTIONS={'min_latency': 1, 'max_latency': 1, 'approval_rate': 1})
+class PaymentBatchTestCase(TestCase):
+    def setUp(self):
+        with mock.patch('payment.executor.django_rq.get_queue'):
+            self.executor = PaymentExecutor(concurrency=100, batch_size=10, batch_wait=0.05)
+
+    def perform(self, payment_ids):
+        jobs = [mock.Mock(func=process_payment, args=(payment_id, payment_id, payment_id),
+                          kwargs={}, timeout=60) for payment_id in payment_ids]
+
+        async def run():
+            await asyncio.gather(*(self.executor._perform(job) for job in jobs))
+
+        with mock.patch.object(self.executor, '_finish') as finish:
+            asyncio.run(run())
+        return finish
+
+    def test_payments_share_gateway_calls(self, update):
+        with mock.patch('payment.executor.get_pending_amounts',
+                        side_effect=lambda ids: dict.fromkeys(ids, Decimal('1'))):
+            start = time.time()
+            finish = self.perform(range(1, 26))
+        # 25 one second charges in 3 batches, all in flight together
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(update.call_count, 3)
+        self.assertEqual(sum(len(call.args[0]) for call in update.call_args_list), 25)
+        self.assertEqual(finish.call_count, 25)
+        self.assertTrue(all(len(call.args) == 1 for call in finish.call_args_list))
+
+    @mock.patch('payment.executor.get_pending_amounts', return_value={1: Decimal('1'), 2: Decimal('1')})
+    def test_payments_without_outcome_fail(self, _, update):
+        with mock.patch('payment.gateway.SimulatedGateway.charge_batch_async',
+                        return_value={'payment-1': True}):
+            finish = self.perform([1, 2, 3])
+        update.assert_called_once_with({1: True}, mock.ANY)
+        failed = [call.args[0].args[0] for call in finish.call_args_list if len(call.args) == 2]
+        # 3 was already processed, 2 stays PENDING for its job to be retried
+        self.assertEqual(failed, [2])
+
+
+class PaymentRetryTestCase(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        self.queue = Queue(settings.PAYMENT_QUEUE, connection=self.redis)
+        with mock.patch('payment.executor.django_rq.get_queue', return_value=self.queue):
+            self.executor = PaymentExecutor(concurrency=1, batch_size=1)
+
+    @override_settings(PAYMENT_RETRY_INTERVALS=[10])
+    def test_failed_payment_job_is_retried(self):
+        self.queue.enqueue_many([payment_job_data(1, 1, 7001)])
+        job = self.executor._dequeue()
+        self.executor._finish(job, "GatewayError: gateway down")
+        self.assertEqual(self.queue.scheduled_job_registry.get_job_ids(), [job.id])
+        self.assertEqual(self.queue.failed_job_registry.count, 0)
+
+        # Moved back to the queue once its retry interval is over
+        scheduler = RQScheduler([self.queue.name], connection=self.redis)
+        with mock.patch('rq.scheduler.current_timestamp', return_value=int(time.time()) + 10):
+            self.executor._enqueue_scheduled(scheduler)
+        job = self.executor._dequeue()
+        self.assertEqual(job.retries_left, 0)
+        self.executor._finish(job, "GatewayError: gateway down")
+        self.assertEqual(self.queue.failed_job_registry.get_job_ids(), [job.id])
@@ -4,8 +4,11 @@ from rest_framework.permissions import IsAdminUser
 from rest_framework import status
 
 from drf_spectacular.utils import extend_schema
+from django.conf import settings
 
 
+from helper.cache import get_or_set
+from helper.pagination import KeysetPagination, paginated
 from payment.models import Payment, Order
 from statistic.api.serializers import TotalOrdersSerializer, TotalOrdersByFlavorSerializer, \
     AvgOrderValueSerializer, FaildPaymentsSerializer, AvgProcessingTimeSerializer, \
@@ -13,6 +16,13 @@ from statistic.api.serializers import TotalOrdersSerializer, TotalOrdersByFlavor
 from statistic.models import EndpointPerformance
 
 
+def _cached_statistic(name, compute):
+    # Aggregates over whole tables, recomputed by one worker at a time and served stale meanwhile.
+    return get_or_set(f'statistic:{name}', compute,
+                      timeout=settings.STATISTICS_CACHE_TIMEOUT,
+                      stale_timeout=settings.STATISTICS_CACHE_STALE_TIMEOUT)
+
+
 @extend_schema(
     request=None,
     responses={status.HTTP_200_OK: TotalOrdersSerializer},
@@ -23,7 +33,7 @@ def total_orders(request):
     """
     Allows admin users, allowing them to retrieve the total number of orders placed within the system.
     """
-    total_orders = Order.get_total_orders()
+    total_orders = _cached_statistic('total_orders', Order.get_total_orders)
 
     serializer = TotalOrdersSerializer(data={"total_orders": total_orders})
     if serializer.is_valid():
@@ -41,7 +51,8 @@ def orders_by_flavor(request, flavor):
     """
     Allows admin users to retrieve the total number of orders for a specific ice cream flavor.
     """
-    total_orders = Order.get_orders_by_flavor(flavor)
+    total_orders = _cached_statistic(
+        f'orders_by_flavor:{flavor}', lambda: Order.get_orders_by_flavor(flavor))
     serializer = TotalOrdersByFlavorSerializer(
         data={"total_orders": total_orders})
     if serializer.is_valid():
@@ -61,7 +72,8 @@ def average_order_value(request):
     Computes and returns the average value of all orders.
     Admin user only.
     """
-    avg_value = Order.get_average_order_value()
+    avg_value = _cached_statistic(
+        'average_order_value', Order.get_average_order_value)
     serializer = AvgOrderValueSerializer(
         data={"average_order_value": avg_value})
     if serializer.is_valid():
@@ -82,7 +94,8 @@ def successful_payments(request):
     Admin user only.
     """
 
-    successful_payments = Payment.get_successful_payments()
+    successful_payments = _cached_statistic(
+        'successful_payments', Payment.get_successful_payments)
     serializer = SuccessfulPaymentsSerializer(
         data={"successful_payments": successful_payments})
     if serializer.is_valid():
@@ -102,7 +115,8 @@ def failed_payments(request):
     Retrieve the total count of faild payment transactions.
     Admin user only.
     """
-    failed_payments = Payment.get_failed_payments()
+    failed_payments = _cached_statistic(
+        'failed_payments', Payment.get_failed_payments)
     serializer = FaildPaymentsSerializer(
         data={"failed_payments": failed_payments})
     if serializer.is_valid():
@@ -122,7 +136,8 @@ def average_processing_time(request):
      Provide the functionality to retrieve the average processing time of payment transactions.
      Admin use only.
     """
-    avg_value = Payment.get_average_processing_time()
+    avg_value = _cached_statistic(
+        'average_processing_time', Payment.get_average_processing_time)
     serializer = AvgProcessingTimeSerializer(
         data={"average_processing_time": avg_value})
     if serializer.is_valid():
@@ -134,7 +149,7 @@ def average_processing_time(request):
 @extend_schema(
     request=None,
     responses={
-        status.HTTP_200_OK: StatisticEndpointPerformanceSerializer(many=True)},
+        status.HTTP_200_OK: paginated(StatisticEndpointPerformanceSerializer)},
 )
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
@@ -142,8 +157,11 @@ def endpoints_performance(request):
     """
     Providing a comprehensive overview of the performance metrics across various endpoints. 
     Admin user only.
+    Results are paginated newest first, follow the "next" link (cursor) for older records.
     """
-    data = EndpointPerformance.objects.all()
-    serializer = StatisticEndpointPerformanceSerializer(data, many=True)
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(
+        EndpointPerformance.objects.all(), request)
+    serializer = StatisticEndpointPerformanceSerializer(page, many=True)
 
-    return Response(serializer.data)
+    return paginator.get_paginated_response(serializer.data)
@@ -1,13 +1,24 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from unittest import mock
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth.models import User
 
+from statistic.models import EndpointPerformance
 
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
 class TotalOrdersTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.admin_user = User.objects.create_superuser(
             'admin', 'admin@test.com', 'password')
@@ -26,8 +37,10 @@ class TotalOrdersTestCase(TestCase):
         self.assertEqual(response.data['total_orders'], 5)
 
 
+@override_settings(CACHES=LOCMEM_CACHES)
 class OrdersByFlavorTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.admin_user = User.objects.create_superuser(
             'admin', 'admin@test.com', 'password')
@@ -46,8 +59,10 @@ class OrdersByFlavorTestCase(TestCase):
         self.assertEqual(response.data['total_orders'], 5)
 
 
+@override_settings(CACHES=LOCMEM_CACHES)
 class AverageOrderValueTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.admin_user = User.objects.create_superuser(
             'admin', 'admin@test.com', 'password')
@@ -67,8 +82,10 @@ class AverageOrderValueTestCase(TestCase):
         self.assertEqual(response.data['average_order_value'], 100.00)
 
 
+@override_settings(CACHES=LOCMEM_CACHES)
 class SuccessfulPaymentsTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.admin_user = User.objects.create_superuser(
             'admin', 'admin@test.com', 'password')
@@ -88,8 +105,10 @@ class SuccessfulPaymentsTestCase(TestCase):
         self.assertEqual(response.data['successful_payments'], 150)
 
 
+@override_settings(CACHES=LOCMEM_CACHES)
 class FailedPaymentsTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.admin_user = User.objects.create_superuser(
             'admin', 'admin@test.com', 'password')
@@ -109,8 +128,10 @@ class FailedPaymentsTestCase(TestCase):
         self.assertEqual(response.data['failed_payments'], 50)
 
 
+@override_settings(CACHES=LOCMEM_CACHES)
 class AverageProcessingTimeTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.admin_user = User.objects.create_superuser(
             'admin', 'admin@test.com', 'password')
@@ -128,3 +149,45 @@ class AverageProcessingTimeTestCase(TestCase):
         # Assert the status code and the average processing time
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['average_processing_time'], 120)
+
+
+class EndpointsPerformanceTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = User.objects.create_superuser(
+            'admin', 'admin@test.com', 'password')
+        self.client.force_authenticate(user=self.admin_user)
+        for i in range(3):
+            EndpointPerformance.objects.create(
+                endpoint=f'/api/test/{i}/', response_time=0.1)
+
+    def test_endpoints_performance_newest_first(self):
+        url = reverse('endpoints_performance')
+
+        response = self.client.get(url, {'page_size': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['endpoint'] for row in response.data['results']],
+                         ['/api/test/2/', '/api/test/1/'])
+        self.assertIsNotNone(response.data['next'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedStatisticsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin_user = User.objects.create_superuser(
+            'admin', 'admin@test.com', 'password')
+        self.client.force_authenticate(user=self.admin_user)
+
+    @mock.patch('order.models.Order.get_total_orders')
+    def test_total_orders_computed_once(self, mock_get_total_orders):
+        mock_get_total_orders.return_value = 5
+        url = reverse('total_orders')
+
+        self.client.get(url)
+        response = self.client.get(url)
+
+        self.assertEqual(response.data['total_orders'], 5)
+        mock_get_total_orders.assert_called_once()
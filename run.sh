@@ -3,8 +3,14 @@
 python manage.py makemigrations
 python manage.py migrate --no-input
 python manage.py collectstatic --no-input
-# Start RQ worker
-python manage.py rqworker default &
+# Start RQ worker, its scheduler runs the recurring jobs
+python manage.py rqworker default --with-scheduler &
+# (Re)start the recurring jobs, replacing any run still pending from the last deploy
+python manage.py cleanup_carts --schedule
+python manage.py reconcile_stock --schedule
+# Start the payment outbox relay and executor, many payments in flight in one process
+python manage.py relay_payments &
+python manage.py run_payment_executor &
 
 # Start Gunicorn server
 gunicorn frozen_dessert.wsgi:application --bind 0.0.0.0:8000